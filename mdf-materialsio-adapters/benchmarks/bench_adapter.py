@@ -0,0 +1,69 @@
+"""Compare the projection used by the MDF adapters to the translate_json call it replaced
+
+Usage: python bench_adapter.py [--atoms 500] [--repeats 200]
+"""
+
+from mdf_matio.adapters.generic import GenericMDFAdapter
+from mdf_toolbox import translate_json
+from argparse import ArgumentParser
+from timeit import repeat
+import random
+
+
+def make_crystal_structure(n_atoms: int, seed: int = 1) -> dict:
+    """Make metadata resembling the output of the crystal structure parser
+
+    Args:
+        n_atoms (int): Number of atoms in the structure
+        seed (int): Random seed
+    Returns:
+        (dict) Metadata, including fields that are not in the MDF schema
+    """
+    rng = random.Random(seed)
+    return {
+        'material': {'composition': 'Al250Ni250', 'elements': ['Al', 'Ni']},
+        'crystal_structure': {'space_group_number': 221, 'number_of_atoms': float(n_atoms),
+                              'volume': rng.random() * 1000, 'stoichiometry': 'AB'},
+        'sites': [{'species': rng.choice(['Al', 'Ni']), 'xyz': [rng.random() for _ in range(3)],
+                   'label': str(i), 'properties': {}} for i in range(n_atoms)],
+        'lattice': {'matrix': [[rng.random() for _ in range(3)] for _ in range(3)],
+                    'pbc': [True, True, True]},
+        'charge': None,
+    }
+
+
+def make_image(seed: int = 1) -> dict:
+    """Make metadata resembling the output of the image parser
+
+    Args:
+        seed (int): Random seed
+    Returns:
+        (dict) Metadata, including fields that are not in the MDF schema
+    """
+    rng = random.Random(seed)
+    return {
+        'image': {'shape': [1024, 1024, 3], 'color_depth': 8, 'format': 'PNG',
+                  'megapixels': 1.05, 'dpi': None},
+        'exif': dict((f'tag_{i}', rng.random()) for i in range(200)),
+        'histogram': [rng.randrange(1024) for _ in range(768)],
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--atoms', type=int, default=500, help='Number of atoms per structure')
+    parser.add_argument('--repeats', type=int, default=200, help='Number of timing repeats')
+    args = parser.parse_args()
+
+    adapter = GenericMDFAdapter()
+    for label, metadata in [('crystal_structure', make_crystal_structure(args.atoms)),
+                            ('image', make_image())]:
+        legacy = translate_json(metadata, adapter.automap, na_values=[[], {}, None])
+        assert legacy == adapter.transform(metadata)
+
+        print(f'{label}:')
+        for name, func in [('translate_json', lambda: translate_json(
+                                metadata, adapter.automap, na_values=[[], {}, None])),
+                           ('projection', lambda: adapter.transform(metadata))]:
+            best = min(repeat(func, number=1, repeat=args.repeats))
+            print(f'{name:>17}: {best * 1e6:.1f} us')
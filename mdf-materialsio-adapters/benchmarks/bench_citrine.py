@@ -0,0 +1,85 @@
+"""Compare the direct PIF field extraction of the DFT adapter to deserializing the whole PIF
+
+Usage: python bench_citrine.py [--pifs 200] [--repeats 5]
+"""
+
+from mdf_matio.adapters.citrine import PIFDFTAdapter
+from pypif_sdk.interop.mdf import _to_user_defined as pif_to_feedstock
+from argparse import ArgumentParser
+from mdf_toolbox import dict_merge
+from pypif.pif import loado
+from timeit import repeat
+from copy import deepcopy
+import random
+import json
+import os
+
+example = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data', 'pifdft.json')
+
+
+def make_corpus(n_pifs: int, seed: int = 1) -> list:
+    """Make PIFs resembling the output of the VASP parser, from the example in the tests
+
+    Args:
+        n_pifs (int): Number of PIFs
+        seed (int): Random seed
+    Returns:
+        ([dict]) PIFs with different values for each property
+    """
+    rng = random.Random(seed)
+    with open(example) as fp:
+        base = json.load(fp)
+    corpus = []
+    for _ in range(n_pifs):
+        pif = deepcopy(base)
+        for prop in pif['properties']:
+            for scalar in prop.get('scalars', []):
+                if isinstance(scalar.get('value'), float):
+                    scalar['value'] *= rng.random()
+        pif['properties'].append({'name': 'Space group number', 'scalars': [{'value': 221}]})
+        corpus.append(pif)
+    return corpus
+
+
+def legacy(adapter: PIFDFTAdapter, pif: dict) -> dict:
+    """Build the translation table, deserialize and flatten the PIF, as the adapter used to"""
+    translations = dict_merge(
+        {'material': {'elemental_proportion': ('elemental_proportions', dict)}},
+        {"dft": {"Converged": ("converged", bool),
+                 "XC_Functional": ("exchange_correlation_functional", str),
+                 "Cutoff_Energy_eV": ("cutoff_energy", float)},
+         "crystal_structure": {"Space_group_number": ("space_group_number", int),
+                               "Number_of_atoms_in_unit_cell": ("number_of_atoms", float),
+                               "Unit_cell_volume_AA_3": ("volume", float)}})
+    flat = pif_to_feedstock(loado(pif))
+    record = {}
+    for block, mapping in translations.items():
+        new_block = {}
+        for pif_field, (mdf_field, translator) in mapping.items():
+            if pif_field in flat:
+                new_block[mdf_field] = translator(flat[pif_field])
+        if new_block:
+            record[block] = new_block
+    software = pif['properties'][0]['methods'][0]['software'][0]
+    record['origin'] = {'type': 'computation', 'name': software['name']}
+    if 'version' in software:
+        record['origin']['version'] = software['version']
+    return record
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pifs', type=int, default=200, help='Number of PIFs in the corpus')
+    parser.add_argument('--repeats', type=int, default=5, help='Number of timing repeats')
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.pifs)
+    adapter = PIFDFTAdapter()
+    for pif in corpus:
+        assert legacy(adapter, pif) == adapter.transform(pif)
+
+    print(f'{args.pifs} PIFs')
+    for name, func in [('loado + flatten', lambda: [legacy(adapter, x) for x in corpus]),
+                       ('direct', lambda: [adapter.transform(x) for x in corpus])]:
+        best = min(repeat(func, number=1, repeat=args.repeats))
+        print(f'{name:>17}: {best / args.pifs * 1e6:.1f} us per PIF')
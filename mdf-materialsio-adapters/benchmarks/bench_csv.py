@@ -0,0 +1,66 @@
+"""Compare the template-based CSV adapter to mapping each row one value at a time
+
+Usage: python bench_csv.py [--rows 100000] [--repeats 5]
+"""
+
+from mdf_matio.adapters.mappable import CSVAdapter, _add_value
+from argparse import ArgumentParser
+from timeit import repeat
+import random
+
+mapping = {'material.composition': 'composition', 'crystal_structure.volume': 'volume',
+           'crystal_structure.space_group_number': 'space_group',
+           'dft.converged': 'converged', 'origin.name': 'code'}
+
+
+def make_rows(n_rows: int, seed: int = 1) -> list:
+    """Make the rows of a CSV file, as output by the parser
+
+    Args:
+        n_rows (int): Number of rows
+        seed (int): Random seed
+    Returns:
+        ([dict]) Rows, with some mapped columns missing and some unmapped columns
+    """
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n_rows):
+        row = {'composition': rng.choice(['NaCl', 'KCl', 'LiFePO4']), 'volume': rng.random(),
+               'space_group': rng.randrange(1, 231), 'converged': True, 'id': i,
+               'notes': 'none'}
+        if i % 10 == 0:
+            del row['volume']
+        rows.append(row)
+    return rows
+
+
+def legacy(rows: list) -> list:
+    """Map each row as the adapter used to"""
+    col_to_mdf = dict((y, x.split('.')) for x, y in mapping.items())
+    sub_records = []
+    for record in rows:
+        new_record = {}
+        for col, key in col_to_mdf.items():
+            if col in record:
+                _add_value(new_record, key, record[col])
+        if len(new_record) > 0:
+            sub_records.append(new_record)
+    return sub_records
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=100000, help='Number of rows')
+    parser.add_argument('--repeats', type=int, default=5, help='Number of timing repeats')
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    adapter = CSVAdapter()
+    assert legacy(rows) == adapter.transform({'records': rows}, {'mapping': mapping})
+
+    print(f'{args.rows} rows')
+    for name, func in [('row by row', lambda: legacy(rows)),
+                       ('template', lambda: adapter.transform({'records': rows},
+                                                              {'mapping': mapping}))]:
+        best = min(repeat(func, number=1, repeat=args.repeats))
+        print(f'{name:>17}: {best * 1e3:.1f} ms')
@@ -0,0 +1,75 @@
+"""Measure how the grouping functions scale with the number of parse results
+
+Records are grouped either in a directory tree, with groups of a few records, or in
+a single group linked by a chain of shared files.
+
+Usage: python bench_grouping.py [--sizes 1000 10000 100000]
+"""
+
+from mdf_matio.grouping import groupby_file
+from materials_io.utils.interface import ParseResult
+from argparse import ArgumentParser
+from time import perf_counter
+import random
+import os
+
+
+def make_records(n: int, seed: int = 1):
+    """Make synthetic parse results in a directory tree
+
+    Each record references 1-3 files from its own directory, so that roughly
+    half of the records share a file with another record
+
+    Args:
+        n (int): Number of records
+        seed (int): Random seed
+    Returns:
+        ([ParseResult]) Synthetic records
+    """
+    rng = random.Random(seed)
+    records = []
+    for i in range(n):
+        directory = os.path.join('data', str(i // 50))
+        files = tuple(os.path.join(directory, f'{rng.randrange(60)}.dat')
+                      for _ in range(rng.randint(1, 3)))
+        records.append(ParseResult(files, 'fake', {}))
+    return records
+
+
+def make_chain(n: int, seed: int = 1):
+    """Make synthetic parse results that form a single group
+
+    Each record shares one file with the next one in the chain, so that all records are
+    linked only through a chain of shared files. Records are in random order
+
+    Args:
+        n (int): Number of records
+        seed (int): Random seed
+    Returns:
+        ([ParseResult]) Synthetic records
+    """
+    records = [ParseResult((f'{i}.dat', f'{i + 1}.dat'), 'fake', {}) for i in range(n)]
+    random.Random(seed).shuffle(records)
+    return records
+
+
+def _time_grouping(label: str, n: int, records):
+    start = perf_counter()
+    n_groups = sum(1 for _ in groupby_file(records))
+    elapsed = perf_counter() - start
+    print(f'{label:>8} {n:>10} {n_groups:>8} {elapsed:>10.3f} {elapsed / n * 1e6:>10.2f}')
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[1000, 3000, 10000, 30000, 100000, 300000])
+    args = parser.parse_args()
+
+    print(f'{"case":>8} {"records":>10} {"groups":>8} {"time (s)":>10} {"us/record":>10}')
+    for n in args.sizes:
+        _time_grouping('tree', n, make_records(n))
+
+    # One large group, where the cost of ordering the records within a group shows
+    for n in args.sizes:
+        _time_grouping('chain', n, make_chain(n))
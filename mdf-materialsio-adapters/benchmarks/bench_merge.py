@@ -0,0 +1,50 @@
+"""Compare merging the records of a large directory group to folding dict_merge over them
+
+Usage: python bench_merge.py [--files 2000] [--repeats 3]
+"""
+
+from mdf_matio.merging import merge_metadata
+from mdf_toolbox import dict_merge
+from functools import reduce, partial
+from argparse import ArgumentParser
+from timeit import repeat
+
+
+def make_records(n_files: int) -> list:
+    """Make the records of the files in a directory, as produced by the generic and
+    crystal structure adapters
+
+    Args:
+        n_files (int): Number of files in the directory
+    Returns:
+        ([dict]) One record per file
+    """
+    records = []
+    for i in range(n_files):
+        record = {'files': [{'filename': f'{i}.cif', 'path': f'calc/{i}.cif', 'length': i,
+                             'data_type': 'ASCII text'}]}
+        if i % 2 == 0:
+            record['material'] = {'composition': 'AlNi', 'elements': ['Al', 'Ni']}
+            record['crystal_structure'] = {'number_of_atoms': 2.0, 'volume': float(i)}
+        records.append(record)
+    return records
+
+
+def legacy(records: list) -> dict:
+    """Fold dict_merge over the records, as _merge_records used to"""
+    return reduce(partial(dict_merge, append_lists=True), records)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=2000, help='Number of files in the group')
+    parser.add_argument('--repeats', type=int, default=3, help='Number of timing repeats')
+    args = parser.parse_args()
+
+    records = make_records(args.files)
+    assert legacy(records) == merge_metadata(records)
+
+    print(f'Group of {args.files} files')
+    for name, func in [('dict_merge', legacy), ('in place', merge_metadata)]:
+        best = min(repeat(lambda: func(records), number=1, repeat=args.repeats))
+        print(f'{name:>17}: {best * 1e3:.1f} ms')
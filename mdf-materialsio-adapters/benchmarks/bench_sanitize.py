@@ -0,0 +1,74 @@
+"""Compare the single-pass sanitizer of the validator to the JSON round-trips it replaced
+
+Usage: python bench_sanitize.py [--files 2000] [--repeats 20]
+"""
+
+from mdf_matio.validator import _sanitize_document
+from argparse import ArgumentParser
+from timeit import repeat
+import random
+import json
+
+
+def make_dft_record(n_files: int, seed: int = 1) -> dict:
+    """Make a large record resembling the output of the DFT adapters
+
+    Args:
+        n_files (int): Number of files in the record
+        seed (int): Random seed
+    Returns:
+        (dict) Record
+    """
+    rng = random.Random(seed)
+    return {
+        'mdf': {'source_id': 'bench_v1', 'source_name': 'bench', 'acl': ['public']},
+        'material': {'composition': 'AlNi', 'elemental_proportions': {'Al': 0.5, 'Ni': 0.5}},
+        'dft': {'converged': True, 'exchange_correlation_functional': 'PAW',
+                'cutoff_energy': 650.0},
+        'crystal_structure': {'space_group_number': 221, 'number_of_atoms': 2.0,
+                              'volume': rng.random() * 100, 'stoichiometry': None},
+        'origin': {'type': 'computation', 'name': 'VASP', 'version': None},
+        'files': [{'filename': f'{i}.out', 'path': f'calc/{i // 10}/{i}.out',
+                   'length': rng.randrange(10 ** 9), 'data_type': 'ASCII text',
+                   'mime_type': 'text/plain', 'sha512': None, 'globus': None,
+                   'url': None} for i in range(n_files)],
+        'custom': dict((f'field_{i}', rng.random()) for i in range(100)),
+    }
+
+
+def _remove_nulls(data, skip=None):
+    """The null-removal pass the sanitizer replaced"""
+    if isinstance(data, dict):
+        new_dict = {}
+        for key, val in data.items():
+            new_val = _remove_nulls(val, skip=skip)
+            if new_val is not None or (skip is not None and key in skip):
+                new_dict[key] = new_val
+        return new_dict
+    elif isinstance(data, list):
+        return [x for x in (_remove_nulls(val, skip=skip) for val in data) if x is not None]
+    else:
+        return data
+
+
+def legacy(doc: dict) -> dict:
+    """Stringify custom, check JSON, remove nulls and copy, as the validator used to"""
+    doc = dict(doc, custom=dict((k, str(v)) for k, v in doc['custom'].items()))
+    json.dumps(doc, allow_nan=False)
+    doc = _remove_nulls(doc)
+    return json.loads(json.dumps(doc))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=2000, help='Number of files per record')
+    parser.add_argument('--repeats', type=int, default=20, help='Number of timing repeats')
+    args = parser.parse_args()
+
+    record = make_dft_record(args.files)
+    assert legacy(record) == _sanitize_document(record)
+
+    print(f'Record with {args.files} files, {len(json.dumps(record)) / 1024:.0f} kB of JSON')
+    for name, func in [('json round-trips', legacy), ('single pass', _sanitize_document)]:
+        best = min(repeat(lambda: func(record), number=1, repeat=args.repeats))
+        print(f'{name:>17}: {best * 1e3:.2f} ms')
@@ -0,0 +1,62 @@
+"""Compare writing records to gzip-compressed shards to serializing and writing them one by one
+
+Usage: python bench_sink.py [--records 100000] [--repeats 3]
+"""
+
+from mdf_matio.sink import ShardSink, read_shard
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from timeit import repeat
+import json
+import gzip
+import os
+
+
+def make_records(n_records: int) -> list:
+    """Make validated records, like those of the rows of a CSV file
+
+    Args:
+        n_records (int): Number of records
+    Returns:
+        ([dict]) Records
+    """
+    return [{'mdf': {'source_id': 'bench_v1.1', 'source_name': 'bench', 'scroll_id': i,
+                     'ingest_date': '2020-01-01T00:00:00.000000Z', 'resource_type': 'record',
+                     'version': 1, 'acl': ['public']},
+             'files': [{'filename': 'data.csv', 'path': 'data/data.csv', 'length': 123456}],
+             'material': {'composition': 'Al2O3', 'elements': ['Al', 'O']},
+             'custom': {'temperature': str(300 + i), 'band_gap': str(i / 1000)}}
+            for i in range(n_records)]
+
+
+def legacy(records: list, directory: str):
+    """Serialize and write each record on its own, as callers of generate_search_index do"""
+    with gzip.open(os.path.join(directory, 'legacy.ndjson.gz'), 'wt') as fp:
+        for record in records:
+            fp.write(json.dumps(record))
+            fp.write('\n')
+
+
+def sink(records: list, directory: str):
+    """Write the records with a ShardSink"""
+    with ShardSink(directory) as s:
+        s.write_all(records)
+    return s.manifest
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--records', type=int, default=100000, help='Number of records')
+    parser.add_argument('--repeats', type=int, default=3, help='Number of timing repeats')
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+    with TemporaryDirectory() as tmp:
+        manifest = sink(records, tmp)
+        assert [r for x in manifest['shards']
+                for r in read_shard(os.path.join(tmp, x['path']))] == records
+
+        print(f'{args.records} records, encoded with {manifest["encoder"]}')
+        for name, func in [('one by one', legacy), ('shard sink', sink)]:
+            best = min(repeat(lambda: func(records, tmp), number=1, repeat=args.repeats))
+            print(f'{name:>17}: {best:.2f} s')
@@ -3,21 +3,23 @@
 from mdf_matio.version import __version__  # noqa: F401
 from materials_io.utils.interface import (get_available_adapters, ParseResult,
                                           get_available_parsers, run_all_parsers)
-from mdf_matio.grouping import groupby_file, groupby_directory
-from mdf_matio.validator import MDFValidator
-from mdf_toolbox import dict_merge
-from typing import Iterable, Set, List
-from functools import reduce, partial
+from mdf_matio.grouping import groupby_file, groupby_directory, DirectoryTrie, \
+    SQLiteGroupStore, _get_directory
+from mdf_matio.parallel import parse_shards, walk_shards
+from mdf_matio.incremental import Manifest
+from mdf_matio.pipeline import Pipeline
+from mdf_matio.sink import ShardSink
+from mdf_matio.validator import MDFValidator, RecordValidation, ValidationError
+from mdf_matio.merging import merge_metadata
+from typing import Callable, Iterable, Set, List, Optional
+from contextlib import nullcontext
+from collections import deque
+from itertools import chain
 import logging
-import os
 
 logger = logging.getLogger(__name__)
 
 
-_merge_func = partial(dict_merge, append_lists=True)
-"""Function used to merge records"""
-
-
 def get_mdf_parsers() -> Set[str]:
     """Get the list of parsers defined for the MDF
 
@@ -31,76 +33,151 @@ def get_mdf_parsers() -> Set[str]:
 def _merge_records(group: List[ParseResult]):
     """Merge a group of records
 
+    List-type results (e.g., one record per row of a CSV file) are concatenated, and the
+    metadata from all other results is merged into each of their records. These records
+    share the objects of that metadata, so they must not be modified in place.
+
+    Results earlier in the group take precedence: a value they hold is kept over the
+    values of later results. :func:`~mdf_matio.grouping.groupby_file` puts the last
+    result of a group first.
+
     Args:
         group ([ParseResult]): List of parse results to group
     """
 
-    # Group the file list and parsers
-    group_files = list(set(sum([tuple(x.group) for x in group], ())))
-    group_parsers = '-'.join(sorted(set(sum([[x.parser] for x in group], []))))
+    # Group the file list and parsers, files in the order they are first seen
+    group_files = list(dict.fromkeys(chain.from_iterable(x.group for x in group)))
+    group_parsers = '-'.join(sorted(set(x.parser for x in group)))
 
     # Merge the metadata
-    is_list = [isinstance(x.metadata, list) for x in group]
-    if sum(is_list) > 1:
-        raise NotImplementedError('We have not defined how to merge >1 list-type data')
-    elif sum(is_list) == 1:
-        list_data = group[is_list.index(True)].metadata
-        if len(is_list) > 1:
-            other_metadata = reduce(_merge_func,
-                                    [x.metadata for x, t in zip(group, is_list) if not t])
-            group_metadata = [_merge_func(x, other_metadata) for x in list_data]
-        else:
-            group_metadata = list_data
+    list_data = [x.metadata for x in group if isinstance(x.metadata, list)]
+    other_data = [x.metadata for x in group if not isinstance(x.metadata, list)]
+    if len(list_data) == 0:
+        group_metadata = merge_metadata(other_data)
+    elif len(other_data) == 0 and len(list_data) == 1:
+        group_metadata = list_data[0]
     else:
-        group_metadata = reduce(_merge_func, [x.metadata for x in group])
+        list_data = list(chain.from_iterable(list_data))
+        if len(other_data) == 0:
+            group_metadata = list_data
+        else:
+            other_metadata = merge_metadata(other_data)
+            group_metadata = [merge_metadata([x, other_metadata]) for x in list_data]
     return ParseResult(group_files, group_parsers, group_metadata)
 
 
-def _merge_files(parse_results: Iterable[ParseResult]) -> Iterable[ParseResult]:
+def _merge_files(parse_results: Iterable[ParseResult],
+                 presorted: bool = False) -> Iterable[ParseResult]:
     """Merge metadata of records associated with the same file(s)
 
     Args:
         parse_results (ParseResult): Generator of ParseResults
+        presorted (bool): Whether the records arrive in the order of a directory walk,
+            in which case they are merged as they stream in
     Yields:
         (ParseResult): ParserResults merged for each file.
     """
-    return map(_merge_records, groupby_file(parse_results))
+    return map(_merge_records, groupby_file(parse_results, presorted=presorted))
 
 
-def _merge_directories(parse_results: Iterable[ParseResult], dirs_to_group: List[str])\
-        -> Iterable[ParseResult]:
-    """Merge records from user-specified directories
+def _find_grouped_directory(dirs_to_group: List[str]) -> Callable[[ParseResult], Optional[str]]:
+    """Make a function finding the directory to group that holds one of the files of a record
+
+    Args:
+        dirs_to_group ([str]): Directories whose contents are grouped into single records
+    Returns:
+        Function from a record to the directory to group it by, None if there is none
+    """
+    index = DirectoryTrie(dirs_to_group)
+
+    def find_directory(record: ParseResult) -> Optional[str]:
+        for f in record.group:
+            directory = index.find(f)
+            if directory is not None:
+                return directory
+        return None
+    return find_directory
+
+
+def _merge_on_disk(parse_results: Iterable[ParseResult], dirs_to_group: List[str],
+                   store: SQLiteGroupStore) -> Iterable[ParseResult]:
+    """Merge records from user-specified directories, then records of the same files, on disk
+
+    Gives the same records as :func:`_merge_files` applied to the output of
+    :func:`_merge_directories`, but each record is written once to a temporary database
+    and grouped there, rather than held in memory.
 
     Args:
         parse_results (ParseResult): Generator of ParseResults
+        dirs_to_group ([str]): Directories whose contents are grouped into single records
+        store (SQLiteGroupStore): Store used to group records on disk
     Yields:
         (ParseResult): ParserResults merged for each record
     """
+    find_directory = _find_grouped_directory(dirs_to_group)
 
-    # Add a path separator to the end of each directory
-    #  Used to simplify checking whether each file is a subdirectory of the matched groups
-    dirs_to_group = [d + os.path.sep for d in dirs_to_group]
+    def unit_key(record):
+        """Records to group are merged by their directory, as in groupby_directory"""
+        return None if find_directory(record) is None else _get_directory(record)
 
-    def is_in_directory(f):
-        """Check whether a file is in one fo the directories to group"""
-        f = os.path.dirname(f) + os.path.sep
-        return any(f.startswith(d) for d in dirs_to_group)
+    return map(_merge_records, store.groupby_file(parse_results, unit_key=unit_key,
+                                                  merge_unit=_merge_records))
+
+
+def _merge_directories(parse_results: Iterable[ParseResult], dirs_to_group: List[str],
+                       presorted: bool = False) -> Iterable[ParseResult]:
+    """Merge records from user-specified directories
+
+    If the records arrive in the order of a walk of the directory tree (e.g., from
+    :func:`~mdf_matio.parallel.parse_shards`), all records below each directory to group
+    are consecutive. They are then grouped as soon as the walk leaves that directory, and
+    only the records of one such directory are held at a time.
+
+    Args:
+        parse_results (ParseResult): Generator of ParseResults
+        dirs_to_group ([str]): Directories whose contents are grouped into single records
+        presorted (bool): Whether the records arrive in the order of a directory walk
+    Yields:
+        (ParseResult): ParserResults merged for each record
+    """
+    find_directory = _find_grouped_directory(dirs_to_group)
+
+    def merge_flagged(records):
+        for group in groupby_directory(records):
+            yield _merge_records(group)
 
     # Gather records that are in directories to group or any of their subdirectories
-    flagged_records = []
+    flagged_records = {}
     for record in parse_results:
-        if any(is_in_directory(f) for f in record.group):
-            flagged_records.append(record)
-        else:
+        directory = find_directory(record)
+
+        # Group the directories the walk has left
+        if presorted:
+            for done in [d for d in flagged_records if d != directory]:
+                yield from merge_flagged(flagged_records.pop(done))
+
+        if directory is None:
             yield record
+        else:
+            # Unless presorted, keep a single list so records are grouped in their input order
+            flagged_records.setdefault(directory if presorted else None, []).append(record)
+
+    # Once all of the parse results are through, group the remaining directories
+    yield from merge_flagged(chain.from_iterable(flagged_records.values()))
 
-    # Once all of the parse results are through, group by directory
-    for group in groupby_directory(flagged_records):
-        yield _merge_records(group)
+
+def _check_validation(result: RecordValidation) -> dict:
+    """Get a validated record, raising the error if it failed validation"""
+    if result.error is not None:
+        raise ValidationError(result.error)
+    return result.record
 
 
 def generate_search_index(data_url: str, validate_records=True, parse_config=None,
-                          exclude_parsers=None, index_options=None) -> Iterable[dict]:
+                          exclude_parsers=None, index_options=None,
+                          spill_to_disk=False, n_workers=None,
+                          manifest: Optional[str] = None,
+                          pipeline: Optional[Pipeline] = None) -> Iterable[dict]:
     """Generate a search index from a directory of data
 
     Args:
@@ -113,6 +190,29 @@ def generate_search_index(data_url: str, validate_records=True, parse_config=Non
                         directory as single records
         exclude_parsers ([str]): Names of parsers to exclude
         index_options (dict): Indexing options used by MDF Connect
+        spill_to_disk (bool): Whether to group records in a temporary SQLite database rather
+            than in memory, each record being written to it once. Useful for datasets whose
+            parse results do not fit in memory. Has no effect when parsing in parallel or
+            incrementally, as records are then grouped one directory at a time
+        n_workers (int): Number of processes used to parse and validate the data. Each
+            directory is parsed by one process, and results are collected in a fixed order
+            so that records are assigned the same ``scroll_id`` on every run.
+            Records are then merged as soon as the parsing of their directory is complete.
+            No more than twice ``n_workers`` directories, or batches of records to validate,
+            are handed to the processes ahead of the results being consumed.
+            Default None, to parse serially
+        manifest (str): Path of the manifest of the previous run, to re-index incrementally.
+            Only the directories with added, changed or deleted files (and their neighbours,
+            see :mod:`mdf_matio.incremental`) are parsed, and only their records are yielded,
+            followed by tombstones for the records that no longer exist.
+            Records keep the ``scroll_id`` they had in the previous run.
+            The manifest is updated once all records have been generated.
+            Default None, to index the whole dataset
+        pipeline (Pipeline): Pipeline with no stages, to parse, merge and validate the
+            records concurrently rather than in lock-step. The stages (``parse``, ``group``
+            and ``validate``) run in their own threads, connected by queues of the size set
+            for the pipeline. Their metrics are available from ``pipeline.metrics()``
+            while the records are generated. Default None, to run all stages in this thread
     Yields:
         (dict): Metadata records ready for ingestion in MDF search index
     """
@@ -134,41 +234,146 @@ def generate_search_index(data_url: str, validate_records=True, parse_config=Non
     # TODO (wardlt): Figure out how this works with Globus URLs
     index_options['generic'] = {'root_dir': data_url}
 
-    # Run the target parsers with their matching adapters on the directory
-    parse_results = run_all_parsers(data_url, include_parsers=list(target_parsers),
-                                    adapter_map='match', parser_context=index_options,
-                                    adapter_context=index_options)
-    # Merge by directory in the user-specified directories
+    # Find the user-specified directories to merge
     grouped_dirs = []
     for path, cfg in parse_config.items():
         if cfg.get('group_by_directory', False):
             grouped_dirs.append(path)
-    logging.info(f'Grouping {len(grouped_dirs)} directories')
-    parse_results = _merge_directories(parse_results, grouped_dirs)
+
+    # Find what changed since the previous run
+    update = None
+    if manifest is not None:
+        update = Manifest.load(manifest).update(data_url, grouped_dirs)
+        logging.info(f'Re-indexing {len(update.shards)} directories')
+
+    # Directories are parsed one at a time when parsing in parallel or incrementally,
+    #  which gives the records in the order of a walk of the directory tree
+    presorted = update is not None or n_workers is not None
+    if update is not None:
+        source = update.shards
+    elif n_workers is not None:
+        source = walk_shards(data_url)
+    else:
+        source = [data_url]
 
     # TODO: Add these variables as arguments or fetch in other way
     dataset_metadata = None   # Provided by MDF directly
     validation_params = None  # Provided by MDF directly
     schema_branch = "master"  # Must be configurable, can be provided by MDF directly
 
-    # Validate metadata and tweak into final MDF feedstock format
-    # Will fail if any entry fails validation - no invalid entries can be allowed
-    vald = MDFValidator(schema_branch=schema_branch)
-    vald_gen = vald.validate_mdf_dataset(dataset_metadata, validation_params)
-    # Yield validated dataset entry
-    yield next(vald_gen)
+    # Temporary databases for grouping, removed once all records are generated
+    with (SQLiteGroupStore() if spill_to_disk else nullcontext()) as store:
+        def parse(source):
+            """Run the target parsers with their matching adapters on the directories"""
+            if presorted:
+                return parse_shards(source, list(target_parsers), parser_context=index_options,
+                                    adapter_context=index_options, n_workers=n_workers)
+            return chain.from_iterable(
+                run_all_parsers(d, include_parsers=list(target_parsers), adapter_map='match',
+                                parser_context=index_options, adapter_context=index_options)
+                for d in source
+            )
+
+        def group(parse_results):
+            """Merge the parse results into records"""
+            # Merge by directory in the user-specified directories,
+            #  then merge records associated with the same file
+            logging.info(f'Grouping {len(grouped_dirs)} directories')
+            if store is not None and not presorted:
+                groups = _merge_on_disk(parse_results, grouped_dirs, store)
+            else:
+                groups = _merge_files(_merge_directories(parse_results, grouped_dirs,
+                                                         presorted=presorted),
+                                      presorted=presorted)
+
+            for group in groups:
+                # Skip records that include only generic metadata
+                if group.parser == 'generic':
+                    continue
+
+                # Loop over all produced records
+                metadata = group.metadata if isinstance(group.metadata, list) \
+                    else [group.metadata]
+                for i, record in enumerate(metadata):
+                    yield group.group, i, record
+
+        def validate(records):
+            """Validate the records, giving them their scroll ids"""
+            # Files and position of the records being validated
+            pending = deque()
+
+            def to_validate():
+                for files, i, record in records:
+                    pending.append((files, i))
+                    yield record
+
+            if n_workers is None:
+                validated = map(vald_gen.send, to_validate())
+            else:
+                validated = (_check_validation(x) for x in vald.validate_records(
+                    to_validate(), batch_size=100, workers=n_workers))
+            for record in validated:
+                files, i = pending.popleft()
+                if update is not None:
+                    update.assign(files, i, record)
+                yield record
+
+        # Validate metadata and tweak into final MDF feedstock format
+        # Will fail if any entry fails validation - no invalid entries can be allowed
+        vald = MDFValidator(schema_branch=schema_branch)
+        vald_gen = vald.validate_mdf_dataset(dataset_metadata, validation_params)
+        # Yield validated dataset entry
+        dataset = next(vald_gen)
+        if update is not None:
+            # Count the files of the records kept from the previous run
+            dataset['data']['total_size'] += update.kept_size
+        yield dataset
+
+        if pipeline is None:
+            yield from validate(group(parse(source)))
+        else:
+            pipeline.add_stage('parse', parse).add_stage('group', group) \
+                .add_stage('validate', validate)
+            yield from pipeline.run(source)
+
+        vald_gen.send(None)
 
-    # Merge records associated with the same file
-    for group in _merge_files(parse_results):
-        # Skip records that include only generic metadata
-        if group.parser == 'generic':
-            continue
+        if update is not None:
+            yield from update.tombstones(dataset)
+            update.manifest.save(manifest)
 
-        # Loop over all produced records
-        metadata = group.metadata if isinstance(group.metadata, list) else [group.metadata]
 
-        # Record validation
-        for record in metadata:
-            yield vald_gen.send(record)
+def write_search_index(data_url: str, directory: str, compression: Optional[str] = 'gzip',
+                       max_records: int = 10000, max_bytes: Optional[int] = 10 * 1024 ** 2,
+                       **kwargs) -> dict:
+    """Generate a search index from a directory of data, and write it as compressed shards
 
-    vald_gen.send(None)
+    The entries are written in NDJSON shards (see :class:`~mdf_matio.sink.ShardSink`), each
+    suitable for a single ingest batch. The dataset entry is written last, once the size of
+    all of its records is known. Tombstones of deleted records (from incremental
+    re-indexing) are not written to the shards, their scroll ids are listed in the manifest
+    under ``deleted_scroll_ids``.
+
+    Args:
+        data_url (str): Location of dataset to be parsed
+        directory (str): Directory of the shards and of their manifest
+        compression (str): ``gzip``, ``zstd`` or None, for no compression
+        max_records (int): Largest number of entries in a shard
+        max_bytes (int): Largest uncompressed size of a shard, in bytes. None for no limit
+        kwargs: Options passed to :func:`generate_search_index`
+    Returns:
+        (dict) The manifest of the shards
+    """
+    entries = generate_search_index(data_url, **kwargs)
+    with ShardSink(directory, prefix='records', compression=compression,
+                   max_records=max_records, max_bytes=max_bytes) as sink:
+        dataset = next(entries)
+        deleted = []
+        for entry in entries:
+            if entry['mdf'].get('resource_type') == 'tombstone':
+                deleted.append(entry['mdf']['scroll_id'])
+            else:
+                sink.write(entry)
+        sink.write(dataset)
+        sink.metadata['deleted_scroll_ids'] = deleted
+    return sink.manifest
@@ -1,10 +1,169 @@
 """Adapters that pull metadata from parsers that produce PIF-format data"""
 
 from materials_io.adapters.base import BaseAdapter
-from pypif_sdk.interop.mdf import _to_user_defined as pif_to_feedstock
-from typing import Dict, Tuple, Type
+from pypif_sdk.interop.mdf import _construct_new_key
+from typing import Callable, Dict, Iterator, List, Set, Tuple, Type
+from functools import lru_cache
 from mdf_toolbox import dict_merge
-from pypif.pif import loado
+
+# Fields of each type of PIF object holding objects that pypif_sdk's ReadView indexes,
+#  with the type of those objects and the field used as their name
+_RCL_FIELDS = {
+    'references': ('reference', 'doi'),
+    'licenses': ('license', 'name'),
+}
+_PIF_FIELDS = {
+    'system': dict(_RCL_FIELDS, **{
+        'subSystems': ('system', 'uid'),
+        'properties': ('value', 'name'),
+        'ids': ('other', 'name'),
+        'source': ('other', 'producer'),
+        'quantity': ('other', 'name'),
+        'preparation': ('process_step', 'name'),
+    }),
+    'value': dict(_RCL_FIELDS, **{
+        'conditions': ('value', 'name'),
+        'methods': ('method', 'name'),
+    }),
+    'method': {
+        'software': ('other', 'name'),
+        'instruments': ('other', 'name'),
+    },
+    'process_step': {
+        'details': ('value', 'name'),
+        'software': ('other', 'name'),
+        'instruments': ('other', 'name'),
+    },
+    'reference': {
+        'references': ('reference', 'doi'),
+        'figure': ('other', 'title'),
+        'table': ('other', 'title'),
+    },
+    'license': {},
+    'other': {},
+}
+
+
+def _iter_named(obj: dict, pif_type: str) -> Iterator[Tuple[str, str, dict]]:
+    """Walk the objects in a PIF that have a name, in the order ReadView visits them
+
+    Only objects with a name are descended into, as in ReadView.
+
+    Args:
+        obj (dict): PIF object, as a dict
+        pif_type (str): Type of the object, a key of ``_PIF_FIELDS``
+    Yields:
+        (str, str, dict) Name, type and contents of each object
+    """
+    for field, (child_type, name_field) in _PIF_FIELDS[pif_type].items():
+        children = obj.get(field)
+        if isinstance(children, dict):
+            children = [children]
+        elif not children:
+            continue
+        for child in children:
+            name = child.get(name_field) if isinstance(child, dict) else None
+            if not name:
+                continue
+            yield name, child_type, child
+            yield from _iter_named(child, child_type)
+
+
+@lru_cache(maxsize=None)
+def _field_name(name: str, units: str) -> str:
+    return _construct_new_key(name, units)
+
+
+def _get_value(obj: dict):
+    """Get the value of a PIF Value: one scalar, a list of scalars or one vector"""
+    if obj.get('scalars'):
+        values = obj['scalars']
+    elif obj.get('vectors') and len(obj['vectors']) == 1:
+        values = obj['vectors'][0]
+    else:
+        return None
+    if isinstance(values, dict):
+        values = [values]
+    values = [x['value'] if isinstance(x, dict) else x for x in values]
+    return values[0] if len(values) == 1 else values
+
+
+def _get_proportions(pif: dict) -> Dict[str, dict]:
+    """Get the elemental proportions or percentages of a PIF system"""
+    elements = {}
+    if pif.get("composition"):
+        for comp in pif["composition"]:
+            if comp.get("actualAtomicPercent"):
+                elements[comp["element"]] = float(comp["actualAtomicPercent"]["value"])
+            elif comp.get("actualWeightPercent"):
+                elements[comp["element"]] = float(comp["actualWeightPercent"]["value"])
+        return {"elemental_percent": elements} if elements else {}
+    elif pif.get("chemicalFormula"):
+        symbol = ""
+        num = ""
+        # A symbol is recorded when the next one starts, as in pypif_sdk (which means
+        #  the last symbol is never recorded)
+        for char in pif["chemicalFormula"]:
+            if char.isupper():
+                if symbol:
+                    try:
+                        elements[symbol] = int(num)
+                    except ValueError:
+                        elements[symbol] = float(num) if num else 1
+                    symbol = ""
+                    num = ""
+                symbol += char
+            elif char.islower():
+                symbol += char
+            elif char.isdigit() or char == ".":
+                num += char
+        return {"elemental_proportion": elements} if elements else {}
+    return {}
+
+
+def extract_pif_fields(pif: dict, fields: Set[str]) -> dict:
+    """Pull fields out of a PIF, as they would be named in its flattened form
+
+    Gives the same values as ``pypif_sdk.interop.mdf._to_user_defined(loado(pif))``
+    for the requested fields, working directly on the dict instead of building
+    the PIF objects and their ReadView.
+    Names used by more than one different object in the PIF are ambiguous, and are
+    left out as they are by ReadView.
+
+    Args:
+        pif (dict): PIF system, as a dict
+        fields ({str}): Names of the fields to pull out, such as ``Cutoff_Energy_eV``
+    Returns:
+        (dict) Values of the requested fields that are in the PIF
+    """
+    # Find the unambiguous names, in the order ReadView lists them
+    named = {}
+    ambiguous = set()
+    for name, pif_type, obj in _iter_named(pif, 'system'):
+        if name in ambiguous:
+            continue
+        if name in named and named[name][1] != obj:
+            ambiguous.add(name)
+            del named[name]
+        else:
+            named[name] = (pif_type, obj)
+
+    output = {}
+    for name, (pif_type, obj) in named.items():
+        if pif_type == 'value':
+            key = _field_name(name, obj.get('units'))
+            value = _get_value(obj) if key in fields else None
+        elif pif_type == 'process_step':
+            key, value = 'Processing', name
+        else:
+            continue
+        if key in fields and value is not None:
+            output[key] = value
+
+    for key, value in _get_proportions(pif).items():
+        if key in fields:
+            output[key] = value
+    return output
 
 
 class CitrineAdapter(BaseAdapter):
@@ -30,16 +189,15 @@ class CitrineAdapter(BaseAdapter):
         }
 
     def transform(self, pif: dict, context=None) -> dict:
-        # Flatten the pif into smaller records
-        pif = pif_to_feedstock(loado(pif))
+        # Pull only the fields being translated out of the pif
+        blocks, pif_fields = _compile_translations(type(self))
+        pif = extract_pif_fields(pif, pif_fields)
 
         # Map the records to an MDF field
         record = {}
-        for block, mapping in self.get_translations().items():
+        for block, mapping in blocks:
             new_block = {}
-            for pif_field, mdf_field_info in mapping.items():
-                mdf_field = mdf_field_info[0]
-                translator = mdf_field_info[1]
+            for pif_field, mdf_field, translator in mapping:
                 if pif_field in pif:
                     new_block[mdf_field] = translator(pif[pif_field])
             if new_block:
@@ -47,6 +205,25 @@ class CitrineAdapter(BaseAdapter):
         return record
 
 
+@lru_cache(maxsize=None)
+def _compile_translations(adapter: Type[CitrineAdapter]) \
+        -> Tuple[List[Tuple[str, List[Tuple[str, str, Callable]]]], Set[str]]:
+    """Get the translation table of an adapter class, once per class
+
+    Args:
+        adapter: Class of the adapter
+    Returns:
+        - ([(str, [(str, str, callable)])]) PIF field, MDF field and translator
+          for each field of each MDF block
+        - ({str}) All PIF fields that are translated
+    """
+    blocks = [(block, [(pif_field, mdf_field, translator)
+                       for pif_field, (mdf_field, translator) in mapping.items()])
+              for block, mapping in adapter().get_translations().items()]
+    pif_fields = frozenset(x[0] for _, mapping in blocks for x in mapping)
+    return blocks, pif_fields
+
+
 class PIFDFTAdapter(CitrineAdapter):
     """Adapter for the PIF DFT parser"""
 
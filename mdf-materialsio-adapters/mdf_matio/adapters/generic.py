@@ -1,9 +1,15 @@
 import os
-
-import jsonschema
-import mdf_toolbox
+from functools import lru_cache
 
 from materials_io.adapters.base import BaseAdapter
+from mdf_matio.projection import compile_paths, project
+from mdf_matio.schemas import get_record_fields, get_schema_uri
+
+
+@lru_cache(maxsize=None)
+def _get_record_trie(schema_uri):
+    """Compile the fields of the record schema into a trie, once per schema URI"""
+    return compile_paths(get_record_fields(schema_uri))
 
 
 class GenericMDFAdapter(BaseAdapter):
@@ -29,7 +35,8 @@ class GenericMDFAdapter(BaseAdapter):
 
         Arguments:
             schema_branch (str): The branch of the MDF data-schemas Github repository to
-                    download and validate against. Default "master".
+                    download and validate against. Default "master", which uses the
+                    bundled copy of the schemas.
             schema_uri (str): The uri to the MDF schema location. Local and nonlocal locations
                     are supported. Default None, to use the Github branch instead.
 
@@ -42,26 +49,18 @@ class GenericMDFAdapter(BaseAdapter):
 
         # Generate URI from Github if branch supplied
         if schema_branch:
-            schema_uri = ("https://raw.githubusercontent.com/materials-data-facility/"
-                          "data-schemas/{}/schemas/".format(schema_branch))
+            schema_uri = get_schema_uri(schema_branch)
         # If URI is bare file path, make into URI
         elif os.path.exists(schema_uri):
             schema_uri = "{}{}{}".format(
                                     "file://" if not schema_uri.startswith("file://") else "",
                                     os.path.abspath(schema_uri),
                                     "/" if schema_uri.endswith("/") else "")
-        # Fetch record schema with resolver
-        resolver = jsonschema.RefResolver(schema_uri, None)
-        base_schema = resolver.resolve("record.json")[1]
-        # Expand JSONSchema (can provider premade resolver)
-        full_schema = mdf_toolbox.expand_jsonschema(base_schema, resolver=resolver)
-
-        # Turn full MDF schema into self-mapping/automap (mdf.field:mdf.field)
-        # Condense into mdf_field: type, then replace type value with field name
-        self.automap = {}
-        for field in mdf_toolbox.condense_jsonschema(full_schema, include_containers=False,
-                                                     list_items=False).keys():
-            self.automap[field] = field
+        # Fields of the MDF schema are computed once per process and shared by all adapters
+        # Turn them into a self-mapping/automap (mdf.field:mdf.field)
+        self.automap = dict((field, field) for field in get_record_fields(schema_uri))
+        # Compiled into a trie, so transform() only visits fields in the schema
+        self._fields = _get_record_trie(schema_uri)
 
     def transform(self, metadata, context=None):
         """Transform the metadata by filtering non-MDF fields away.
@@ -76,8 +75,6 @@ class GenericMDFAdapter(BaseAdapter):
         """
         if context is None:
             context = {}
-        # Use automapping to pull out MDF-format fields in metadata
-        # Discard empty values
-        filtered_metadata = mdf_toolbox.translate_json(metadata, self.automap,
-                                                       na_values=[[], {}, None])
-        return filtered_metadata
+        # Pull out MDF-format fields in metadata, discarding empty values
+        # Same output as translate_json(metadata, self.automap, na_values=[[], {}, None])
+        return project(metadata, self._fields)
@@ -1,6 +1,9 @@
 """Adapters for structured files"""
 from materials_io.adapters.base import BaseAdapter
-from typing import List, Tuple, Union
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
+
+_MISSING = object()
+"""Marker for a column that is not present in a row"""
 
 
 def _add_value(record, key: Tuple[str], value):
@@ -20,14 +23,130 @@ def _add_value(record, key: Tuple[str], value):
         _add_value(record[key[0]], key[1:], value)
 
 
+def _compile_template(col_to_mdf: Dict[str, List[str]]) -> Callable[[dict], dict]:
+    """Resolve the locations of each column into a function that builds a record
+
+    Args:
+        col_to_mdf (dict): Location of each column in the MDF record
+    Returns:
+        Function that takes a row and returns the record holding the values of the
+        columns present in the row
+    """
+    # Nested template, where the leaves are the names of the columns
+    template = {}
+    for col, key in col_to_mdf.items():
+        _add_value(template, key, col)
+    return _compile_node(template)
+
+
+def _compile_node(node: dict) -> Callable[[dict], dict]:
+    """Compile one level of the template made by :func:`_compile_template`"""
+    # Blocks holding only columns (e.g., ``material``) are filled in place,
+    # only deeper blocks need a call of their own
+    leaves, blocks, nested = [], [], []
+    for key, child in node.items():
+        if not isinstance(child, dict):
+            leaves.append((key, child))
+        elif any(isinstance(x, dict) for x in child.values()):
+            nested.append((key, _compile_node(child)))
+        else:
+            blocks.append((key, list(child.items())))
+
+    def build(row: dict) -> dict:
+        record = {}
+        for key, col in leaves:
+            value = row.get(col, _MISSING)
+            if value is not _MISSING:
+                record[key] = value
+        for key, block_leaves in blocks:
+            block = {}
+            for k, col in block_leaves:
+                value = row.get(col, _MISSING)
+                if value is not _MISSING:
+                    block[k] = value
+            if block:
+                record[key] = block
+        for key, child in nested:
+            block = child(row)
+            if block:
+                record[key] = block
+        return record
+    return build
+
+
+def _to_list(column) -> list:
+    """Get the values of a column as a list of Python objects
+
+    NumPy arrays and pandas series (``tolist``) and Arrow arrays (``to_pylist``) are
+    converted in bulk, which also turns their scalars into plain Python types.
+    """
+    if hasattr(column, 'to_pylist'):
+        return column.to_pylist()
+    if hasattr(column, 'tolist'):
+        return column.tolist()
+    return list(column)
+
+
+def _iter_columns(data: dict, columns: List[str]) -> Iterator[dict]:
+    """Get the rows of columnar data, holding only certain columns"""
+    columns = [col for col in columns if col in data]
+    for values in zip(*[_to_list(data[col]) for col in columns]):
+        yield dict(zip(columns, values))
+
+
 class CSVAdapter(BaseAdapter):
     """Execute mapping operation on CSV adapters
 
     The CSV adapter requires a single context parameter: ``mapping``.
     Mapping defines the name of the MDF field (using '.'s to separate keys at different levels)
     to the name of the column.
+
+    The metadata holds either the rows of the file (``records``, a list of dicts) or its
+    columns (``columns``, a dict of column name to a list, NumPy array or Arrow array).
+    Only the mapped columns are read, and the records are built by a function compiled
+    once from the mapping. :meth:`iter_records` yields them one at a time.
+
+    Large files can be streamed instead: a parser that yields the rows in chunks (each a
+    list of rows or a dict of columns) is mapped chunk by chunk by :meth:`iter_chunks`,
+    so only one chunk is held in memory at a time.
     """
 
+    def iter_records(self, metadata: dict, mapping: Dict[str, str]) -> Iterator[dict]:
+        """Generate the records of a file, one at a time
+
+        Args:
+            metadata (dict): Output of the CSV parser
+            mapping (dict): Map of MDF field to column name
+        Yields:
+            (dict) Non-empty records, in the order of the rows
+        """
+        if 'columns' in metadata:
+            chunk = metadata['columns']
+        else:
+            chunk = metadata['records']
+        for records in self.iter_chunks([chunk], mapping):
+            yield from records
+
+    def iter_chunks(self, chunks: Iterable[Union[List[dict], dict]],
+                    mapping: Dict[str, str]) -> Iterator[Iterator[dict]]:
+        """Map the rows of a file chunk by chunk
+
+        Args:
+            chunks: Chunks of the file, each either an iterable of rows (dicts)
+                or a dict of column name to the values of that column
+            mapping (dict): Map of MDF field to column name
+        Yields:
+            Iterator over the non-empty records of each chunk, generated lazily
+        """
+        # Parse the mapping
+        col_to_mdf = dict((y, x.split('.')) for x, y in mapping.items())
+        columns = list(col_to_mdf)
+        build = _compile_template(col_to_mdf)
+
+        for chunk in chunks:
+            rows = _iter_columns(chunk, columns) if isinstance(chunk, dict) else chunk
+            yield (record for record in map(build, rows) if len(record) > 0)
+
     def transform(self, metadata: dict,
                   context: Union[None, dict] = None) -> Union[None, List[dict]]:
         # We cannot handle CSV files if the user does not define a mapping
@@ -36,16 +155,6 @@ class CSVAdapter(BaseAdapter):
         if 'mapping' not in context:
             return None
 
-        # Parse the mapping
-        col_to_mdf = dict((y, x.split('.')) for x, y in context['mapping'].items())
-
         # Generate entries
-        sub_records = []
-        for record in metadata['records']:
-            new_record = {}
-            for col, key in col_to_mdf.items():
-                if col in record:
-                    _add_value(new_record, key, record[col])
-            if len(new_record) > 0:
-                sub_records.append(new_record)
+        sub_records = list(self.iter_records(metadata, context['mapping']))
         return sub_records if len(sub_records) > 0 else None
@@ -0,0 +1,35 @@
+"""Tools for reading the elements out of composition strings"""
+
+from functools import lru_cache
+from typing import Tuple
+import re
+
+ELEMENTS = frozenset("""
+H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe Co Ni Cu Zn Ga Ge As Se
+Br Kr Rb Sr Y Zr Nb Mo Tc Ru Rh Pd Ag Cd In Sn Sb Te I Xe Cs Ba La Ce Pr Nd Pm Sm Eu Gd Tb Dy
+Ho Er Tm Yb Lu Hf Ta W Re Os Ir Pt Au Hg Tl Pb Bi Po At Rn Fr Ra Ac Th Pa U Np Pu Am Cm Bk Cf
+Es Fm Md No Lr Rf Db Sg Bh Hs Mt Ds Rg Cn Nh Fl Mc Lv Ts Og
+""".split())
+"""Symbols of all elements in the periodic table"""
+
+_word = re.compile(r'[A-Z][a-z]*')
+"""Runs of letters that start with a capital: element symbols, or other words"""
+
+
+@lru_cache(maxsize=65536)
+def get_elements(composition: str) -> Tuple[str, ...]:
+    """Get the elements present in a composition string
+
+    Symbols are recognized anywhere in the string, so parentheses
+    (e.g., ``Ca(OH)2``), hydrates (``CuSO4·5H2O``, ``CuSO4*5H2O``) and fractional
+    stoichiometry (``Li0.5CoO2``) are all handled. Letters that do not form the symbol of
+    an element, such as other words (``NaCl and KCl``, ``Water``), are ignored.
+
+    Results are cached, as the same composition often appears in many records.
+
+    Args:
+        composition (str): Composition string
+    Returns:
+        ((str)) Unique symbols of the elements, in alphabetical order
+    """
+    return tuple(sorted(set(x for x in _word.findall(composition) if x in ELEMENTS)))
@@ -1,16 +1,15 @@
 from materials_io.utils.interface import ParseResult
-from typing import Iterable, List
+from typing import Callable, Iterable, Iterator, List, Tuple, IO, Optional
+from contextlib import ExitStack, contextmanager
+from tempfile import TemporaryFile, TemporaryDirectory
 from operator import itemgetter
-from itertools import groupby
+from itertools import groupby, islice
+from heapq import merge
+import sqlite3
+import pickle
 import os
 
 
-# TODO (wardlt): Grouping requires entire parsed data, memory intensive for larger filesystems
-#  Potential Plan: Write to a temporary database with SQLite and sqlalchemy
-#    Pros: No external database to manage, can handle temporary file with context manager
-#    Cons: Disk access slow (avoidable?), would recreate database on each step
-
-
 def _get_directory(group: ParseResult) -> str:
     """Get the directory for a group of files
 
@@ -26,90 +25,443 @@ def _get_directory(group: ParseResult) -> str:
         return os.path.commonpath(files)
 
 
-def groupby_directory(records: Iterable[ParseResult]) -> Iterable[List[ParseResult]]:
+def _spill(chunk: List[Tuple[str, ParseResult]]) -> IO[bytes]:
+    """Sort a chunk of (directory, record) pairs and write them to a temporary file
+
+    Args:
+        chunk ([(str, ParseResult)]): Records and their directories
+    Returns:
+        (file) Temporary file holding the sorted chunk, rewound to the start
+    """
+    fp = TemporaryFile()
+    pickler = pickle.Pickler(fp, protocol=pickle.HIGHEST_PROTOCOL)
+    for item in sorted(chunk, key=itemgetter(0)):
+        pickler.dump(item)
+        pickler.clear_memo()
+    fp.seek(0)
+    return fp
+
+
+def _read_spill(fp: IO[bytes]) -> Iterator[Tuple[str, ParseResult]]:
+    """Read back the (directory, record) pairs written by :meth:`_spill`"""
+    unpickler = pickle.Unpickler(fp)
+    while True:
+        try:
+            yield unpickler.load()
+        except EOFError:
+            return
+
+
+def groupby_directory(records: Iterable[ParseResult], presorted: bool = False,
+                      chunk_size: int = 100000,
+                      store: Optional['SQLiteGroupStore'] = None) -> Iterable[List[ParseResult]]:
     """Group parsing results by directory
 
+    If the records are known to arrive with all records from a directory next to each other
+    (e.g., in directory-walk order), they can be grouped as they stream in and only
+    one directory is held in memory at a time.
+
+    Otherwise, records are sorted by directory. Inputs larger than ``chunk_size`` are
+    sorted externally: each chunk is sorted and spilled to a temporary file, and the sorted
+    chunks are merged back as they are read. Peak memory is then bounded by the
+    chunk size and the largest directory rather than the whole dataset.
+
+    If a :class:`SQLiteGroupStore` is provided, records are instead grouped in a
+    temporary database and ``presorted`` and ``chunk_size`` are ignored.
+
     Args:
         records ([ParseResult])): Iterable of data coming from the parser
+        presorted (bool): Whether records from each directory are already consecutive
+        chunk_size (int): Maximum number of records to sort in memory
+        store (SQLiteGroupStore): Store used to group records on disk
     Yields:
-        ([ParseResult]) after grouping based on directory, sorted by directory name
+        ([ParseResult]) after grouping based on directory. Sorted by directory name,
+        unless ``presorted``, in which case they are in the order they arrived
+    Raises:
+        (ValueError) If ``presorted`` and a directory re-appears after its group was yielded
+    """
+
+    if store is not None:
+        yield from store.groupby_directory(records)
+        return
+
+    keyed = ((_get_directory(record), record) for record in records)
+
+    if presorted:
+        seen = set()
+        for gid, group in groupby(keyed, key=itemgetter(0)):
+            if gid in seen:
+                raise ValueError(f'Records from {gid} are not consecutive')
+            seen.add(gid)
+            yield [x[1] for x in group]
+        return
+
+    with ExitStack() as stack:
+        # Sort the records in chunks, spilling to disk if they do not fit in one
+        spills = []
+        chunk = list(islice(keyed, chunk_size))
+        while len(chunk) == chunk_size:
+            spills.append(stack.enter_context(_spill(chunk)))
+            chunk = list(islice(keyed, chunk_size))
+        if len(spills) == 0:
+            # Sort by the directory name, so that `groupby` see consecutive keys of the
+            sorted_data = sorted(chunk, key=itemgetter(0))
+        else:
+            if len(chunk) > 0:
+                spills.append(stack.enter_context(_spill(chunk)))
+            del chunk
+            # `merge` is stable, so ties keep their input order just as with `sorted`
+            sorted_data = merge(*map(_read_spill, spills), key=itemgetter(0))
+
+        for gid, group in groupby(sorted_data, key=itemgetter(0)):
+            yield [x[1] for x in group]  # Remove directory name
+
+
+class DirectoryTrie:
+    """Index of directories that finds which of them contain a path
+
+    Directories are stored in a trie of path components, so a lookup takes time
+    proportional to the depth of the path rather than to the number of directories.
     """
 
-    # Sort by the directory name, so that `groupby` see consecutive keys of the
-    sorted_data = sorted(zip(map(_get_directory, records), records), key=itemgetter(0))
-    for gid, group in groupby(sorted_data, key=itemgetter(0)):
-        yield [x[1] for x in group]  # Remove directory name
+    _END = object()
+    """Key marking a node that is one of the indexed directories"""
+
+    def __init__(self, directories: Iterable[str]):
+        """
+        Args:
+            directories ([str]): Directories to index
+        """
+        self._root = {}
+        for directory in directories:
+            node = self._root
+            for part in self._split(directory):
+                node = node.setdefault(part, {})
+            node[self._END] = directory
+
+    @staticmethod
+    def _split(path: str) -> List[str]:
+        """Split a path into its components, keeping the empty root of an absolute path"""
+        path = path.rstrip(os.path.sep) or path
+        return path.split(os.path.sep)
+
+    def find(self, path: str) -> Optional[str]:
+        """Find the outermost indexed directory that contains a file
+
+        Args:
+            path (str): Path of the file
+        Returns:
+            (str) Directory as it was given when indexing, or None if no indexed
+            directory contains the file
+        """
+        node = self._root
+        for part in self._split(os.path.dirname(path)):
+            node = node.get(part)
+            if node is None:
+                return None
+            if self._END in node:
+                return node[self._END]
+        return None
+
 
+def _group_by_file(records: List[ParseResult]) -> Iterable[List[ParseResult]]:
+    """Group records that reference the same files, held in memory"""
+    parent = list(range(len(records)))
+    size = [1] * len(records)
 
-def groupby_file(records: Iterable[ParseResult], max_passes=-1) -> Iterable[List[ParseResult]]:
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]  # Path halving
+            i = parent[i]
+        return i
+
+    # Join each record with the first record to reference each of its files
+    file_owner = {}
+    for i, record in enumerate(records):
+        for f in record[0]:
+            j = file_owner.setdefault(f, i)
+            if j == i:
+                continue
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                if size[ri] < size[rj]:
+                    ri, rj = rj, ri
+                parent[rj] = ri
+                size[ri] += size[rj]
+
+    # Collect the groups, ordered by their first record
+    groups = {}
+    for i, record in enumerate(records):
+        groups.setdefault(find(i), []).append(record)
+    return map(_order_group, groups.values())
+
+
+def _order_group(group: List[ParseResult]) -> List[ParseResult]:
+    """Order the records of a group by their precedence when merged
+
+    The last record of the group comes first, followed by the others in input order.
+    This is the order of the earlier, iterative grouping procedure whenever all records
+    share a file with the last one (e.g., several parsers run on the same files).
+
+    Args:
+        group ([ParseResult]): Records that share files, in input order
+    Returns:
+        ([ParseResult]) The records, the last one first
+    """
+    return group[-1:] + group[:-1]
+
+
+def groupby_file(records: Iterable[ParseResult], max_passes=-1, presorted: bool = False,
+                 store: Optional['SQLiteGroupStore'] = None) -> Iterable[List[ParseResult]]:
     """Group together parsing results that reference the same files
 
-    Files are grouped in an iterative procedure, which can be costly.
-    The number of grouping iterations can be truncated for speed.
+    Records are grouped in a single pass using an index from each file to the first
+    record that references it, and a disjoint-set forest that joins the groups of
+    records sharing a file. Grouping is thus near-linear in the number of records.
+
+    Groups are yielded in order of their first record. Within each group, the last record
+    comes first, followed by the others in input order. The first records of a group take
+    precedence when merged (see :func:`~mdf_matio._merge_records`). This is the order of
+    the earlier, iterative procedure whenever all records of a group share a file with
+    the last one.
+
+    If the records arrive with all records from a directory next to each other, and
+    records from different directories never share files (e.g., when each directory is
+    parsed on its own), they can be grouped as they stream in, one directory at a time.
+
+    If a :class:`SQLiteGroupStore` is provided, the records are held in a temporary
+    database rather than in memory, and ``presorted`` is ignored.
 
     Args:
         records (ParseResult): Results of parsing
-        max_passes (int): Maximum number of grouping passes
-        # TODO: Consider a timeout-based solution
+        max_passes (int): Ignored. Kept for compatibility with the earlier, iterative
+            grouping procedure, which could be truncated for speed.
+        presorted (bool): Whether records from each directory are already consecutive
+        store (SQLiteGroupStore): Store used to group records on disk
     Yields:
         ([ParseResult]) Lists of parsed records that contain the same files
+    Raises:
+        (ValueError) If ``presorted`` and a directory re-appears after its records were grouped
     """
 
-    # Initialize each file into its own group
-    current_groups = [(set(x[0]), [x]) for x in records]
+    if store is not None:
+        yield from store.groupby_file(records)
+        return
 
-    # Perform grouping passes
-    grouping_pass = 0
-    while True:
-        grouping_pass += 1
-        matched_groups = []  # Groups that are matched and may have to be grouped again
-
-        while len(current_groups) > 0:
-            # Pick a record to attempt to match other records
-            to_match = current_groups.pop()
-            matched_ids = set()
-
-            # See if it matches any already-matched group
-            my_files = to_match[0]
-            matched = False
-            for files, records in matched_groups:
-                if not my_files.isdisjoint(files):
-                    matched = True
-                    files.update(my_files)
-                    records.extend(to_match[1])
-                    break
-            if matched:
-                continue
+    if presorted:
+        seen = set()
+        for gid, group in groupby(records, key=_get_directory):
+            if gid in seen:
+                raise ValueError(f'Records from {gid} are not consecutive')
+            seen.add(gid)
+            yield from _group_by_file(list(group))
+        return
 
-            # Loop over all other records, find those that have similar
-            for i, record in enumerate(current_groups):
-                if not record[0].isdisjoint(my_files):
-                    matched_ids.add(i)
-
-            if len(matched_ids) == 0:
-                # Take it out of circulation as there will be no matches on later passes
-                yield to_match[1]  # Return the group
-            else:
-                # Get the matched entries, and delete them from current groups
-                my_matched_groups = [e for i, e in enumerate(current_groups) if i in matched_ids]
-                current_groups = [e for i, e in enumerate(current_groups) if i not in matched_ids]
-
-                # Merge the matched groups
-                my_records = to_match[1]
-                for group in my_matched_groups:
-                    my_files.update(group[0])
-                    my_records.extend(group[1])
-
-                # Add new groups to the "must be grouped again list"
-                matched_groups.append((my_files, my_records))
-
-        # Check if we are done
-        if grouping_pass == max_passes:
-            # Return the current matched groups
-            for group in matched_groups:
-                yield group[1]
-        elif len(matched_groups) == 0:
-            return  # Nothing left to group
-        else:
-            # Prepare to group again
-            current_groups = matched_groups
+    yield from _group_by_file(list(records))
+
+
+class SQLiteGroupStore:
+    """Groups parse results in temporary SQLite databases rather than in memory
+
+    Each grouping operation serializes its records once into a fresh database, indexed by
+    directory and by file path, groups them with SQL, and streams the groups back as they
+    are read. Only the record identifiers are kept in memory. Each database is deleted
+    once its groups have all been read, or the generator reading them is closed.
+
+    Use the store as a context manager, which deletes any remaining databases on exit::
+
+        with SQLiteGroupStore() as store:
+            for group in groupby_file(records, store=store):
+                ...
+    """
+
+    def __init__(self, directory: Optional[str] = None, batch_size: int = 10000):
+        """
+        Args:
+            directory (str): Where to create the temporary databases. Default is the
+                system temporary directory
+            batch_size (int): Number of records inserted per transaction
+        """
+        self.batch_size = batch_size
+        self._tmpdir = TemporaryDirectory(prefix='mdf_matio_', dir=directory)
+        self._connections = []
+        self._n_databases = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Close and delete all databases"""
+        for conn in self._connections:
+            conn.close()
+        self._connections.clear()
+        self._tmpdir.cleanup()
+
+    @contextmanager
+    def _database(self, records: Iterable[ParseResult],
+                  unit_key: Optional[Callable[[ParseResult], Optional[str]]] = None) \
+            -> Iterator[sqlite3.Connection]:
+        """Write records to a new database, which is deleted when the context exits
+
+        Args:
+            records ([ParseResult]): Records to be stored
+            unit_key: Function giving the unit of each record, if any (see :meth:`groupby_file`)
+        Yields:
+            (sqlite3.Connection) Connection to the database
+        """
+        path = os.path.join(self._tmpdir.name, f'group-{self._n_databases}.db')
+        self._n_databases += 1
+        conn = sqlite3.connect(path)
+        self._connections.append(conn)
+        try:
+            self._load(conn, records, unit_key)
+            yield conn
+        finally:
+            # Unless the store was closed, which deleted all databases
+            if conn in self._connections:
+                self._connections.remove(conn)
+                conn.close()
+                os.unlink(path)
+
+    def _load(self, conn: sqlite3.Connection, records: Iterable[ParseResult],
+              unit_key: Optional[Callable[[ParseResult], Optional[str]]] = None):
+        """Write records to an empty database
+
+        Args:
+            conn (sqlite3.Connection): Connection to the database
+            records ([ParseResult]): Records to be stored
+            unit_key: Function giving the unit of each record, if any (see :meth:`groupby_file`)
+        """
+        if unit_key is None:
+            def unit_key(record):
+                return None
+
+        # Data is temporary, no need for durability
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('CREATE TABLE records '
+                     '(id INTEGER PRIMARY KEY, directory TEXT, unit TEXT, data BLOB)')
+        conn.execute('CREATE TABLE files (file TEXT, id INTEGER)')
+
+        records = iter(records)
+        next_id = 0
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if len(batch) == 0:
+                break
+            ids = range(next_id, next_id + len(batch))
+            next_id += len(batch)
+            with conn:
+                conn.executemany('INSERT INTO records VALUES (?, ?, ?, ?)', (
+                    (i, _get_directory(r), unit_key(r),
+                     pickle.dumps(r, protocol=pickle.HIGHEST_PROTOCOL))
+                    for i, r in zip(ids, batch)
+                ))
+                conn.executemany('INSERT INTO files VALUES (?, ?)',
+                                 ((f, i) for i, r in zip(ids, batch) for f in r[0]))
+
+        # Index once all records are in
+        with conn:
+            conn.execute('CREATE INDEX records_directory ON records (directory, id)')
+            conn.execute('CREATE INDEX records_unit ON records (unit, id) '
+                         'WHERE unit IS NOT NULL')
+            conn.execute('CREATE INDEX files_file ON files (file, id)')
+
+    @staticmethod
+    def _read_groups(cursor: Iterable[Tuple[object, bytes]]) -> Iterator[List[ParseResult]]:
+        """Group (key, serialized record) rows that are sorted by key"""
+        for _, group in groupby(cursor, key=itemgetter(0)):
+            yield [pickle.loads(x[1]) for x in group]
+
+    def groupby_directory(self, records: Iterable[ParseResult]) -> Iterator[List[ParseResult]]:
+        """Group parsing results by directory
+
+        Args:
+            records ([ParseResult])): Iterable of data coming from the parser
+        Yields:
+            ([ParseResult]) after grouping based on directory, sorted by directory name
+        """
+        with self._database(records) as conn:
+            yield from self._read_groups(
+                conn.execute('SELECT directory, data FROM records ORDER BY directory, id')
+            )
+
+    def groupby_file(self, records: Iterable[ParseResult],
+                     unit_key: Optional[Callable[[ParseResult], Optional[str]]] = None,
+                     merge_unit: Optional[Callable[[List[ParseResult]], ParseResult]] = None) \
+            -> Iterator[List[ParseResult]]:
+        """Group together parsing results that reference the same files
+
+        Records can first be merged into units (e.g., the records from a directory to be
+        grouped into a single record), which are then grouped with the other records by
+        the files they reference. Each record is written to the database only once.
+        The groups are the same as from merging the units by :func:`groupby_directory`
+        and grouping the resulting records by :func:`groupby_file`, with the records
+        that are not in a unit followed by the units, sorted by key.
+
+        Args:
+            records ([ParseResult]): Results of parsing
+            unit_key: Function giving the key of the unit of a record, or None if the record
+                is not part of a unit. Default is no units
+            merge_unit: Function merging the records of a unit, in input order, into one
+        Yields:
+            ([ParseResult]) Lists of parsed records that contain the same files, in order
+            of their first record, with records ordered as by :func:`groupby_file`
+        """
+        if unit_key is not None and merge_unit is None:
+            raise ValueError('merge_unit is required to group records into units')
+        with self._database(records, unit_key) as conn:
+            n_records, = conn.execute('SELECT COUNT(*) FROM records').fetchone()
+
+            # Join records that share a file, or a unit. The root of each set is its first record
+            parent = list(range(n_records))
+
+            def find(i):
+                while parent[i] != i:
+                    parent[i] = parent[parent[i]]  # Path halving
+                    i = parent[i]
+                return i
+
+            for query in ['SELECT file, id FROM files ORDER BY file, id',
+                          'SELECT unit, id FROM records WHERE unit IS NOT NULL ORDER BY unit, id']:
+                for _, rows in groupby(conn.execute(query), key=itemgetter(0)):
+                    first = find(next(rows)[1])
+                    for _, i in rows:
+                        root = find(i)
+                        if root != first:
+                            first, root = min(first, root), max(first, root)
+                            parent[root] = first
+
+            # Order the groups by their first record, the units coming after all other records
+            first_item = {}
+            for i, unit in conn.execute('SELECT id, unit FROM records'):
+                root = find(i)
+                key = (0, i) if unit is None else (1, unit)
+                if root not in first_item or key < first_item[root]:
+                    first_item[root] = key
+            rank = dict((root, n) for n, root in enumerate(sorted(first_item, key=first_item.get)))
+            del first_item
+
+            # Store the group of each record, and read them back group by group
+            with conn:
+                conn.execute('CREATE TABLE roots (id INTEGER PRIMARY KEY, rank INTEGER)')
+                conn.executemany('INSERT INTO roots VALUES (?, ?)',
+                                 ((i, rank[find(i)]) for i in range(n_records)))
+                conn.execute('CREATE INDEX roots_rank ON roots (rank, id)')
+            rows = conn.execute(
+                'SELECT roots.rank, records.unit, records.data '
+                'FROM roots JOIN records ON roots.id = records.id '
+                'ORDER BY roots.rank, records.unit IS NOT NULL, records.unit, records.id'
+            )
+            for _, group in groupby(rows, key=itemgetter(0)):
+                items = []
+                for unit, unit_rows in groupby(group, key=itemgetter(1)):
+                    unit_records = [pickle.loads(x[2]) for x in unit_rows]
+                    if unit is None:
+                        items.extend(unit_records)
+                    else:
+                        items.append(merge_unit(unit_records))
+                yield _order_group(items)
@@ -0,0 +1,293 @@
+"""Re-index a dataset incrementally, parsing only what changed since the previous run
+
+The state of a dataset after each run is kept in a :class:`Manifest`: its directories,
+the size, mtime and hash of each file, and the scroll id, size and files of each record
+that was emitted. On the next run, the manifest is compared to the files on disk to find
+the directories that must be parsed again (see :meth:`Manifest.update`). A directory is
+parsed again if it is new or one of its files was added, changed or deleted, and so is
+the parent of a directory that was added or deleted. Then so are their "neighbours":
+
+- the directories of the other files of the records found in a re-parsed directory,
+  as these records may be merged from files in several directories, and
+- all directories below a directory that is grouped into single records.
+
+Records keep their scroll id from one run to the next as long as they are made from the
+same files. Records of the previous run that are no longer produced are reported as
+tombstones, so they can be deleted from the search index.
+"""
+
+from mdf_matio.parallel import Shard, walk_shards
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set
+from collections import defaultdict
+import tempfile
+import hashlib
+import json
+import os
+
+MANIFEST_VERSION = 1
+"""Version of the manifest format. Manifests of other versions are ignored"""
+
+
+class FileState(NamedTuple):
+    """State of a file when it was indexed"""
+
+    size: int
+    """Size of the file in bytes"""
+    mtime_ns: int
+    """Modification time, in nanoseconds"""
+    sha256: str
+    """Hash of the contents of the file"""
+
+
+class RecordEntry(NamedTuple):
+    """A record emitted by a previous run"""
+
+    scroll_id: int
+    """Scroll id given to the record"""
+    size: int
+    """Total size of the files of the record, as counted in the dataset entry"""
+    files: List[str]
+    """Files of the record, relative to the root of the dataset"""
+
+
+def _hash_file(path: str) -> str:
+    """Compute the SHA-256 hash of a file, reading it in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1024 ** 2), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_file_state(path: str, previous: Optional[FileState] = None) -> FileState:
+    """Get the state of a file
+
+    Hashing the contents is the expensive part, so the hash of the previous state is
+    reused if the size and mtime of the file have not changed.
+
+    Args:
+        path (str): Path of the file
+        previous (FileState): State of the file in the previous run, if any
+    Returns:
+        (FileState) Current state of the file
+    """
+    st = os.stat(path)
+    if previous is not None and previous.size == st.st_size \
+            and previous.mtime_ns == st.st_mtime_ns:
+        return previous
+    return FileState(st.st_size, st.st_mtime_ns, _hash_file(path))
+
+
+def get_record_id(files: List[str], index: int) -> str:
+    """Identify a record by the files it was made from
+
+    Args:
+        files ([str]): Files of the record, relative to the root of the dataset
+        index (int): Position of the record among those made from the same files
+            (e.g., the row of a CSV file)
+    Returns:
+        (str) Identifier of the record, the same on every run
+    """
+    digest = hashlib.sha1('\0'.join(sorted(files)).encode())
+    return f'{digest.hexdigest()}-{index}'
+
+
+def _directory(path: str) -> str:
+    """Get the directory of a path relative to the root of the dataset"""
+    return os.path.dirname(path) or '.'
+
+
+def _is_below(path: str, directory: str) -> bool:
+    """Check whether a relative path is a directory or in the subtree of a directory"""
+    return directory == '.' or path == directory or path.startswith(directory + os.path.sep)
+
+
+class Manifest:
+    """State of a dataset when it was last indexed
+
+    Use :meth:`load` to read the manifest of the previous run (an empty manifest if there
+    was none), :meth:`update` to plan the next run, and :meth:`save` to store the
+    manifest produced by that run.
+    """
+
+    def __init__(self, files: Optional[Dict[str, FileState]] = None,
+                 records: Optional[Dict[str, RecordEntry]] = None,
+                 next_scroll_id: int = 1, directories: Optional[Set[str]] = None):
+        """
+        Args:
+            files (dict): State of each file, keyed by path relative to the dataset root
+            records (dict): Records emitted by the run, keyed by their record id
+            next_scroll_id (int): Scroll id of the next new record. Scroll ids are never
+                reused, so that a new record cannot take the place of a deleted one
+            directories ({str}): Directories of the dataset, relative to its root
+        """
+        self.files = files or {}
+        self.records = records or {}
+        self.next_scroll_id = next_scroll_id
+        self.directories = directories or set()
+
+    @classmethod
+    def load(cls, path: str) -> 'Manifest':
+        """Read a manifest from disk
+
+        Args:
+            path (str): Path of the manifest
+        Returns:
+            (Manifest) The manifest, or an empty manifest if there is none at that path
+        """
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as fp:
+            data = json.load(fp)
+        if data.get('version') != MANIFEST_VERSION:
+            return cls()
+        return cls(dict((k, FileState(*v)) for k, v in data['files'].items()),
+                   dict((k, RecordEntry(*v)) for k, v in data['records'].items()),
+                   data['next_scroll_id'], set(data['directories']))
+
+    def save(self, path: str):
+        """Write the manifest to disk
+
+        The manifest is written to a temporary file that then replaces the previous
+        one, so an interrupted run leaves the manifest of the run before it in place.
+
+        Args:
+            path (str): Path of the manifest
+        """
+        data = {'version': MANIFEST_VERSION, 'next_scroll_id': self.next_scroll_id,
+                'directories': sorted(self.directories), 'files': self.files,
+                'records': self.records}
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(data, fp)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def update(self, data_url: str, grouped_dirs: Optional[List[str]] = None) -> 'IndexUpdate':
+        """Compare the manifest to the files on disk and plan the re-indexing
+
+        Args:
+            data_url (str): Root of the dataset
+            grouped_dirs ([str]): Directories whose contents are grouped into single records
+        Returns:
+            (IndexUpdate) The directories to parse, and the bookkeeping of the new run
+        """
+        # Find the current state of all files, and the directories where they changed
+        files = {}
+        dirty_dirs = set()
+        all_shards = []
+        for root, dirs, paths in walk_shards(data_url):
+            all_shards.append((root, dirs, paths))
+            for path in paths:
+                rel_path = os.path.relpath(path, data_url)
+                previous = self.files.get(rel_path)
+                state = files[rel_path] = get_file_state(path, previous)
+                if previous is None or state.sha256 != previous.sha256:
+                    dirty_dirs.add(_directory(rel_path))
+        dirty_dirs.update(_directory(f) for f in self.files.keys() - files.keys())
+
+        # Parse new directories, and the parents of those added or deleted,
+        #  as parsers may group the subdirectories of a directory
+        all_dirs = [os.path.relpath(shard[0], data_url) for shard in all_shards]
+        added_dirs = set(all_dirs) - self.directories
+        deleted_dirs = self.directories.difference(all_dirs)
+        dirty_dirs.update(added_dirs)
+        dirty_dirs.update(deleted_dirs)
+        dirty_dirs.update(_directory(d) for d in added_dirs | deleted_dirs if d != '.')
+
+        # Add the neighbours of the changed directories until there are no more to add
+        grouped_dirs = [os.path.relpath(d, data_url) for d in grouped_dirs or []]
+        records_by_dir = defaultdict(list)
+        for record_id, entry in self.records.items():
+            for directory in set(map(_directory, entry.files)):
+                records_by_dir[directory].append(record_id)
+        to_check = list(dirty_dirs)
+        while len(to_check) > 0:
+            directory = to_check.pop()
+            neighbours = set()
+            for record_id in records_by_dir.get(directory, []):
+                neighbours.update(map(_directory, self.records[record_id].files))
+            for group_dir in grouped_dirs:
+                if _is_below(directory, group_dir):
+                    neighbours.update(d for d in all_dirs if _is_below(d, group_dir))
+            neighbours.difference_update(dirty_dirs)
+            dirty_dirs.update(neighbours)
+            to_check.extend(neighbours)
+
+        # Records with files in the changed directories are replaced by those of the new run
+        replaced = set(record_id for d in dirty_dirs for record_id in records_by_dir.get(d, []))
+        kept = dict((k, v) for k, v in self.records.items() if k not in replaced)
+        shards = [shard for shard, d in zip(all_shards, all_dirs) if d in dirty_dirs]
+        return IndexUpdate(data_url, shards, self,
+                           Manifest(files, kept, self.next_scroll_id, set(all_dirs)), replaced)
+
+
+class IndexUpdate:
+    """Plan and bookkeeping of an incremental re-indexing
+
+    Records emitted by the run must be passed to :meth:`assign` to be given their scroll
+    id, and :meth:`tombstones` then lists the records of the previous run that were not
+    produced again.
+    """
+
+    def __init__(self, data_url: str, shards: List[Shard], previous: Manifest,
+                 manifest: Manifest, replaced: Set[str]):
+        """
+        Args:
+            data_url (str): Root of the dataset
+            shards ([Shard]): Directories to parse
+            previous (Manifest): Manifest of the previous run
+            manifest (Manifest): Manifest of this run, holding the records that are kept
+            replaced ({str}): Ids of the records of the previous run in the parsed directories
+        """
+        self.data_url = data_url
+        self.shards = shards
+        self.previous = previous
+        self.manifest = manifest
+        self.replaced = replaced
+        self.kept_size = sum(entry.size for entry in manifest.records.values())
+        """Total size of the files of the records that are kept from the previous run"""
+
+    def assign(self, files: List[str], index: int, record: dict) -> dict:
+        """Give a record its scroll id, and add it to the manifest
+
+        Args:
+            files ([str]): Paths of the files the record was made from
+            index (int): Position of the record among those made from the same files
+            record (dict): Validated record, modified in place
+        Returns:
+            (dict) The record
+        """
+        files = [os.path.relpath(f, self.data_url) for f in files]
+        record_id = get_record_id(files, index)
+        previous = self.previous.records.get(record_id)
+        if previous is not None:
+            scroll_id = previous.scroll_id
+        else:
+            scroll_id = self.manifest.next_scroll_id
+            self.manifest.next_scroll_id += 1
+        record['mdf']['scroll_id'] = scroll_id
+        size = sum(f.get('length', 0) for f in record.get('files', []))
+        self.manifest.records[record_id] = RecordEntry(scroll_id, size, files)
+        return record
+
+    def tombstones(self, dataset: dict) -> Iterator[dict]:
+        """Generate the tombstones of the records that were deleted
+
+        Args:
+            dataset (dict): Validated dataset entry
+        Yields:
+            (dict) Tombstone for each record of the previous run that was not produced by
+            this run, ordered by scroll id. Its ``mdf.resource_type`` is ``tombstone``
+        """
+        deleted = [self.previous.records[k] for k in self.replaced
+                   if k not in self.manifest.records]
+        for entry in sorted(deleted):
+            yield {
+                'mdf': {'source_id': dataset['mdf'].get('source_id'),
+                        'scroll_id': entry.scroll_id, 'resource_type': 'tombstone'},
+                'files': [{'path': os.path.join(self.data_url, f)} for f in entry.files]
+            }
@@ -0,0 +1,92 @@
+"""Merge the metadata of records describing the same files
+
+Merging follows the rules of ``mdf_toolbox.dict_merge(..., append_lists=True)`` applied
+from left to right: values already present are kept, objects are merged recursively and
+lists at the top level of the record are extended with the items they do not yet hold.
+
+Unlike folding ``dict_merge`` over the records, which copies the whole merged record at
+each step, the record is merged in place. Only the objects and lists that are modified
+are copied (copy-on-write), so the inputs are left untouched and the cost is linear in
+the size of the records.
+"""
+
+from typing import Dict, Hashable, List, Set
+
+
+def _freeze(value) -> Hashable:
+    """Make a hashable value that compares equal when the JSON values are equal"""
+    if isinstance(value, dict):
+        return frozenset((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return list, tuple(_freeze(v) for v in value)
+    return value
+
+
+class _Merger:
+    """Merges records in place, copying only containers it did not create"""
+
+    def __init__(self):
+        self._owned: Set[int] = set()
+        self._list_items: Dict[int, set] = {}
+
+    def own(self, container):
+        """Get a copy of a container that may be modified, unless this merger made it"""
+        if id(container) in self._owned:
+            return container
+        container = container.copy()
+        self._owned.add(id(container))
+        return container
+
+    def merge(self, base: dict, addition: dict, append_lists: bool = False):
+        """Merge a record into another, which must be owned by this merger
+
+        Args:
+            base (dict): Record being added to, modified in place
+            addition (dict): Record with the additional data, not modified
+            append_lists (bool): Whether to add the new items of lists to lists in base
+        """
+        for key, value in addition.items():
+            if key not in base:
+                base[key] = value
+                continue
+            current = base[key]
+            if isinstance(value, dict) and isinstance(current, dict):
+                # As in dict_merge, lists are only appended at the top level
+                current = base[key] = self.own(current)
+                self.merge(current, value)
+            elif append_lists and isinstance(value, list) and isinstance(current, list):
+                current = base[key] = self.own(current)
+                self._extend(current, value)
+
+    def _extend(self, current: list, items: list):
+        """Append the items not yet in an owned list"""
+        try:
+            if id(current) not in self._list_items:
+                self._list_items[id(current)] = set(_freeze(x) for x in current)
+            seen = self._list_items[id(current)]
+            for item in items:
+                frozen = _freeze(item)
+                if frozen not in seen:
+                    seen.add(frozen)
+                    current.append(item)
+        except TypeError:
+            # Values that cannot be hashed, fall back to comparing them one by one
+            self._list_items.pop(id(current), None)
+            current.extend([x for x in items if x not in current])
+
+
+def merge_metadata(records: List[dict]) -> dict:
+    """Merge records, earlier records taking precedence
+
+    Args:
+        records ([dict]): Records to merge
+    Returns:
+        (dict) Merged record. May share unmodified objects with the input records
+    """
+    if len(records) == 1:
+        return records[0]
+    merger = _Merger()
+    output = merger.own(records[0])
+    for record in records[1:]:
+        merger.merge(output, record, append_lists=True)
+    return output
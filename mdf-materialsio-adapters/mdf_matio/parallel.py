@@ -0,0 +1,133 @@
+"""Run MaterialsIO parsers over a directory tree using a pool of processes"""
+
+from materials_io.utils.interface import (ParseResult, get_available_adapters, get_parser,
+                                          get_adapter)
+from typing import Iterable, Iterator, List, Tuple, Optional
+from multiprocessing import Pool
+from functools import lru_cache, partial
+from mdf_matio.pipeline import imap_bounded
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+Shard = Tuple[str, List[str], List[str]]
+"""A single directory to be parsed: its path, subdirectories and files"""
+
+
+def walk_shards(directory: str) -> Iterator[Shard]:
+    """Split a directory tree into shards of one directory each
+
+    Directories and files are visited in sorted order, so the shards are always
+    produced in the same order for the same tree.
+
+    Args:
+        directory (str): Root of the tree
+    Yields:
+        (Shard): Path, subdirectories and files of each directory
+    """
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        yield (root, [os.path.join(root, d) for d in dirs],
+               [os.path.join(root, f) for f in sorted(files)])
+
+
+@lru_cache(maxsize=None)
+def _load_parser(name: str):
+    """Load a parser and the adapter matching its name, once per worker
+
+    Args:
+        name (str): Name of the parser
+    Returns:
+        (BaseParser, BaseAdapter) Parser and its adapter, or None if there is no adapter
+    """
+    adapter = get_adapter(name) if name in get_available_adapters() else None
+    return get_parser(name), adapter
+
+
+def parse_shard(shard: Shard, parsers: List[str], parser_context: dict,
+                adapter_context: dict) -> List[ParseResult]:
+    """Run parsers and their matching adapters on the files of a single directory
+
+    Args:
+        shard (Shard): Directory to be parsed
+        parsers ([str]): Names of the parsers to run
+        parser_context (dict): Context for each parser, keyed by parser name
+        adapter_context (dict): Context for each adapter, keyed by parser name
+    Returns:
+        ([ParseResult]) Results for each parser, in the order of ``parsers``
+    """
+    root, dirs, files = shard
+    results = []
+    for name in parsers:
+        parser, adapter = _load_parser(name)
+        try:
+            groups = list(parser.group(files, dirs, parser_context.get(name)))
+        except Exception:
+            logger.debug(f'Parser {name} failed to group files in {root}', exc_info=True)
+            continue
+        for group in groups:
+            try:
+                metadata = parser.parse(group, parser_context.get(name))
+                if adapter is not None:
+                    metadata = adapter.transform(metadata, adapter_context.get(name))
+            except Exception:
+                logger.debug(f'Parser {name} failed on {group}', exc_info=True)
+                continue
+            if metadata is not None:
+                results.append(ParseResult(group, name, metadata))
+    return results
+
+
+def parse_shards(shards: Iterable[Shard], include_parsers: List[str],
+                 parser_context: Optional[dict] = None,
+                 adapter_context: Optional[dict] = None,
+                 n_workers: Optional[int] = None,
+                 max_pending: Optional[int] = None) -> Iterator[ParseResult]:
+    """Run parsers with their matching adapters on selected directories
+
+    Shards are read only as the results are consumed, no more than ``max_pending`` ahead.
+
+    Args:
+        shards ([Shard]): Directories to be parsed
+        include_parsers ([str]): Names of the parsers to run
+        parser_context (dict): Context for each parser, keyed by parser name
+        adapter_context (dict): Context for each adapter, keyed by parser name
+        n_workers (int): Number of worker processes. Default None, to parse in this process
+        max_pending (int): Number of shards being parsed at a time by the workers.
+            Default is twice the number of workers
+    Yields:
+        (ParseResult) Results of parsing, in the order of the shards
+    """
+    func = partial(parse_shard, parsers=sorted(include_parsers),
+                   parser_context=parser_context or {}, adapter_context=adapter_context or {})
+    if n_workers is None:
+        for shard in shards:
+            yield from func(shard)
+        return
+    with Pool(n_workers) as pool:
+        for results in imap_bounded(pool, func, shards, max_pending or 2 * n_workers):
+            yield from results
+
+
+def run_all_parsers_parallel(directory: str, include_parsers: List[str],
+                             parser_context: Optional[dict] = None,
+                             adapter_context: Optional[dict] = None,
+                             n_workers: Optional[int] = None) -> Iterator[ParseResult]:
+    """Run parsers with their matching adapters on a directory tree in parallel
+
+    Each directory of the tree is parsed by a worker process. Results are returned in
+    the order of the directories in a sorted walk of the tree, regardless of which
+    worker finishes first, so the output is deterministic.
+
+    Args:
+        directory (str): Root of the tree
+        include_parsers ([str]): Names of the parsers to run
+        parser_context (dict): Context for each parser, keyed by parser name
+        adapter_context (dict): Context for each adapter, keyed by parser name
+        n_workers (int): Number of worker processes. Default is the number of CPUs
+    Yields:
+        (ParseResult) Results of parsing
+    """
+    return parse_shards(walk_shards(directory), include_parsers, parser_context,
+                        adapter_context, n_workers=n_workers or os.cpu_count())
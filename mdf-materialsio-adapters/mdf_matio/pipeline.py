@@ -0,0 +1,300 @@
+"""Run the stages of indexing concurrently, connected by bounded queues
+
+Each stage of a :class:`Pipeline` is a function that takes an iterator over the outputs of
+the previous stage and returns an iterator over its own outputs, like the generators that
+make up :func:`~mdf_matio.generate_search_index`. Every stage runs in its own thread and
+passes its outputs to the next through a queue of bounded size, so a fast stage never
+gets more than ``queue_size`` items ahead of a slow one (backpressure).
+
+Threads suit the stages that wait on I/O. Stages that are CPU-bound should hand their work
+to a pool of processes with :func:`imap_bounded`, as :func:`~mdf_matio.parallel.parse_shards`
+and :meth:`~mdf_matio.validator.MDFValidator.validate_records` do, with their thread keeping
+the order of the results. The pool holds a bounded number of items too, so a stage never
+reads more than ``queue_size`` items and the items in its pool ahead of the next stage.
+
+The number of items, the time spent working and waiting, and the depth of the output
+queue of each stage are available while the pipeline runs from :meth:`Pipeline.metrics`.
+"""
+
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from multiprocessing.pool import Pool
+from collections import deque
+from threading import Event, Thread
+from queue import Queue, Empty, Full
+import time
+
+Stage = Callable[[Iterator], Iterator]
+"""A stage of the pipeline: a function from an iterator of inputs to an iterator of outputs"""
+
+_DONE = object()
+"""Marks the end of the outputs of a stage"""
+
+
+def imap_bounded(pool: Pool, func: Callable, items: Iterable, max_pending: int) -> Iterator:
+    """Apply a function to items in a pool of processes, like ``Pool.imap``, but with no
+    more than ``max_pending`` items submitted ahead of the results consumed
+
+    ``Pool.imap`` reads its items as fast as it can, whatever the pace of the consumer.
+    Here the oldest item is waited on before another is read.
+
+    Args:
+        pool (Pool): Pool of worker processes
+        func (Callable): Function to apply
+        items ([object]): Items to apply it to, read only as the results are consumed
+        max_pending (int): Number of items in the pool at a time
+    Yields:
+        (object) Result for each item, in the order of the items
+    """
+    pending = deque()
+    for item in items:
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (item,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+class _Failure(NamedTuple):
+    """Exception raised by a stage, passed down the pipeline to be raised by the consumer"""
+
+    error: BaseException
+
+
+class _Stopped(Exception):
+    """Raised in a stage when the pipeline is stopped, or an earlier stage failed"""
+    pass
+
+
+class StageMetrics:
+    """Counters for one stage of a pipeline"""
+
+    def __init__(self, name: str, queue: Queue):
+        """
+        Args:
+            name (str): Name of the stage
+            queue (Queue): Output queue of the stage
+        """
+        self.name = name
+        self.queue = queue
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_time = 0.
+        self.input_wait_time = 0.
+        self.output_wait_time = 0.
+        self.max_queue_depth = 0
+        self.start_time: Optional[float] = None
+        self.first_output_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+
+    def as_dict(self) -> dict:
+        """Get the metrics of the stage
+
+        Returns:
+            (dict) Counts of items taken in and put out, throughput in items per second
+            of elapsed time, seconds spent working (``busy_time``) or waiting on the
+            input and output queues, seconds to the first output, and the current and
+            largest depth of the output queue
+        """
+        if self.start_time is None:
+            elapsed = 0.
+        else:
+            elapsed = (self.end_time or time.perf_counter()) - self.start_time
+        return {
+            'items_in': self.items_in,
+            'items_out': self.items_out,
+            'throughput': self.items_out / elapsed if elapsed > 0 else 0.,
+            'elapsed_time': elapsed,
+            'busy_time': self.busy_time,
+            'input_wait_time': self.input_wait_time,
+            'output_wait_time': self.output_wait_time,
+            'time_to_first_output': None if self.first_output_time is None
+            else self.first_output_time - self.start_time,
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            'running': self.start_time is not None and self.end_time is None
+        }
+
+
+class Pipeline:
+    """Stages connected by bounded queues, each running in its own thread
+
+    Build the pipeline by adding stages in order, then iterate over :meth:`run`::
+
+        pipeline = Pipeline(queue_size=100)
+        pipeline.add_stage('parse', parse).add_stage('merge', merge)
+        for record in pipeline.run(directories):
+            ...
+
+    An exception raised by a stage stops the pipeline and is raised again to the consumer.
+    Closing the iterator returned by :meth:`run` early stops all stages.
+    """
+
+    def __init__(self, queue_size: int = 1000, poll_interval: float = 0.1):
+        """
+        Args:
+            queue_size (int): Largest number of items held between two stages
+            poll_interval (float): Seconds between checks of whether the pipeline was
+                stopped, while a stage waits on a queue
+        """
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self._stages: List[Tuple[str, Stage]] = []
+        self._metrics: Dict[str, StageMetrics] = {}
+        self._stop = Event()
+
+    def add_stage(self, name: str, func: Stage) -> 'Pipeline':
+        """Add a stage at the end of the pipeline
+
+        Args:
+            name (str): Name of the stage, used to report its metrics
+            func: Function from an iterator over the outputs of the previous stage (or
+                over the source, for the first stage) to an iterator of outputs
+        Returns:
+            (Pipeline) This pipeline, so calls can be chained
+        """
+        if any(name == x[0] for x in self._stages):
+            raise ValueError(f'Stage {name} already exists')
+        self._stages.append((name, func))
+        return self
+
+    def metrics(self) -> Dict[str, dict]:
+        """Get the metrics of each stage, which is safe to call while the pipeline runs
+
+        Returns:
+            (dict) Metrics of each stage (see :meth:`StageMetrics.as_dict`), by stage name
+        """
+        return dict((name, m.as_dict()) for name, m in self._metrics.items())
+
+    def _get(self, queue: Queue, metrics: StageMetrics):
+        """Take an item from a queue, waiting until there is one or the pipeline stops"""
+        start = time.perf_counter()
+        try:
+            while True:
+                if self._stop.is_set():
+                    raise _Stopped()
+                try:
+                    return queue.get(timeout=self.poll_interval)
+                except Empty:
+                    continue
+        finally:
+            metrics.input_wait_time += time.perf_counter() - start
+
+    def _put(self, queue: Queue, item, metrics: StageMetrics):
+        """Put an item in a queue, waiting until there is space or the pipeline stops"""
+        start = time.perf_counter()
+        try:
+            while True:
+                if self._stop.is_set():
+                    raise _Stopped()
+                try:
+                    queue.put(item, timeout=self.poll_interval)
+                    break
+                except Full:
+                    continue
+        finally:
+            metrics.output_wait_time += time.perf_counter() - start
+        metrics.max_queue_depth = max(metrics.max_queue_depth, queue.qsize())
+
+    def _fail(self, queue: Queue, error: BaseException, metrics: StageMetrics):
+        """Pass an exception to the next stage, unless the pipeline was stopped"""
+        try:
+            self._put(queue, _Failure(error), metrics)
+        except _Stopped:
+            pass
+
+    def _read(self, items: Iterable, queue: Optional[Queue],
+              metrics: StageMetrics) -> Iterator:
+        """Iterate over the input of a stage, from the source or the previous queue"""
+        if queue is None:
+            # Time spent producing the source counts as time waiting for input
+            items = iter(items)
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                finally:
+                    metrics.input_wait_time += time.perf_counter() - start
+                metrics.items_in += 1
+                yield item
+        while True:
+            item = self._get(queue, metrics)
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise _Stopped() from item.error
+            metrics.items_in += 1
+            yield item
+
+    def _run_stage(self, func: Stage, items: Iterable, in_queue: Optional[Queue],
+                   out_queue: Queue, metrics: StageMetrics):
+        """Run a stage until its input is exhausted, putting its outputs in its queue"""
+        metrics.start_time = time.perf_counter()
+        outputs = None
+        try:
+            outputs = iter(func(self._read(items, in_queue, metrics)))
+            while True:
+                start = time.perf_counter()
+                waited = metrics.input_wait_time
+                try:
+                    item = next(outputs)
+                except StopIteration:
+                    break
+                metrics.busy_time += time.perf_counter() - start \
+                    - (metrics.input_wait_time - waited)
+                if metrics.first_output_time is None:
+                    metrics.first_output_time = time.perf_counter()
+                self._put(out_queue, item, metrics)
+                metrics.items_out += 1
+            self._put(out_queue, _DONE, metrics)
+        except _Stopped as e:
+            # Pass the failure of an earlier stage down to the consumer
+            if e.__cause__ is not None:
+                self._fail(out_queue, e.__cause__, metrics)
+        except BaseException as e:
+            self._fail(out_queue, e, metrics)
+        finally:
+            if hasattr(outputs, 'close'):
+                outputs.close()
+            if in_queue is None and hasattr(items, 'close'):
+                items.close()
+            metrics.end_time = time.perf_counter()
+
+    def run(self, source: Iterable) -> Iterator:
+        """Run the pipeline on a source of items
+
+        Args:
+            source: Inputs to the first stage
+        Yields:
+            Outputs of the last stage, in order
+        """
+        if len(self._stages) == 0:
+            raise ValueError('The pipeline has no stages')
+        self._stop.clear()
+
+        # Start a thread for each stage
+        threads = []
+        in_queue = None
+        for name, func in self._stages:
+            out_queue = Queue(maxsize=self.queue_size)
+            metrics = self._metrics[name] = StageMetrics(name, out_queue)
+            thread = Thread(target=self._run_stage, name=f'pipeline-{name}', daemon=True,
+                            args=(func, source, in_queue, out_queue, metrics))
+            threads.append(thread)
+            in_queue = out_queue
+
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = in_queue.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,216 @@
+"""Project JSON documents onto a fixed set of fields
+
+:func:`project` gives the same output as ``mdf_toolbox.translate_json`` for a mapping of
+each field onto itself with ``[]``, ``{}`` and ``None`` as N/A values, but without
+flattening the whole document first. The fields are compiled once into a trie of keys
+(see :func:`compile_paths`), and only the keys of the document found in the trie are
+visited. Empty values are pruned in the same walk.
+
+Lists are flattened the way ``mdf_toolbox.flatten_json`` flattens them: lists of objects
+are merged field by field, nested lists of values are concatenated and lists holding a
+single value are replaced by that value.
+"""
+
+from typing import Iterable
+
+_NA_VALUES = [[], {}, None]
+"""Values that are not copied to the output"""
+
+_UNDEFINED = object()
+"""Key holding the values of a list that mixes objects and values (``flatten_undefined``)"""
+
+_ABSENT = object()
+"""Marker for a field without a value"""
+
+_SELF = object()
+"""Key marking a node of the trie that is a field itself, as well as the parent of fields"""
+
+_EMPTY = {}
+"""Trie without any fields, used to find the values of a list"""
+
+
+def compile_paths(paths: Iterable[str]) -> dict:
+    """Compile fields in dot notation into a trie of keys
+
+    Args:
+        paths ([str]): Fields to keep, such as ``material.composition``
+    Returns:
+        (dict) Trie where each field is a nested dict, and the last key of each
+        field maps to ``None``. Fields that are also the parent of other fields
+        are marked by a ``_SELF`` key instead
+    """
+    trie = {}
+    for path in sorted(paths, key=lambda x: x.count('.'), reverse=True):
+        fields = path.split('.')
+        node = trie
+        for field in fields[:-1]:
+            node = node.setdefault(field, {})
+        if isinstance(node.get(fields[-1]), dict):
+            node[fields[-1]][_SELF] = None
+        else:
+            node[fields[-1]] = None
+    return trie
+
+
+def project(document: dict, trie: dict) -> dict:
+    """Keep only the fields of a document that are in a trie, and drop empty values
+
+    Args:
+        document (dict): Document to project
+        trie (dict): Fields to keep, from :func:`compile_paths`
+    Returns:
+        (dict) New document with the non-empty values of the fields
+    """
+    output = {}
+    for key, value in document.items():
+        node = trie.get(key, _ABSENT)
+        if node is _ABSENT:
+            continue
+        if node is None:
+            value = _clean(_terminal(value))
+        elif isinstance(value, dict):
+            value = project(value, node) or _ABSENT
+        else:
+            value = _finish(_flatten_field(value, node), node)
+        if value is not _ABSENT:
+            output[key] = value
+    return output
+
+
+def _finish(flat: dict, trie: dict):
+    """Remove N/A values and empty objects from a flattened field with child fields
+
+    A field can only hold either a value or child fields. As with ``translate_json``,
+    the value wins if both are present.
+    """
+    if _SELF in trie:
+        value = _clean(flat.get(_UNDEFINED, _ABSENT))
+        if value is not _ABSENT:
+            return value
+    output = {}
+    for key, value in flat.items():
+        if key is _UNDEFINED:
+            continue
+        # Only fields with children are flattened to objects
+        value = _finish(value, trie[key]) if isinstance(value, dict) else _clean(value)
+        if value is not _ABSENT:
+            output[key] = value
+    return output or _ABSENT
+
+
+def _clean(value):
+    """Remove N/A values from a field, returning ``_ABSENT`` if nothing is left"""
+    if value is _ABSENT:
+        return value
+    if isinstance(value, list):
+        value = [x for x in value if x not in _NA_VALUES]
+    if value in _NA_VALUES:
+        return _ABSENT
+    return value
+
+
+def _terminal(value):
+    """Get the value that ``flatten_json`` assigns to a field itself, not to its children"""
+    if isinstance(value, dict):
+        return _ABSENT
+    if isinstance(value, list):
+        value = _flatten_list(value, _EMPTY)
+        if isinstance(value, dict):
+            return value.get(_UNDEFINED, _ABSENT)
+    return value
+
+
+def _flatten_field(value, trie: dict) -> dict:
+    """Flatten the value of a field with child fields
+
+    Returns:
+        (dict) Values of the child fields. The value of the field itself, if it has
+        one and is in the trie, is held under ``_UNDEFINED``
+    """
+    if isinstance(value, dict):
+        return _flatten_dict(value, trie)
+    if isinstance(value, list):
+        value = _flatten_list(value, trie)
+        if isinstance(value, dict):
+            if _SELF not in trie:
+                value.pop(_UNDEFINED, None)
+            return value
+    return {_UNDEFINED: value} if _SELF in trie else {}
+
+
+def _flatten_dict(document: dict, trie: dict) -> dict:
+    """Flatten an object held in a list, keeping only the fields in the trie"""
+    output = {}
+    for key, value in document.items():
+        node = trie.get(key, _ABSENT)
+        if node is _ABSENT:
+            continue
+        if node is None:
+            value = _terminal(value)
+            if value is not _ABSENT:
+                output[key] = value
+        else:
+            value = _flatten_field(value, node)
+            if value:
+                output[key] = value
+    return output
+
+
+def _flatten_list(values: list, trie: dict):
+    """Flatten a list, keeping only the fields in the trie
+
+    Returns:
+        (dict) Fields merged from the objects in the list, if it holds any objects.
+        Otherwise, the values in the list (or the single value)
+    """
+    merged = {}
+    terminals = []
+    objects = []
+    for value in values:
+        if isinstance(value, dict):
+            flat = _flatten_dict(value, trie)
+        elif isinstance(value, list):
+            flat = _flatten_list(value, trie)
+        else:
+            terminals.append(value)
+            continue
+
+        if isinstance(flat, dict):
+            objects.append(value)
+            _merge(merged, flat, trie)
+        elif isinstance(flat, list):
+            terminals.extend(flat)
+        else:
+            terminals.append(flat)
+
+    if not terminals:
+        return merged
+    if len(terminals) == 1:
+        terminals = terminals[0]
+    # Fields outside of the trie still make this a mixed list
+    if merged or any(_has_values(x) for x in objects):
+        merged[_UNDEFINED] = terminals
+        return merged
+    return terminals
+
+
+def _merge(merged: dict, flat: dict, trie: dict):
+    """Merge the fields of an object into those of the objects before it in a list"""
+    for key, value in flat.items():
+        if isinstance(value, dict):
+            _merge(merged.setdefault(key, {}), value, trie[key])
+        elif key not in merged:
+            merged[key] = value
+        elif type(merged[key]) is not list:
+            merged[key] = [merged[key], value]
+        else:
+            merged[key].append(value)
+
+
+def _has_values(value) -> bool:
+    """Whether a container holds any value other than containers, at any depth"""
+    if isinstance(value, dict):
+        return any(_has_values(x) for x in value.values())
+    if isinstance(value, list):
+        return any(_has_values(x) for x in value)
+    return True
@@ -0,0 +1,218 @@
+"""Registry of the MDF schemas, shared by every validator and adapter in a process
+
+The schemas bundled with this repository (``data-schemas/schemas``) are loaded once and
+placed in the store of a :class:`jsonschema.RefResolver`, so that ``record.json`` and all of
+the schemas it references resolve from memory rather than from GitHub.
+Set the ``MDF_SCHEMA_DIR`` environment variable to use schemas from another directory.
+
+Validators for each schema are also compiled once per process, using
+`fastjsonschema <https://horejsek.github.io/python-fastjsonschema/>`_ if it is installed.
+
+The fields of ``record.json`` used by the adapters are computed once per process too, and
+are shipped with the package for the bundled branch (``record_fields.json``). Regenerate
+that file after updating the bundled schemas by running ``python -m mdf_matio.schemas``.
+"""
+
+from urllib.parse import urljoin
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+import mdf_toolbox
+import jsonschema
+import hashlib
+import json
+import os
+
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+SCHEMA_REPO_URI = "https://raw.githubusercontent.com/materials-data-facility/" \
+                  "data-schemas/{}/schemas/"
+"""URI of the schemas for a certain branch of the data-schemas repository"""
+
+BUNDLED_SCHEMA_DIR = os.environ.get(
+    'MDF_SCHEMA_DIR',
+    os.path.join(os.path.dirname(__file__), '..', '..', 'data-schemas', 'schemas')
+)
+"""Directory holding the bundled copy of the schemas"""
+
+BUNDLED_SCHEMA_BRANCH = 'master'
+"""Branch of the data-schemas repository that the bundled schemas are a copy of"""
+
+RECORD_FIELDS_PATH = os.path.join(os.path.dirname(__file__), 'record_fields.json')
+"""Path to the fields of the record schema, precomputed for the bundled branch"""
+
+
+def get_schema_uri(schema_branch: str = 'master') -> str:
+    """Get the URI of the schemas on a certain branch of the data-schemas repository
+
+    Args:
+        schema_branch (str): Name of the branch
+    Returns:
+        (str) Base URI of the schemas
+    """
+    return SCHEMA_REPO_URI.format(schema_branch)
+
+
+@lru_cache(maxsize=None)
+def load_schema_store(schema_dir: str, base_uri: str) -> Dict[str, dict]:
+    """Load all schemas from a directory
+
+    Args:
+        schema_dir (str): Directory holding the schemas
+        base_uri (str): URI that the schemas should be resolved as being from
+    Returns:
+        (dict) Map of the URI of each schema to its contents
+    """
+    store = {}
+    for name in sorted(os.listdir(schema_dir)):
+        if name.endswith('.json'):
+            with open(os.path.join(schema_dir, name)) as fp:
+                store[urljoin(base_uri, name)] = json.load(fp)
+    return store
+
+
+@lru_cache(maxsize=None)
+def get_ref_resolver(base_uri: str) -> jsonschema.RefResolver:
+    """Get the resolver for schemas at a certain URI, creating it once per process
+
+    The store of the resolver is preloaded with the bundled schemas if the URI is that of
+    the branch they are a copy of, or with all schemas in the directory for ``file://``
+    URIs. Other schemas are fetched over the network when first needed, and then cached.
+
+    Args:
+        base_uri (str): Base URI of the schemas
+    Returns:
+        (RefResolver) Resolver shared by all users of these schemas
+    """
+    store = {}
+    if base_uri == get_schema_uri(BUNDLED_SCHEMA_BRANCH) and os.path.isdir(BUNDLED_SCHEMA_DIR):
+        store = load_schema_store(BUNDLED_SCHEMA_DIR, base_uri)
+    elif base_uri.startswith('file://') and os.path.isdir(base_uri[len('file://'):]):
+        store = load_schema_store(base_uri[len('file://'):], base_uri)
+    return jsonschema.RefResolver(base_uri, None, store=store)
+
+
+def get_schema(name: str, base_uri: str = get_schema_uri()) -> dict:
+    """Get a schema by name
+
+    Args:
+        name (str): Name of the schema file (e.g., ``record.json``)
+        base_uri (str): Base URI of the schemas. Default is the ``master`` branch
+    Returns:
+        (dict) Schema
+    """
+    return get_ref_resolver(base_uri).resolve(name)[1]
+
+
+@lru_cache(maxsize=None)
+def compile_validator(name: str, base_uri: str = get_schema_uri()) -> Callable[[dict], None]:
+    """Get a validator for a schema, compiling it once per process
+
+    If ``fastjsonschema`` is installed, the schema is compiled to Python code with all
+    references resolved through the shared resolver. Otherwise, or if ``fastjsonschema``
+    rejects the schema, a :mod:`jsonschema` validator for the schema's draft is built once
+    and reused.
+    In both cases, formats are not checked and no defaults are filled in, matching
+    :func:`jsonschema.validate`.
+
+    Args:
+        name (str): Name of the schema file (e.g., ``record.json``)
+        base_uri (str): Base URI of the schemas. Default is the ``master`` branch
+    Returns:
+        Function that takes a document and raises a :class:`jsonschema.ValidationError`
+        if it is invalid
+    """
+    resolver = get_ref_resolver(base_uri)
+    schema = get_schema(name, base_uri)
+
+    if fastjsonschema is not None:
+        handlers = dict((scheme, resolver.resolve_from_url) for scheme in ('http', 'https', 'file'))
+        formats = {'date-time': lambda x: True, 'uri': lambda x: True}
+        # Give the schema its URI, so that relative references resolve to the store
+        try:
+            compiled = fastjsonschema.compile(dict(schema, id=urljoin(base_uri, name)),
+                                              handlers=handlers, formats=formats,
+                                              use_default=False)
+        except fastjsonschema.JsonSchemaDefinitionException:
+            # Stricter than jsonschema about some schema constructs, fall back to it
+            compiled = None
+
+        if compiled is not None:
+            def validate(document):
+                try:
+                    compiled(document)
+                except fastjsonschema.JsonSchemaValueException as e:
+                    raise jsonschema.ValidationError(e.message) from e
+            return validate
+
+    validator = jsonschema.validators.validator_for(schema)(schema, resolver=resolver)
+
+    def validate(document):
+        error = jsonschema.exceptions.best_match(validator.iter_errors(document))
+        if error is not None:
+            raise error
+    return validate
+
+
+def _compute_record_fields(base_uri: str) -> Tuple[str, ...]:
+    """Expand the record schema and list its fields
+
+    Args:
+        base_uri (str): Base URI of the schemas
+    Returns:
+        ((str)) Fields of the record schema that hold values, in dot notation
+    """
+    resolver = get_ref_resolver(base_uri)
+    full_schema = mdf_toolbox.expand_jsonschema(get_schema('record.json', base_uri),
+                                                resolver=resolver)
+    return tuple(mdf_toolbox.condense_jsonschema(full_schema, include_containers=False,
+                                                 list_items=False))
+
+
+def _hash_bundled_schemas() -> Optional[str]:
+    """Hash the contents of the bundled schemas, if they are available"""
+    if not os.path.isdir(BUNDLED_SCHEMA_DIR):
+        return None
+    store = load_schema_store(BUNDLED_SCHEMA_DIR, get_schema_uri(BUNDLED_SCHEMA_BRANCH))
+    return hashlib.sha256(json.dumps(store, sort_keys=True).encode()).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def get_record_fields(base_uri: str = get_schema_uri()) -> Tuple[str, ...]:
+    """Get the fields of the record schema, computing them once per process
+
+    For the bundled branch, the fields are read from ``record_fields.json`` unless the
+    bundled schemas have changed since it was written.
+
+    Args:
+        base_uri (str): Base URI of the schemas. Default is the ``master`` branch
+    Returns:
+        ((str)) Fields of the record schema that hold values, in dot notation
+        (e.g., ``material.composition``)
+    """
+    if base_uri == get_schema_uri(BUNDLED_SCHEMA_BRANCH) and os.path.isfile(RECORD_FIELDS_PATH):
+        with open(RECORD_FIELDS_PATH) as fp:
+            precomputed = json.load(fp)
+        schema_hash = _hash_bundled_schemas()
+        if schema_hash is None or schema_hash == precomputed['schema_hash']:
+            return tuple(precomputed['fields'])
+    return _compute_record_fields(base_uri)
+
+
+def write_record_fields(path: str = RECORD_FIELDS_PATH):
+    """Write the fields of the bundled record schema, for :func:`get_record_fields`
+
+    Args:
+        path (str): Path to the output file
+    """
+    fields = _compute_record_fields(get_schema_uri(BUNDLED_SCHEMA_BRANCH))
+    with open(path, 'w') as fp:
+        json.dump({'branch': BUNDLED_SCHEMA_BRANCH, 'schema_hash': _hash_bundled_schemas(),
+                   'fields': fields}, fp, indent=2)
+        fp.write('\n')
+
+
+if __name__ == "__main__":
+    write_record_fields()
@@ -0,0 +1,263 @@
+"""Write records as compressed NDJSON shards, ready to be ingested in bulk
+
+Records are written one per line (`NDJSON <http://ndjson.org/>`_) into shards of a bounded
+number of records and size, each a gzip or Zstandard-compressed file. A manifest lists
+the shards with their number of records, size and hash, so that each shard can be sent
+to Globus Search as one ingest batch and checked before it is.
+
+Records are encoded as compact JSON with `orjson <https://github.com/ijl/orjson>`_ if it is
+installed, and with the ``json`` module otherwise. Both decode to the same records, but the
+bytes can differ: floats in exponent form are written ``1e16`` by orjson and ``1e+16`` by
+``json``, so the sizes and hashes in the manifest depend on the encoder. NaN and Infinity are
+not JSON, and are rejected by :class:`~mdf_matio.validator.MDFValidator`; given them anyway,
+``json`` raises a ValueError where orjson writes ``null``.
+Zstandard compression requires `zstandard <https://github.com/indygreg/python-zstandard>`_.
+"""
+
+from typing import Iterable, Optional
+import tempfile
+import hashlib
+import json
+import gzip
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MANIFEST_VERSION = 1
+"""Version of the format of the manifest"""
+
+_EXTENSIONS = {None: '.ndjson', 'gzip': '.ndjson.gz', 'zstd': '.ndjson.zst'}
+"""File extension for each compression"""
+
+_DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+"""Default compression level for each compression, trading size for speed"""
+
+
+def _dumps_json(record: dict) -> bytes:
+    """Encode a record as a line of compact JSON, with the json module"""
+    return json.dumps(record, separators=(',', ':'), ensure_ascii=False,
+                      allow_nan=False).encode() + b'\n'
+
+
+def _dumps_orjson(record: dict) -> bytes:
+    """Encode a record as a line of compact JSON, with orjson"""
+    return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+
+
+dumps = _dumps_json if orjson is None else _dumps_orjson
+"""Encode a record as a line of NDJSON, in bytes"""
+
+
+class ShardSink:
+    """Writes records to compressed NDJSON shards, and a manifest of the shards
+
+    Use the sink as a context manager. The manifest is written when it exits without
+    an error::
+
+        with ShardSink('output', compression='gzip', max_records=10000) as sink:
+            sink.write_all(records)
+
+    Each shard is written to a temporary file that is renamed once the shard is complete,
+    so a shard listed in the manifest or present under its final name is always whole.
+    Encoded records are buffered and compressed in blocks rather than one at a time.
+    """
+
+    def __init__(self, directory: str, prefix: str = 'records',
+                 compression: Optional[str] = 'gzip', max_records: int = 10000,
+                 max_bytes: Optional[int] = 10 * 1024 ** 2, level: Optional[int] = None,
+                 buffer_size: int = 1024 ** 2):
+        """
+        Args:
+            directory (str): Directory of the shards and the manifest, created if needed
+            prefix (str): Start of the names of the shards, and of the manifest
+                (``<prefix>-manifest.json``)
+            compression (str): ``gzip``, ``zstd`` or None, for no compression
+            max_records (int): Largest number of records in a shard
+            max_bytes (int): Largest uncompressed size of a shard, in bytes. A shard always
+                holds at least one record. Default is 10 MiB, the size of the largest
+                ingest request accepted by Globus Search. None for no limit
+            level (int): Compression level. Default is 6 for gzip and 3 for Zstandard
+            buffer_size (int): Bytes of encoded records compressed at a time
+        """
+        if compression not in _EXTENSIONS:
+            raise ValueError(f'Unknown compression: {compression}')
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('Zstandard compression requires the zstandard package')
+        self.directory = directory
+        self.prefix = prefix
+        self.compression = compression
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.level = _DEFAULT_LEVELS.get(compression) if level is None else level
+        self.buffer_size = buffer_size
+        self.shards = []
+        self.metadata = {}  # Additional information written in the manifest
+        self.manifest = None  # Manifest, once the sink is closed
+        os.makedirs(directory, exist_ok=True)
+
+        # State of the shard being written
+        self._file = None
+        self._writer = None
+        self._tmp_path = None
+        self._buffer = []
+        self._buffered = 0
+        self._records = 0
+        self._bytes = 0
+
+    @property
+    def records(self) -> int:
+        """Number of records written so far"""
+        return sum(x['records'] for x in self.shards) + self._records
+
+    @property
+    def manifest_path(self) -> str:
+        """Path of the manifest"""
+        return os.path.join(self.directory, f'{self.prefix}-manifest.json')
+
+    def _open(self):
+        """Start a new shard"""
+        fd, self._tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+        if self.compression == 'gzip':
+            # No file name or time in the header, so the same records give the same bytes
+            self._writer = gzip.GzipFile(filename='', mode='wb', fileobj=self._file,
+                                         compresslevel=self.level, mtime=0)
+        elif self.compression == 'zstd':
+            self._writer = zstandard.ZstdCompressor(level=self.level) \
+                .stream_writer(self._file, closefd=False)
+        else:
+            self._writer = self._file
+
+    def _flush(self):
+        """Compress the buffered records"""
+        if self._buffer:
+            self._writer.write(b''.join(self._buffer))
+            self._buffer.clear()
+            self._buffered = 0
+
+    def _finish(self):
+        """Complete the current shard, moving it into place and adding it to the manifest"""
+        if self._file is None:
+            return
+        self._flush()
+        if self._writer is not self._file:
+            self._writer.close()
+        self._file.close()
+
+        name = f'{self.prefix}-{len(self.shards):05d}{_EXTENSIONS[self.compression]}'
+        path = os.path.join(self.directory, name)
+        digest = hashlib.sha256()
+        with open(self._tmp_path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1024 ** 2), b''):
+                digest.update(chunk)
+        os.replace(self._tmp_path, path)
+        self.shards.append({'path': name, 'records': self._records, 'bytes': self._bytes,
+                            'compressed_bytes': os.path.getsize(path),
+                            'sha256': digest.hexdigest()})
+        self._file = self._writer = self._tmp_path = None
+        self._records = self._bytes = 0
+
+    def write(self, record: dict):
+        """Write a record
+
+        Args:
+            record (dict): Record to write, which must be strict JSON
+        """
+        line = dumps(record)
+        if self._file is not None and (
+                self._records >= self.max_records
+                or (self.max_bytes is not None and self._bytes + len(line) > self.max_bytes)):
+            self._finish()
+        if self._file is None:
+            self._open()
+        self._buffer.append(line)
+        self._buffered += len(line)
+        self._records += 1
+        self._bytes += len(line)
+        if self._buffered >= self.buffer_size:
+            self._flush()
+
+    def write_all(self, records: Iterable[dict]) -> int:
+        """Write many records
+
+        Args:
+            records ([dict]): Records to write
+        Returns:
+            (int) Number of records written
+        """
+        n = 0
+        for record in records:
+            self.write(record)
+            n += 1
+        return n
+
+    def close(self) -> dict:
+        """Complete the last shard and write the manifest, available as ``manifest``
+
+        Returns:
+            (dict) The manifest
+        """
+        self._finish()
+        manifest = dict(self.metadata, version=MANIFEST_VERSION, format='ndjson',
+                        compression=self.compression,
+                        encoder='json' if orjson is None else 'orjson',
+                        records=self.records, shards=self.shards)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(manifest, fp, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        self.manifest = manifest
+        return manifest
+
+    def _abort(self):
+        """Remove the shard being written"""
+        if self._file is not None:
+            self._file.close()
+            os.unlink(self._tmp_path)
+            self._file = self._writer = self._tmp_path = None
+            self._buffer.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort()
+
+
+def read_shard(path: str) -> Iterable[dict]:
+    """Read the records of a shard
+
+    Args:
+        path (str): Path of the shard, compressed or not according to its extension
+    Yields:
+        (dict) Records of the shard
+    """
+    loads = json.loads if orjson is None else orjson.loads
+    if path.endswith('.gz'):
+        fp = gzip.open(path, 'rb')
+    elif path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('Zstandard compression requires the zstandard package')
+        fp = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    else:
+        fp = open(path, 'rb')
+    with fp:
+        buffer = b''
+        for chunk in iter(lambda: fp.read(1024 ** 2), b''):
+            lines = (buffer + chunk).split(b'\n')
+            buffer = lines.pop()
+            for line in lines:
+                yield loads(line)
+        if buffer:
+            yield loads(buffer)
@@ -1,30 +1,16 @@
 """Tools for validating against MDF schema"""
 
-from jsonschema import Draft7Validator, RefResolver
-
-
-# Make the schema resolver: Using a module-level variable to leverage RefResolvers' cache
-_schema_repo = "https://raw.githubusercontent.com/materials-data-facility/" \
-               "data-schemas/master/schemas/"
-_ref_resolver = RefResolver(_schema_repo, None)
+from mdf_matio.schemas import compile_validator, get_schema_uri
 
 
 def validate_against_mdf_schemas(document):
     """Validate a metadata record against the MDF record schema
 
-    Note: Requires an internet connection to GitHub
+    The validator is compiled on first use and reused for later documents.
 
     Args:
         document (dict): Document instance to be validated
     Raises:
-        (jsonschema.SchemaError) If the schema fails to validate
+        (jsonschema.ValidationError) If the document fails to validate
     """
-
-    # Get record schema
-    _, schema = _ref_resolver.resolve("record.json")
-
-    # Make the validator
-    validator = Draft7Validator(schema, resolver=_ref_resolver)
-
-    # Test the document
-    validator.validate(document)
+    compile_validator("record.json", get_schema_uri("master"))(document)
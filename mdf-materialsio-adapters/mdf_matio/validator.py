@@ -1,30 +1,78 @@
+from collections import namedtuple
+from multiprocessing import Pool
+from itertools import islice
 from datetime import datetime
+import copy
 import json
+import math
 
 import jsonschema
 
+from mdf_matio.schemas import get_ref_resolver, get_schema_uri, compile_validator
+from mdf_matio.composition import get_elements
+from mdf_matio.pipeline import imap_bounded
 
-def _remove_nulls(data, skip=None):
-    """Remove all null/None/empty values from a dict or list, except those listed in skip."""
+
+def _json_key(key):
+    """Convert a dict key to a string the way the json module does."""
+    if isinstance(key, (int, float)) or key is None:
+        return json.dumps(key, allow_nan=False)
+    raise TypeError("keys must be str, int, float, bool or None, not {}"
+                    .format(type(key).__name__))
+
+
+def _sanitize(data, skip=None):
+    """Check that data is strict JSON and remove all null/None values from dicts and lists,
+    except those listed in skip, in a single pass.
+    Tuples become lists and non-string keys become strings, as they would through JSON.
+    The containers in the result are all new; none are shared with the input.
+
+    Raises:
+        ValueError: If data contains NaN or Infinity.
+        TypeError: If data contains a type that cannot be represented in JSON.
+    """
     if isinstance(data, dict):
         new_dict = {}
         for key, val in data.items():
-            new_val = _remove_nulls(val, skip=skip)
+            if not isinstance(key, str):
+                key = _json_key(key)
+            new_val = _sanitize(val, skip)
             if new_val is not None or (skip is not None and key in skip):
                 new_dict[key] = new_val
         return new_dict
-    elif isinstance(data, list):
+    elif isinstance(data, (list, tuple)):
         new_list = []
         for val in data:
-            new_val = _remove_nulls(val, skip=skip)
+            new_val = _sanitize(val, skip)
             if new_val is not None:
                 new_list.append(new_val)
         return new_list
+    elif isinstance(data, float):
+        if not math.isfinite(data):
+            raise ValueError("Out of range float values are not JSON compliant: {}".format(data))
+        return data
+    elif data is None or isinstance(data, (str, int)):
+        return data
     # Could delete required but empty blocks - services, etc.
     # elif hasattr(data, "__len__") and len(data) <= 0:
     #    return None
-    else:
-        return data
+    raise TypeError("Object of type {} is not JSON serializable".format(type(data).__name__))
+
+
+def _sanitize_document(doc, skip=None):
+    """Sanitize a dataset or record with _sanitize, also making all values
+    in the "custom" block into strings.
+    """
+    custom = doc.get("custom")
+    if custom:
+        doc = dict(doc, custom=dict((key, str(val)) for key, val in custom.items()))
+    return _sanitize(doc, skip)
+
+
+RecordValidation = namedtuple("RecordValidation", ["index", "record", "error"])
+"""Outcome of validating one record with MDFValidator.validate_records.
+index is the position of the record in the input, record is the validated record
+(None if it failed) and error is the validation error message (None if it passed)."""
 
 
 class ValidationError(Exception):
@@ -61,14 +109,34 @@ class MDFValidator():
         Arguments:
             schema_branch (str): The GitHub branch of the MDF schema to use in validation.
                     See https://github.com/materials-data-facility/data-schemas
+                    The bundled copy of the schemas is used for "master",
+                    other branches are fetched from GitHub.
         """
         self.__dataset = None
         self.__scroll_id = None
         self.__ingest_date = datetime.utcnow().isoformat("T") + "Z"
         self.__indexed_files = []
-        self.ref_resolver = jsonschema.RefResolver("https://raw.githubusercontent.com/materials-"
-                                                   "data-facility/data-schemas/{}/schemas/"
-                                                   .format(schema_branch), None)
+        self.__schema_branch = schema_branch
+        self._load_schemas()
+
+    def _load_schemas(self):
+        """Get the schema resolver and the validators, compiled once and reused
+        for every dataset and record."""
+        schema_uri = get_schema_uri(self.__schema_branch)
+        self.ref_resolver = get_ref_resolver(schema_uri)
+        self._dataset_validator = compile_validator("dataset.json", schema_uri)
+        self._record_validator = compile_validator("record.json", schema_uri)
+
+    def __getstate__(self):
+        # The resolver and validators are rebuilt when unpickled, e.g. in a worker process
+        state = self.__dict__.copy()
+        for key in ["ref_resolver", "_dataset_validator", "_record_validator"]:
+            state.pop(key)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._load_schemas()
 
     def validate_mdf_dataset(self, ds_md, validation_info=None):
         """Begin validating a new dataset against the MDF schema.
@@ -112,6 +180,67 @@ class MDFValidator():
         # Effect is .send(None) returns None, which is logical
         yield
 
+    def validate_records(self, records, batch_size=1000, workers=None, max_pending=None):
+        """Validate many records, optionally in parallel.
+
+        The dataset must first be started with `validate_mdf_dataset()`.
+        Records are validated in batches, in worker processes if `workers` is given.
+        Unlike sending records to the generator one by one, a record that fails
+        validation does not stop the others; its error is reported instead.
+        Results come back in input order, and only valid records are given a scroll_id,
+        so the scroll_ids and the dataset's `data.total_size` are the same however
+        many workers are used.
+        Records are read from the input only as results are consumed, no more than
+        `max_pending` batches ahead.
+
+        Arguments:
+            records (iterable of dict): The records to validate.
+            batch_size (int): The number of records sent to a worker at a time. Default 1000.
+            workers (int): The number of worker processes. Default None, to validate
+                    in this process.
+            max_pending (int): The number of batches being validated at a time by the
+                    workers. Default twice the number of workers.
+
+        Yields:
+            RecordValidation: The index of the record, the validated record (or None),
+                    and the validation error message (or None).
+        """
+        if not self.__dataset:
+            raise ValidationError("Dataset not started. Records cannot be validated without "
+                                  "a dataset. Call .validate_mdf_dataset() instead.")
+
+        # Records are validated by a copy, so that this validator's counters are only
+        # updated here, in input order
+        worker = copy.copy(self)
+        worker.__dataset = copy.deepcopy(self.__dataset)
+        worker.__indexed_files = []
+
+        records = iter(records)
+        batches = iter(lambda: list(islice(records, batch_size)), [])
+        if workers is None:
+            results = (_validate_batch(batch, worker) for batch in batches)
+            pool = None
+        else:
+            pool = Pool(workers, initializer=_init_worker, initargs=(worker,))
+            results = imap_bounded(pool, _validate_batch, batches, max_pending or 2 * workers)
+
+        try:
+            index = 0
+            for batch in results:
+                for rc_md, error in batch:
+                    if rc_md is not None:
+                        rc_md["mdf"]["scroll_id"] = self.__scroll_id
+                        self.__scroll_id += 1
+                        if rc_md.get("files"):
+                            self.__indexed_files += rc_md["files"]
+                            for f in rc_md["files"]:
+                                self.__dataset["data"]["total_size"] += f.get("length", 0)
+                    yield RecordValidation(index, rc_md, error)
+                    index += 1
+        finally:
+            if pool is not None:
+                pool.terminate()
+
     def _validate_dataset(self, ds_md, validation_info=None):
         """Validate a dataset entry.
         Not intended for calling directly.
@@ -136,9 +265,6 @@ class MDFValidator():
         self.__allowed_nulls = validation_info.get("allowed_nulls", None)
         self.__base_acl = validation_info.get("base_acl", None)
 
-        # Load schema
-        _, schema = self.ref_resolver.resolve("dataset.json")
-
         # if not ds_md.get("dc") or not isinstance(ds_md["dc"], dict):
         #    ds_md["dc"] = {}
         if not ds_md.get("mdf") or not isinstance(ds_md["mdf"], dict):
@@ -184,26 +310,17 @@ class MDFValidator():
         ds_md["data"]["total_size"] = 0
 
         # BLOCK: custom
-        # Make all values into strings
-        if ds_md.get("custom"):
-            new_custom = {}
-            for key, val in ds_md["custom"].items():
-                new_custom[key] = str(val)
-            ds_md["custom"] = new_custom
-
-        # Require strict JSON
+        # Make all values into strings,
+        # require strict JSON, and remove null/None values (in a single pass)
         try:
-            json.dumps(ds_md, allow_nan=False)
-        except (ValueError, json.JSONDecodeError) as e:
+            ds_md = _sanitize_document(ds_md, self.__allowed_nulls)
+        except (ValueError, TypeError) as e:
             raise ValidationError("Dataset metadata is not valid JSON: {}"
                                   .format(str(e))) from e
 
-        # Remove null/None values
-        ds_md = _remove_nulls(ds_md, self.__allowed_nulls)
-
         # Validate against schema
         try:
-            jsonschema.validate(ds_md, schema, resolver=self.ref_resolver)
+            self._dataset_validator(ds_md)
         except jsonschema.ValidationError as e:
             raise ValidationError("Invalid dataset metadata: {}"
                                   .format(str(e).split("\n")[0])) from e
@@ -246,8 +363,8 @@ class MDFValidator():
                 raise ValidationError("Missing organization metadata: '{}' are required"
                                       .format(missing))
 
-        # Ensure dataset JSON-sanitized before return
-        return json.loads(json.dumps(ds_md))
+        # Dataset was JSON-sanitized, and copied, by _sanitize_document
+        return ds_md
 
     def _validate_record(self, rc_md):
         """Process and validate a record against the MDF schema.
@@ -263,18 +380,16 @@ class MDFValidator():
             raise ValidationError("Dataset not started. Records cannot be validated without "
                                   "a dataset. Call .validate_mdf_dataset() instead.")
 
-        # Load schema
-        _, schema = self.ref_resolver.resolve("record.json")
-
         # Add any missing blocks
-        if not rc_md.get("mdf"):
-            rc_md["mdf"] = {}
+        # The record and the blocks that are filled in are copied, not modified in place:
+        # merged records share their blocks (see mdf_matio.merging)
+        rc_md = dict(rc_md)
+        rc_md["mdf"] = dict(rc_md.get("mdf") or {})
         if not rc_md.get("files"):
             rc_md["files"] = []
         elif isinstance(rc_md["files"], dict):
             rc_md["files"] = [rc_md["files"]]
-        if not rc_md.get("material"):
-            rc_md["material"] = {}
+        rc_md["material"] = dict(rc_md.get("material") or {})
 
         # Add fields
         # BLOCK: mdf
@@ -315,48 +430,61 @@ class MDFValidator():
         # BLOCK: material
         # elements
         if rc_md["material"].get("composition"):
-            composition = rc_md["material"]["composition"].replace("and", "")
-            str_of_elem = ""
-            for char in list(composition):
-                if char.isupper():  # Start of new element symbol
-                    str_of_elem += " " + char
-                elif char.islower():  # Continuation of symbol
-                    str_of_elem += char
-                # Anything else is not an element (numbers, whitespace, etc.)
-
-            # Split elements in string (on whitespace), make unique and JSON-serializable
-            list_of_elem = list(set(str_of_elem.split()))
-            # Ensure deterministic results
-            list_of_elem.sort()
-
-            rc_md["material"]["elements"] = list_of_elem
+            # Unique, checked against the periodic table, and sorted for deterministic results
+            rc_md["material"]["elements"] = list(get_elements(rc_md["material"]["composition"]))
         elif rc_md["material"].get("elemental_proportions"):
             rc_md["material"]["elements"] = list(rc_md["material"]["elemental_proportions"].keys())
             rc_md["material"]["elements"].sort()
 
         # BLOCK: custom
-        # Make all values into strings
-        if rc_md.get("custom"):
-            new_custom = {}
-            for key, val in rc_md["custom"].items():
-                new_custom[key] = str(val)
-            rc_md["custom"] = new_custom
-
-        # Require strict JSON
+        # Make all values into strings,
+        # require strict JSON, and remove null/None values (in a single pass)
         try:
-            json.dumps(rc_md, allow_nan=False)
-        except (ValueError, json.JSONDecodeError) as e:
+            rc_md = _sanitize_document(rc_md, self.__allowed_nulls)
+        except (ValueError, TypeError) as e:
             raise ValidationError("Record is not valid JSON: {}".format(str(e))) from e
 
-        # Remove null/None values
-        rc_md = _remove_nulls(rc_md, self.__allowed_nulls)
-
         # Validate against schema
         try:
-            jsonschema.validate(rc_md, schema, resolver=self.ref_resolver)
+            self._record_validator(rc_md)
         except jsonschema.ValidationError as e:
             raise ValidationError("Invalid record metadata: {}"
                                   .format(str(e).split("\n")[0])) from e
 
         # Return results
         return rc_md
+
+
+# Validator used by the worker processes of MDFValidator.validate_records
+_worker_validator = None
+
+
+def _init_worker(validator):
+    global _worker_validator
+    _worker_validator = validator
+
+
+def _validate_batch(records, validator=None):
+    """Validate a batch of records, capturing validation errors.
+
+    Arguments:
+        records (list of dict): The records to validate.
+        validator (MDFValidator): The validator to use. Default None, to use the
+                validator of this worker process.
+
+    Returns:
+        list of tuple: The validated record (or None) and error message (or None)
+                for each record.
+    """
+    validator = validator or _worker_validator
+    results = []
+    for rc_md in records:
+        try:
+            results.append((validator._validate_record(rc_md), None))
+        except ValidationError as e:
+            results.append((None, str(e)))
+        except Exception as e:
+            # Malformed metadata can fail before reaching the schema, e.g. a non-numeric length
+            results.append((None, "Record could not be processed: {}: {}"
+                                  .format(type(e).__name__, e)))
+    return results
@@ -12,7 +12,12 @@ setup(
     version=version,
     packages=find_packages(),
     install_requires=['pypif_sdk', 'jsonschema>3', 'mdf_toolbox>=0.5.3'],
+    extras_require={
+        'fast': ['fastjsonschema', 'orjson'],
+        'zstd': ['zstandard']
+    },
     include_package_data=True,
+    package_data={'mdf_matio': ['record_fields.json']},
     entry_points={
         'materialsio.adapter': [
             'dft = mdf_matio.adapters.citrine:PIFDFTAdapter',
@@ -1,6 +1,8 @@
 """Tests for the Citrine adapters"""
 
-from mdf_matio.adapters.citrine import PIFDFTAdapter
+from mdf_matio.adapters.citrine import PIFDFTAdapter, extract_pif_fields
+from pypif_sdk.interop.mdf import _to_user_defined as pif_to_feedstock
+from pypif.pif import loado
 from pytest import fixture
 import json
 import os
@@ -20,3 +22,15 @@ def test_pif_dft(example_dft):
                         'cutoff_energy': 650.0},
                 'origin': {'type': 'computation', 'name': 'VASP', 'version': '5.3.2'}}
     assert PIFDFTAdapter().transform(example_dft) == expected
+
+
+def test_extract_fields(example_dft):
+    flat = pif_to_feedstock(loado(example_dft))
+    assert extract_pif_fields(example_dft, set(flat)) == flat
+
+    # Names used by different objects are ambiguous, and left out
+    example_dft['properties'].append({'name': 'XC Functional', 'scalars': [{'value': 'PBE'}]})
+    fields = extract_pif_fields(example_dft, {'XC_Functional', 'Cutoff_Energy_eV', 'Other'})
+    assert fields == {'Cutoff_Energy_eV': 650.0}
+    assert fields == dict((k, v) for k, v in pif_to_feedstock(loado(example_dft)).items()
+                          if k in {'XC_Functional', 'Cutoff_Energy_eV'})
@@ -0,0 +1,23 @@
+"""Tests for reading elements from composition strings"""
+
+from mdf_matio.composition import get_elements, ELEMENTS
+
+
+def test_periodic_table():
+    assert len(ELEMENTS) == 118
+
+
+def test_get_elements():
+    assert get_elements('NaCl') == ('Cl', 'Na')
+    assert get_elements('CO') == ('C', 'O')
+    assert get_elements('Co') == ('Co',)
+
+    # Parentheses, hydrates and fractional stoichiometry
+    assert get_elements('Ca(OH)2') == ('Ca', 'H', 'O')
+    assert get_elements('CuSO4·5H2O') == ('Cu', 'H', 'O', 'S')
+    assert get_elements('Li0.5CoO2') == ('Co', 'Li', 'O')
+
+    # Words are not elements, and do not damage neighboring symbols
+    assert get_elements('NdFeB and SmCo5') == ('B', 'Co', 'Fe', 'Nd', 'Sm')
+    assert get_elements('NaCl in Water') == ('Cl', 'Na')
+    assert get_elements('sand') == ()
@@ -0,0 +1,48 @@
+"""Tests for mapping the rows of CSV files to MDF records"""
+
+from mdf_matio.adapters.mappable import CSVAdapter
+import numpy as np
+
+mapping = {'material.composition': 'composition', 'crystal_structure.volume': 'volume',
+           'material.common_name': 'name'}
+
+
+def test_rows():
+    rows = [{'composition': 'NaCl', 'volume': 1.5, 'other': 1},
+            {'composition': 'LiFePO4'},
+            {'other': 2},
+            {'volume': None}]
+    adapter = CSVAdapter()
+    assert adapter.transform({'records': rows}, {'mapping': mapping}) == [
+        {'material': {'composition': 'NaCl'}, 'crystal_structure': {'volume': 1.5}},
+        {'material': {'composition': 'LiFePO4'}},
+        {'crystal_structure': {'volume': None}}
+    ]
+
+    # Records are generated lazily
+    records = adapter.iter_records({'records': iter(rows)}, mapping)
+    assert next(records) == {'material': {'composition': 'NaCl'},
+                             'crystal_structure': {'volume': 1.5}}
+
+    # No mapping, or nothing mapped
+    assert adapter.transform({'records': rows}) is None
+    assert adapter.transform({'records': rows}, {'mapping': {'material.name': 'x'}}) is None
+
+
+def test_columns():
+    columns = {'composition': np.array(['NaCl', 'KCl']), 'volume': np.array([1.5, 2.0])}
+    output = CSVAdapter().transform({'columns': columns}, {'mapping': mapping})
+    assert output == [{'material': {'composition': 'NaCl'}, 'crystal_structure': {'volume': 1.5}},
+                      {'material': {'composition': 'KCl'}, 'crystal_structure': {'volume': 2.0}}]
+    # Values are plain Python types
+    assert type(output[0]['crystal_structure']['volume']) is float
+
+
+def test_chunks():
+    chunks = [[{'composition': 'NaCl'}, {'other': 1}],
+              {'composition': ['KCl'], 'volume': [2.0]},
+              []]
+    output = [list(x) for x in CSVAdapter().iter_chunks(iter(chunks), mapping)]
+    assert output == [[{'material': {'composition': 'NaCl'}}],
+                      [{'material': {'composition': 'KCl'}, 'crystal_structure': {'volume': 2.0}}],
+                      []]
@@ -1,6 +1,8 @@
 """Test the functions that group files into chunks"""
 
-from mdf_matio.grouping import groupby_directory, groupby_file
+from mdf_matio.grouping import groupby_directory, groupby_file, DirectoryTrie, SQLiteGroupStore
+from mdf_matio import _merge_directories, _merge_files, _merge_on_disk, _merge_records
+from materials_io.utils.interface import ParseResult
 import pytest
 import os
 
@@ -57,3 +59,163 @@ def test_groupby_file(example_files):
     assert sorted(map(len, groups)) == [1, 1, 3]
     assert isinstance(groups[0], list)
     assert isinstance(groups[0][0], tuple)
+
+
+def test_groupby_file_transitive():
+    # Records are only linked through a chain of shared files
+    records = [
+        (('a',), 'fake', {}),
+        (('x',), 'fake', {}),
+        (('c', 'd'), 'fake', {}),
+        (('b', 'c'), 'fake', {}),
+        (('a', 'b'), 'fake', {}),
+    ]
+    groups = list(groupby_file(records))
+    assert len(groups) == 2
+
+    # Groups are in order of their first record, and records in order of precedence:
+    #  the last first, then the others in input order
+    assert groups[0] == [records[4], records[0], records[2], records[3]]
+    assert groups[1] == [records[1]]
+
+    # The number of passes no longer changes the result
+    assert list(groupby_file(records, max_passes=1)) == groups
+
+
+def test_groupby_file_precedence():
+    # The last record of a group comes first, so its metadata takes precedence when merged
+    records = [
+        ParseResult(['NaCl.cif'], 'crystal_structure', {'material': {'composition': 'NaCl'}}),
+        ParseResult(['NaCl.cif'], 'ase', {'material': {'composition': 'Na Cl'}}),
+    ]
+    group, = groupby_file(records)
+    assert group == records[::-1]
+    assert _merge_records(group).metadata['material']['composition'] == 'Na Cl'
+
+    # Then the others, in input order
+    records.append(ParseResult(['NaCl.cif'], 'dft', {'dft': {'converged': True}}))
+    records.insert(0, ParseResult(['NaCl.cif', 'OUTCAR'], 'generic',
+                                  {'material': {'composition': 'ClNa'}}))
+    group, = groupby_file(records)
+    assert group == [records[3], records[0], records[1], records[2]]
+    assert _merge_records(group).metadata == {'dft': {'converged': True},
+                                              'material': {'composition': 'ClNa'}}
+    with SQLiteGroupStore() as store:
+        assert list(groupby_file(records, store=store)) == [group]
+
+
+def test_groupby_file_streaming(example_files):
+    # Records from each directory are consecutive, and share files only within a directory
+    records = [example_files[i] for i in [0, 2, 3, 4]]
+    assert list(groupby_file(iter(records), presorted=True)) == list(groupby_file(records))
+
+    # Groups are produced before the input is exhausted
+    def gen():
+        yield from records[:2]
+        raise RuntimeError()
+    assert next(groupby_file(gen(), presorted=True)) == [records[0]]
+
+    with pytest.raises(ValueError):
+        list(groupby_file([example_files[i] for i in [2, 4, 3]], presorted=True))
+
+
+def test_groupby_directory_streaming(example_files):
+    # Records from each directory are consecutive, groups come back in arrival order
+    records = [example_files[4], example_files[2], example_files[3], example_files[0]]
+    groups = list(groupby_directory(records, presorted=True))
+    assert groups == [[records[0]], [records[1], records[2]], [records[3]]]
+    assert list(groupby_directory(iter(records), presorted=True)) == groups
+    assert list(groupby_directory(iter(records))) == list(groupby_directory(records))
+
+    # Fail if a directory comes back after it was grouped
+    with pytest.raises(ValueError):
+        list(groupby_directory([example_files[i] for i in [2, 4, 3]], presorted=True))
+
+
+def test_groupby_directory_spill(example_files):
+    # Sorting in small chunks that spill to disk gives the same result as in memory
+    expected = list(groupby_directory(example_files))
+    for chunk_size in [1, 2, 3]:
+        assert list(groupby_directory(example_files, chunk_size=chunk_size)) == expected
+        assert list(groupby_directory(example_files[::-1], chunk_size=chunk_size)) == \
+            list(groupby_directory(example_files[::-1]))
+
+
+def test_sqlite_store(example_files):
+    with SQLiteGroupStore(batch_size=2) as store:
+        # Same groups, in the same order, as grouping in memory
+        assert list(groupby_directory(example_files, store=store)) == \
+            list(groupby_directory(example_files))
+        assert list(groupby_file(example_files, store=store)) == list(groupby_file(example_files))
+
+        # Each database is deleted once its groups are read, or its reader is closed
+        tmpdir = store._tmpdir.name
+        for _ in range(3):
+            assert len(list(groupby_file(example_files, store=store))) == 3
+        groups = groupby_directory(example_files, store=store)
+        next(groups)
+        assert len(os.listdir(tmpdir)) == 1
+        groups.close()
+        assert os.listdir(tmpdir) == [] and store._connections == []
+
+        # Databases still being read are deleted on exit
+        groups = groupby_file(example_files, store=store)
+        next(groups)
+
+    assert not os.path.exists(tmpdir)
+    groups.close()
+
+
+def test_directory_trie():
+    index = DirectoryTrie([os.path.join('a', 'b'), 'a' + os.path.sep, 'c', os.path.join('d', 'e')])
+    assert index.find(os.path.join('a', 'b', 'x.in')) == 'a' + os.path.sep  # Outermost
+    assert index.find(os.path.join('a', 'x.in')) == 'a' + os.path.sep
+    assert index.find(os.path.join('c', 'f', 'g', 'x.in')) == 'c'
+    assert index.find(os.path.join('d', 'e', 'x.in')) == os.path.join('d', 'e')
+    assert index.find(os.path.join('d', 'x.in')) is None
+    assert index.find(os.path.join('cc', 'x.in')) is None
+    assert index.find('c') is None
+    assert DirectoryTrie([]).find('a.in') is None
+
+
+def test_merge_directories(example_files):
+    def merge(records, presorted):
+        merged = _merge_directories(records, ['d'], presorted=presorted)
+        return [(list(x.group), x.parser) for x in merged]
+    a, da, db, ea = 'a.in', os.path.join('d', 'a.in'), os.path.join('d', 'b.in'), \
+        os.path.join('e', 'a.in')
+
+    # Records with files in the grouped directory are merged by their directory
+    records = [ParseResult(*x) for x in example_files]
+    assert merge(records, False) == [([a], 'fake'), ([ea], 'fake'),
+                                     ([da, a], 'fake'), ([da, db], 'fake')]
+
+    # Records in walk order are merged as soon as the walk leaves the directory
+    records = [records[i] for i in [0, 2, 3, 4]]
+    assert merge(records, True) == [([a], 'fake'), ([da, db], 'fake'), ([ea], 'fake')]
+
+
+def test_merge_on_disk(example_files):
+    # Records merged by directory share files with other records, and with each other
+    records = [ParseResult(x[0], x[1], {'id': i}) for i, x in enumerate(example_files)]
+    expected = list(_merge_files(_merge_directories(records, ['d'])))
+    assert len(expected) == 2
+
+    # Same records, in the same order, from a single database holding each record once
+    with SQLiteGroupStore() as store:
+        loads = []
+        original_load = store._load
+        store._load = lambda conn, records, unit_key: loads.append(1) or \
+            original_load(conn, records, unit_key)
+        assert list(_merge_on_disk(iter(records), ['d'], store)) == expected
+        assert list(_merge_on_disk(records, [], store)) == list(_merge_files(records))
+        assert len(loads) == 2
+
+    # Records whose files span two of the directories to group keep their input order
+    records = [ParseResult(files, 'p', {'id': i}) for i, files in enumerate(
+        [['c/2.x'], ['c/0.x', 'c/e/0.x'], ['a/0.x', 'c/e/0.x'], ['c/e/0.x'], ['c/1.x', 'd/2.x']]
+    )]
+    with SQLiteGroupStore() as store:
+        merged, = _merge_on_disk(records, ['c', 'a'], store)
+    assert merged == next(_merge_files(_merge_directories(records, ['c', 'a'])))
+    assert merged.group == ['c/e/0.x', 'a/0.x', 'c/1.x', 'd/2.x', 'c/2.x', 'c/0.x']
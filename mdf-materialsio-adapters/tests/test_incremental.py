@@ -0,0 +1,76 @@
+"""Tests for re-indexing a dataset incrementally"""
+
+from mdf_matio.incremental import Manifest, get_record_id
+import os
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fp:
+        fp.write(content)
+
+
+def _run(data_url, manifest_path, records, grouped_dirs=None):
+    """Simulate a run, emitting the records (lists of files) found in the parsed shards"""
+    update = Manifest.load(manifest_path).update(data_url, grouped_dirs)
+    parsed = set(f for shard in update.shards for f in shard[2])
+    emitted = []
+    for files in records:
+        if any(os.path.join(data_url, f) in parsed for f in files):
+            record = {'mdf': {}, 'files': [{'length': 1} for _ in files]}
+            emitted.append(update.assign([os.path.join(data_url, f) for f in files], 0, record))
+    tombstones = list(update.tombstones({'mdf': {'source_id': 'test'}}))
+    update.manifest.save(manifest_path)
+    return update, emitted, tombstones
+
+
+def test_incremental(tmp_path):
+    data_url = str(tmp_path / 'data')
+    manifest_path = str(tmp_path / 'manifest.json')
+    for name in ['a/1.txt', 'a/2.txt', 'b/1.txt', 'c/1.txt', 'c/d/1.txt']:
+        _write(os.path.join(data_url, name), name)
+    records = [['a/1.txt'], ['a/2.txt'], ['b/1.txt', 'c/1.txt'], ['c/d/1.txt']]
+
+    # First run parses everything and gives sequential scroll ids
+    update, emitted, tombstones = _run(data_url, manifest_path, records)
+    assert len(update.shards) == 5
+    assert [x['mdf']['scroll_id'] for x in emitted] == [1, 2, 3, 4]
+    assert tombstones == []
+
+    # Nothing changed, nothing is parsed
+    update, emitted, tombstones = _run(data_url, manifest_path, records)
+    assert update.shards == [] and emitted == [] and tombstones == []
+    assert update.kept_size == 5
+
+    # Touching a file without changing it does not cause re-parsing
+    os.utime(os.path.join(data_url, 'a', '1.txt'), ns=(0, 0))
+    update, emitted, tombstones = _run(data_url, manifest_path, records)
+    assert update.shards == []
+
+    # Changing a file re-parses its directory, and that of the other file of its record
+    _write(os.path.join(data_url, 'b', '1.txt'), 'changed')
+    update, emitted, tombstones = _run(data_url, manifest_path, records)
+    assert sorted(os.path.relpath(x[0], data_url) for x in update.shards) == ['b', 'c']
+    assert [x['mdf']['scroll_id'] for x in emitted] == [3]
+    assert update.kept_size == 3
+
+    # Deleting a file gives a tombstone, and new records get new scroll ids
+    os.unlink(os.path.join(data_url, 'a', '2.txt'))
+    _write(os.path.join(data_url, 'a', '3.txt'), 'new')
+    records = [['a/1.txt'], ['a/3.txt'], ['b/1.txt', 'c/1.txt'], ['c/d/1.txt']]
+    update, emitted, tombstones = _run(data_url, manifest_path, records)
+    assert [x['mdf']['scroll_id'] for x in emitted] == [1, 5]
+    assert [x['mdf']['scroll_id'] for x in tombstones] == [2]
+    assert tombstones[0]['mdf']['resource_type'] == 'tombstone'
+    assert tombstones[0]['files'] == [{'path': os.path.join(data_url, 'a', '2.txt')}]
+
+    # All directories below a grouped directory are parsed together
+    _write(os.path.join(data_url, 'c', 'd', '1.txt'), 'changed')
+    update, _, _ = _run(data_url, manifest_path, records,
+                        grouped_dirs=[os.path.join(data_url, 'c')])
+    assert sorted(os.path.relpath(x[0], data_url) for x in update.shards) == ['b', 'c', 'c/d']
+
+
+def test_record_id():
+    assert get_record_id(['a', 'b'], 0) == get_record_id(['b', 'a'], 0)
+    assert get_record_id(['a', 'b'], 0) != get_record_id(['a', 'b'], 1)
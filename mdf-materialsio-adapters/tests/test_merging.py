@@ -0,0 +1,40 @@
+"""Tests for merging the records of the same files"""
+
+from mdf_matio import _merge_records, ParseResult
+from mdf_matio.merging import merge_metadata
+from mdf_toolbox import dict_merge
+from functools import reduce, partial
+from copy import deepcopy
+
+
+def test_merge_metadata():
+    records = [
+        {'files': [{'filename': 'a'}], 'material': {'composition': 'NaCl'}},
+        {'files': [{'filename': 'a'}, {'filename': 'b'}],
+         'material': {'composition': 'KCl', 'elements': ['K']}},
+        {'files': [{'filename': 'c'}], 'image': {'shape': [1, 1]}, 'material': 'invalid'},
+        {'material': {'elements': ['Cl']}},
+    ]
+    original = deepcopy(records)
+    output = merge_metadata(records)
+    assert output == {'files': [{'filename': 'a'}, {'filename': 'b'}, {'filename': 'c'}],
+                      'material': {'composition': 'NaCl', 'elements': ['K']},
+                      'image': {'shape': [1, 1]}}
+    assert output == reduce(partial(dict_merge, append_lists=True), deepcopy(records))
+    assert records == original
+
+
+def test_merge_records():
+    group = [ParseResult(['a.csv'], 'csv', [{'material': {'composition': 'NaCl'}},
+                                            {'material': {'composition': 'KCl'}}]),
+             ParseResult(['a.csv', 'b.csv'], 'csv', [{'material': {'composition': 'LiCl'}}]),
+             ParseResult(['a.csv'], 'generic', {'files': [{'filename': 'a.csv'}]})]
+    output = _merge_records(group)
+    assert output.group == ['a.csv', 'b.csv']
+    assert output.parser == 'csv-generic'
+
+    # Records of both list-type results are kept, with the other metadata in each
+    assert output.metadata == [
+        {'material': {'composition': x}, 'files': [{'filename': 'a.csv'}]}
+        for x in ['NaCl', 'KCl', 'LiCl']
+    ]
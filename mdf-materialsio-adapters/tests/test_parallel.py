@@ -0,0 +1,29 @@
+"""Tests for parsing a directory tree in parallel"""
+
+from mdf_matio.parallel import run_all_parsers_parallel, walk_shards
+from materials_io.utils.interface import run_all_parsers
+import os
+
+file_dir = os.path.join(os.path.dirname(__file__), '..', 'notebooks', 'example-files')
+
+
+def test_walk_shards():
+    shards = list(walk_shards(file_dir))
+    assert shards[0][0] == file_dir
+    assert shards == list(walk_shards(file_dir))
+    for root, dirs, files in shards:
+        assert files == sorted(files)
+        assert all(os.path.dirname(f) == root for f in files + dirs)
+
+
+def test_parallel_parse():
+    parsers = ['generic', 'csv', 'image']
+    results = list(run_all_parsers_parallel(file_dir, parsers, n_workers=2))
+
+    # Same output on every run
+    assert results == list(run_all_parsers_parallel(file_dir, parsers, n_workers=2))
+
+    # Same records as parsing serially
+    serial = run_all_parsers(file_dir, include_parsers=parsers, adapter_map='match')
+    assert sorted((x.parser, tuple(x.group)) for x in results) == \
+        sorted((x.parser, tuple(x.group)) for x in serial)
@@ -0,0 +1,94 @@
+"""Tests for running stages concurrently"""
+
+from mdf_matio.pipeline import Pipeline
+from mdf_matio import parallel
+from materials_io.utils.interface import ParseResult
+from threading import enumerate as threads
+from functools import partial
+import pytest
+import time
+
+
+def _square(items):
+    for x in items:
+        yield x * x
+
+
+def _slow(items):
+    for x in items:
+        time.sleep(0.001)
+        yield x
+
+
+def test_pipeline():
+    pipeline = Pipeline(queue_size=4, poll_interval=0.01)
+    pipeline.add_stage('square', _square).add_stage('slow', _slow) \
+        .add_stage('sum', lambda items: map(sum, zip(items, items)))
+    assert list(pipeline.run(range(100))) == [x * x + (x + 1) ** 2 for x in range(0, 100, 2)]
+
+    # Stages do not get ahead of the slow one by more than the size of the queues
+    metrics = pipeline.metrics()
+    assert list(metrics) == ['square', 'slow', 'sum']
+    assert metrics['square']['items_in'] == 100 and metrics['square']['items_out'] == 100
+    assert metrics['sum']['items_in'] == 100 and metrics['sum']['items_out'] == 50
+    assert all(m['max_queue_depth'] <= 4 for m in metrics.values())
+    assert metrics['square']['output_wait_time'] > metrics['square']['busy_time']
+    assert metrics['slow']['busy_time'] >= 0.1
+    assert all(not m['running'] and m['throughput'] > 0 for m in metrics.values())
+
+    with pytest.raises(ValueError):
+        pipeline.add_stage('sum', _square)
+
+
+def test_failure():
+    def fail(items):
+        for x in items:
+            if x == 10:
+                raise KeyError(x)
+            yield x
+
+    pipeline = Pipeline(queue_size=2, poll_interval=0.01)
+    pipeline.add_stage('fail', fail).add_stage('square', _square)
+    with pytest.raises(KeyError):
+        list(pipeline.run(range(100)))
+    assert not any(t.name.startswith('pipeline-') for t in threads())
+
+
+def test_close():
+    pipeline = Pipeline(queue_size=2, poll_interval=0.01)
+    pipeline.add_stage('square', _square).add_stage('slow', _slow)
+    records = pipeline.run(iter(range(1000000)))
+    assert next(records) == 0
+    records.close()
+
+    # All stages stopped, long before the end of the source
+    assert not any(t.name.startswith('pipeline-') for t in threads())
+    assert pipeline.metrics()['square']['items_in'] < 100
+
+
+def _parse_shard(shard, **kwargs):
+    """Stands in for parse_shard in the worker processes"""
+    return [ParseResult(shard[2], 'fake', {})]
+
+
+def test_pool_backpressure(monkeypatch):
+    monkeypatch.setattr(parallel, 'parse_shard', _parse_shard)
+    read = []
+
+    def shards():
+        for i in range(1000):
+            read.append(i)
+            yield f'dir{i}', [], [f'dir{i}/a.txt']
+
+    pipeline = Pipeline(queue_size=2, poll_interval=0.01)
+    parse = partial(parallel.parse_shards, include_parsers=['fake'], n_workers=2, max_pending=4)
+    pipeline.add_stage('parse', parse).add_stage('slow', _slow)
+    records = pipeline.run(shards())
+    for i in range(10):
+        assert next(records).group == [f'dir{i}/a.txt']
+        time.sleep(0.05)
+
+    # The parse stage reads no further than the queues, the stages holding an item each,
+    #  and the shards in the pool of processes
+    assert len(read) <= 10 + 2 * (2 + 1) + 4 + 1
+    records.close()
@@ -0,0 +1,78 @@
+"""Tests for projecting documents onto the fields of a schema"""
+
+from mdf_matio.adapters.basic_adapters import CrystalStructureAdapter, ImageAdapter
+from mdf_matio.projection import compile_paths, project
+from mdf_toolbox import translate_json
+from copy import deepcopy
+import random
+
+fields = ['material.composition', 'material.elements', 'crystal_structure.volume',
+          'crystal_structure.number_of_atoms', 'files.filename', 'files.length',
+          'origin', 'origin.type']
+
+
+def translate(document, paths):
+    return translate_json(deepcopy(document), dict((x, x) for x in paths),
+                          na_values=[[], {}, None])
+
+
+def test_compile():
+    trie = compile_paths(fields)
+    assert trie['material'] == {'composition': None, 'elements': None}
+    assert trie['files']['length'] is None
+    assert trie['origin']['type'] is None
+
+
+def test_project():
+    trie = compile_paths(fields)
+    document = {
+        'material': {'composition': 'NaCl', 'elements': ['Na', None, 'Cl'], 'extra': 1},
+        'crystal_structure': {'volume': None, 'number_of_atoms': []},
+        'files': [{'filename': 'a.cif', 'length': 1, 'path': '/a.cif'},
+                  {'filename': 'b.cif'}],
+        'origin': {'type': 'computation', 'name': 'VASP'},
+        'not_mdf': {'material': {'composition': 'KCl'}}
+    }
+    original = deepcopy(document)
+    output = project(document, trie)
+    assert output == {
+        'material': {'composition': 'NaCl', 'elements': ['Na', 'Cl']},
+        'files': {'filename': ['a.cif', 'b.cif'], 'length': 1},
+        'origin': {'type': 'computation'}
+    }
+    assert output == translate(document, fields)
+    assert document == original
+
+    # A list holding a single value is replaced by that value
+    assert project({'material': {'elements': [['Na']]}}, trie) == {'material': {'elements': 'Na'}}
+    assert project({'material': {'elements': [None]}}, trie) == {}
+
+
+def test_adapters_share_fields():
+    crystal, image = CrystalStructureAdapter(), ImageAdapter()
+    assert crystal._fields is image._fields
+    assert crystal.automap == image.automap
+    output = crystal.transform({'image': {'shape': [4, 4]}, 'extra': 1})
+    assert output == {'image': {'shape': [4, 4]}}
+
+
+def test_matches_translate_json():
+    # Compare on random documents, including lists of objects and values mixed together
+    rng = random.Random(1)
+    keys = ['a', 'b', 'c']
+
+    def make(depth):
+        choice = rng.random()
+        if depth == 0 or choice < 0.35:
+            return rng.choice([None, 0, 'x', True, [], {}])
+        if choice < 0.7:
+            return dict((rng.choice(keys), make(depth - 1)) for _ in range(rng.randrange(4)))
+        return [make(depth - 1) for _ in range(rng.randrange(4))]
+
+    for _ in range(2000):
+        paths = set('.'.join(rng.choice(keys) for _ in range(rng.randrange(1, 4)))
+                    for _ in range(rng.randrange(1, 6)))
+        # translate_json fails on fields that are also the parent of other fields
+        paths = [x for x in paths if not any(y.startswith(x + '.') for y in paths)]
+        document = dict((key, make(4)) for key in keys)
+        assert project(document, compile_paths(paths)) == translate(document, paths)
@@ -0,0 +1,55 @@
+"""Tests for the registry of MDF schemas"""
+
+from mdf_matio.schemas import (get_ref_resolver, get_schema_uri, get_schema, compile_validator,
+                               get_record_fields, _compute_record_fields)
+from jsonschema import Draft4Validator, RefResolver, ValidationError
+import pytest
+import json
+import os
+
+schema_tests = os.path.join(os.path.dirname(__file__), '..', '..', 'data-schemas', 'tests',
+                            'test_files', 'record')
+
+
+@pytest.fixture()
+def offline(monkeypatch):
+    def fail(self, uri):
+        raise AssertionError(f'Attempted to fetch {uri}')
+    monkeypatch.setattr(RefResolver, 'resolve_remote', fail)
+
+
+def test_shared_resolver():
+    assert get_ref_resolver(get_schema_uri()) is get_ref_resolver(get_schema_uri('master'))
+    assert get_ref_resolver(get_schema_uri()) is not get_ref_resolver(get_schema_uri('dev'))
+
+
+def test_offline_validation(offline):
+    resolver = get_ref_resolver(get_schema_uri())
+    assert get_schema_uri() + 'record.json' in resolver.store
+
+    # Validate a record, resolving all references from memory
+    with open(os.path.join(schema_tests, 'success_minimal.json')) as fp:
+        record = json.load(fp)
+    Draft4Validator(get_schema('record.json'), resolver=resolver).validate(record)
+
+
+def test_compiled_validator(offline):
+    validate = compile_validator('record.json')
+    assert validate is compile_validator('record.json')
+
+    with open(os.path.join(schema_tests, 'success_minimal.json')) as fp:
+        record = json.load(fp)
+    validate(record)
+
+    # Failures raise the same exception type whichever validator is used
+    del record['files']
+    with pytest.raises(ValidationError):
+        validate(record)
+
+
+def test_record_fields(offline):
+    # Precomputed fields are up to date with the bundled schemas
+    fields = get_record_fields()
+    assert fields == _compute_record_fields(get_schema_uri())
+    assert fields is get_record_fields()
+    assert 'material.composition' in fields
@@ -0,0 +1,68 @@
+"""Tests for writing records as compressed shards"""
+
+from mdf_matio.sink import ShardSink, read_shard, _dumps_json, _dumps_orjson
+import pytest
+import json
+import os
+
+
+records = [{'mdf': {'scroll_id': i}, 'material': {'composition': 'Al2O3'},
+            'custom': {'name': f'Ångström {i}'}} for i in range(25)]
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip', 'zstd'])
+def test_sink(tmp_path, compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    with ShardSink(str(tmp_path), compression=compression, max_records=10) as sink:
+        assert sink.write_all(records) == 25
+    manifest = sink.manifest
+
+    # Shards are full, except the last
+    assert [x['records'] for x in manifest['shards']] == [10, 10, 5]
+    assert manifest['records'] == 25 and manifest['compression'] == compression
+    with open(sink.manifest_path) as fp:
+        assert json.load(fp) == manifest
+    assert sorted(os.listdir(str(tmp_path))) == \
+        sorted([x['path'] for x in manifest['shards']] + ['records-manifest.json'])
+
+    # Records read back in order
+    read = []
+    for shard in manifest['shards']:
+        read.extend(read_shard(os.path.join(str(tmp_path), shard['path'])))
+    assert read == records
+
+
+def test_max_bytes(tmp_path):
+    line_size = len(_dumps_json(records[0]))
+    with ShardSink(str(tmp_path), max_bytes=3 * line_size, buffer_size=1) as sink:
+        sink.write_all(records[:7])
+    assert [x['records'] for x in sink.manifest['shards']] == [3, 3, 1]
+    assert all(x['bytes'] <= 3 * line_size for x in sink.manifest['shards'])
+
+
+def test_abort(tmp_path):
+    with pytest.raises(KeyError):
+        with ShardSink(str(tmp_path), max_records=10) as sink:
+            sink.write_all(records[:15])
+            raise KeyError()
+
+    # Only the complete shard is left, and no manifest
+    assert os.listdir(str(tmp_path)) == ['records-00000.ndjson.gz']
+
+
+def test_encoders():
+    pytest.importorskip('orjson')
+    for record in records:
+        assert _dumps_orjson(record) == _dumps_json(record)
+
+
+def test_encoders_floats():
+    pytest.importorskip('orjson')
+    floats = [0.1, -0.0, 1e16, 1.5e-7, 1e22, 123456789.125, 5e-324, 1.7976931348623157e308]
+    record = {'values': floats, 'nested': {str(i): x for i, x in enumerate(floats)}}
+
+    # The encoders agree on the values, if not on how floats are written
+    assert json.loads(_dumps_orjson(record)) == json.loads(_dumps_json(record)) == record
+    assert _dumps_orjson({'x': 1e16}) == b'{"x":1e16}\n'
+    assert _dumps_json({'x': 1e16}) == b'{"x":1e+16}\n'
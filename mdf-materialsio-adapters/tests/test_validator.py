@@ -0,0 +1,117 @@
+"""Tests for the MDF validator"""
+
+from mdf_matio.validator import MDFValidator, _sanitize_document
+from mdf_matio import _merge_records, ParseResult
+from pytest import fixture, raises
+from copy import deepcopy
+import json
+import os
+
+schema_tests = os.path.join(os.path.dirname(__file__), '..', '..', 'data-schemas', 'tests',
+                            'test_files')
+
+
+@fixture()
+def dataset():
+    with open(os.path.join(schema_tests, 'dataset', 'success_minimal.json')) as fp:
+        return json.load(fp)
+
+
+@fixture()
+def records():
+    output = []
+    for i in range(7):
+        output.append({'files': [{'data_type': 'text', 'filename': f'{i}.txt', 'length': i}],
+                       'material': {'composition': 'NaCl'}})
+    # Two invalid records
+    output[2]['material']['not_a_field'] = 1
+    output[5]['files'][0]['data_type'] = 5
+    return output
+
+
+def test_validate_records(dataset, records):
+    results = {}
+    for workers in [None, 2]:
+        vald = MDFValidator()
+        vald_gen = vald.validate_mdf_dataset(dict(dataset))
+        next(vald_gen)
+        results[workers] = list(vald.validate_records(deepcopy(records),
+                                                      batch_size=3, workers=workers))
+        for x in results[workers]:
+            if x.record is not None:
+                del x.record['mdf']['ingest_date']  # Differs between validators
+        assert vald._MDFValidator__dataset['data']['total_size'] == 0 + 1 + 3 + 4 + 6
+
+    # Errors are reported for invalid records, in input order
+    output = results[None]
+    assert [x.index for x in output] == list(range(7))
+    assert [x.error is None for x in output] == [True, True, False, True, True, False, True]
+    assert all(x.record is None for x in output if x.error is not None)
+
+    # Valid records get consecutive scroll ids after the dataset
+    assert [x.record['mdf']['scroll_id'] for x in output if x.record] == [1, 2, 3, 4, 5]
+    assert output[0].record['material']['elements'] == ['Cl', 'Na']
+
+    # Same results in parallel
+    assert results[2] == output
+
+
+def test_validate_records_bounded(dataset, records):
+    read = []
+
+    def source():
+        for i in range(1000):
+            read.append(i)
+            yield deepcopy(records[0])
+
+    vald = MDFValidator()
+    next(vald.validate_mdf_dataset(dict(dataset)))
+    results = vald.validate_records(source(), batch_size=3, workers=2, max_pending=4)
+
+    # Records are read no further ahead than the batches in the workers, and the next one
+    assert next(results).index == 0
+    assert len(read) <= (4 + 1) * 3
+    assert [x.index for x in results] == list(range(1, 1000))
+    assert len(read) == 1000
+
+
+def test_validate_merged_records(dataset):
+    # Records fanned out from a list-type result share the blocks of the other metadata
+    other = {'files': [{'data_type': 'text', 'filename': 'a.csv', 'length': 1}],
+             'mdf': {}, 'material': {'composition': 'KCl'}}
+    group = [ParseResult(['a.csv'], 'csv', [{'material': {'composition': 'NaCl'}},
+                                            {'crystal_structure': {'space_group_number': 1}}]),
+             ParseResult(['a.csv'], 'generic', other)]
+    first, second = _merge_records(group).metadata
+    assert first['mdf'] is second['mdf']
+    original = deepcopy(second)
+
+    # Validating one of them leaves the other unchanged
+    vald = MDFValidator()
+    vald_gen = vald.validate_mdf_dataset(dict(dataset))
+    next(vald_gen)
+    validated = vald_gen.send(first)
+    assert validated['mdf']['scroll_id'] == 1
+    assert second == original
+    assert vald_gen.send(second)['mdf']['scroll_id'] == 2
+    assert validated['mdf']['scroll_id'] == 1
+
+
+def test_sanitize():
+    doc = {'a': None, 'b': [1, None, (2.5, 'x')], 'c': {'d': None, 'e': {}}, 1: True,
+           'custom': {'x': 1.5, 'y': None}}
+    clean = _sanitize_document(doc, skip=['d'])
+    assert clean == {'b': [1, [2.5, 'x']], 'c': {'d': None, 'e': {}}, '1': True,
+                     'custom': {'x': '1.5', 'y': 'None'}}
+
+    # No containers are shared with the input
+    assert clean['c'] is not doc['c']
+    assert doc['custom']['x'] == 1.5
+
+    # Non-JSON data is rejected
+    with raises(ValueError):
+        _sanitize_document({'a': [float('nan')]})
+    with raises(ValueError):
+        _sanitize_document({'a': {'b': float('-inf')}})
+    with raises(TypeError):
+        _sanitize_document({'a': {1, 2}})
@@ -0,0 +1,38 @@
+"""Tests for the on-disk cache of extraction results"""
+
+import pickle
+import sqlite3
+
+from xtract_matio_cache import ExtractionCache
+
+
+def _size(value):
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def test_total_size(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    value = ['x' * 100]
+    cache = ExtractionCache(path, max_bytes=3 * _size(value))
+    for key in 'abc':
+        cache.put(key, value)
+    assert cache.stats()['bytes'] == 3 * _size(value)
+
+    # Replacing a result does not count it twice
+    cache.put('a', value)
+    assert cache.stats()['bytes'] == 3 * _size(value)
+    assert cache.stats()['evictions'] == 0
+
+    # Going over the bound evicts the least recently used results
+    cache.get('b')
+    cache.put('d', value)
+    assert cache.get('c') is None and cache.get('b') == value
+    stats = cache.stats()
+    assert stats['evictions'] == 1 and stats['entries'] == 3
+    assert stats['bytes'] == 3 * _size(value)
+
+    # Another process sharing the database sees the same total
+    other = ExtractionCache(path, max_bytes=3 * _size(value))
+    other.put('e', ['y'])
+    assert cache.stats()['bytes'] == other.stats()['bytes'] == \
+        sum(size for size, in sqlite3.connect(path).execute('SELECT size FROM results'))
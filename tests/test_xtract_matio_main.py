@@ -0,0 +1,258 @@
+"""Tests for running the MaterialsIO parsers on a group of files"""
+
+from functools import partial
+from types import SimpleNamespace
+import os
+import time
+
+import pytest
+
+import xtract_matio_main
+from xtract_matio_cache import ExtractionCache
+import xtract_matio_plugins
+
+
+class FakeParser:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.contexts = []
+
+    def version(self):
+        return '1.0'
+
+    def parse(self, group, context=None):
+        self.contexts.append(context)
+        if self.fail:
+            raise ValueError('Cannot parse')
+        return {'files': list(group)}
+
+
+class FakeAdapter:
+    def __init__(self, compatible=True):
+        self.compatible = compatible
+        self.contexts = []
+
+    def version(self):
+        return '1.0'
+
+    def check_compatibility(self, parser):
+        return self.compatible
+
+    def transform(self, metadata, context=None):
+        self.contexts.append(context)
+        return dict(metadata, adapted=True)
+
+
+@pytest.fixture
+def plugins(monkeypatch):
+    """Replace the installed parsers with fake ones, keyed by name"""
+    plugins = {}
+    monkeypatch.setattr(xtract_matio_main, '_get_parser_and_adapter', lambda name: plugins[name])
+    monkeypatch.setattr(xtract_matio_main, 'get_plugin_version',
+                        lambda group, name: '1.0' if name in plugins else None)
+    monkeypatch.setattr(xtract_matio_main, 'get_plugin_names', lambda group: frozenset(
+        name for name, (_, adapter) in plugins.items()
+        if group == xtract_matio_plugins.PARSER_GROUP or adapter is not None
+    ))
+    monkeypatch.setenv('CONTAINER_VERSION', 'test')
+    return plugins
+
+
+def test_run_parser(plugins):
+    plugins['good'] = FakeParser(), FakeAdapter()
+    results = xtract_matio_main._run_parser('good', ['a.txt'], {'p': 1}, {'a': 2})
+    assert [(x.group, x.parser, x.metadata) for x in results] == \
+        [(['a.txt'], 'good', {'files': ['a.txt'], 'adapted': True})]
+
+    # The parser and the adapter each get their context
+    assert plugins['good'][0].contexts == [{'p': 1}]
+    assert plugins['good'][1].contexts == [{'a': 2}]
+
+    # A parser that fails is reported, for extract_matio to give no results
+    plugins['bad'] = FakeParser(fail=True), FakeAdapter()
+    with pytest.raises(xtract_matio_main.ParserFailed):
+        xtract_matio_main._run_parser('bad', ['a.txt'])
+
+    # An adapter that is not compatible with its parser is an error
+    plugins['old'] = FakeParser(), FakeAdapter(compatible=False)
+    with pytest.raises(ValueError):
+        xtract_matio_main._run_parser('old', ['a.txt'])
+
+
+def test_extract_errors(plugins, tmp_path):
+    path = tmp_path / 'a.txt'
+    path.write_text('Some text that is long enough for any of the parsers to try it')
+    plugins['bad'] = FakeParser(fail=True), None
+    plugins['old'] = FakeParser(), FakeAdapter(compatible=False)
+
+    meta = xtract_matio_main.extract_matio([str(path)], ['bad', 'old'], sniff=False)
+    assert meta['bad'] == []
+    assert meta['old'][0]['error'] == 'Unable to execute parser on group'
+
+
+def test_extract_without_sniffing(plugins, tmp_path):
+    small = tmp_path / 'small.txt'
+    small.write_text('tiny')
+    plugins['csv'] = FakeParser(), FakeAdapter()
+
+    # Without sniffing, the output has the same shape as before sniffing was added
+    meta = xtract_matio_main.extract_matio([str(small)], ['ase', 'csv'], sniff=False)
+    assert meta['ase'] == [{'error': 'file too small to process',
+                            'extract_time': meta['ase'][0]['extract_time']}]
+    assert [x['mdata'].metadata for x in meta['csv']] == [{'files': [str(small)],
+                                                           'adapted': True}]
+    assert 'skipped_parsers' not in meta
+
+    # With sniffing, the same parsers are skipped and the reasons collected
+    meta = xtract_matio_main.extract_matio([str(small)], ['ase', 'csv'])
+    assert meta['ase'][0]['skipped'] == 'file too small to process'
+    assert meta['csv'][0]['skipped'] == 'no delimited text found'
+    assert sorted(meta['skipped_parsers']) == ['ase', 'csv']
+
+
+class FakeEntryPoint:
+    def __init__(self, name, plugin):
+        self.name = name
+        self.value = f'fake_package.{name}:Plugin'
+        self.dist = SimpleNamespace(version='1.0')
+        self.plugin = plugin
+
+    def load(self):
+        return lambda: self.plugin
+
+
+def test_cache_hit_loads_nothing(monkeypatch, tmp_path):
+    parser, adapter = FakeParser(), FakeAdapter()
+    monkeypatch.setattr(xtract_matio_plugins, '_entry_points', {
+        xtract_matio_plugins.PARSER_GROUP: {'fake': FakeEntryPoint('fake', parser)},
+        xtract_matio_plugins.ADAPTER_GROUP: {'fake': FakeEntryPoint('fake', adapter)},
+    })
+    monkeypatch.setattr(xtract_matio_plugins, '_load_times', {})
+    monkeypatch.setenv('CONTAINER_VERSION', 'test')
+    xtract_matio_main._get_parser_and_adapter.cache_clear()
+    path = tmp_path / 'a.txt'
+    path.write_text('Some text that is long enough for any of the parsers to try it')
+    cache = str(tmp_path / 'cache.db')
+
+    try:
+        meta = xtract_matio_main.extract_matio([str(path)], ['fake'], sniff=False, cache=cache)
+        assert meta['cache']['misses'] == ['fake']
+        assert (xtract_matio_plugins.PARSER_GROUP, 'fake') in xtract_matio_plugins.get_load_times()
+
+        # A new process finds the results in the cache without loading the plugins
+        xtract_matio_plugins._load_times.clear()
+        xtract_matio_main._get_parser_and_adapter.cache_clear()
+        meta = xtract_matio_main.extract_matio([str(path)], ['fake'], sniff=False, cache=cache)
+        assert meta['cache']['hits'] == ['fake'] and meta['fake'][0]['cache_hit']
+        assert xtract_matio_plugins.get_load_times() == {}
+        assert parser.contexts == [None]
+    finally:
+        xtract_matio_main._get_parser_and_adapter.cache_clear()
+
+
+def _fake_extract(paths, parsers=None, **kwargs):
+    """Stands in for extract_matio in the pool workers, acting on the name of the file"""
+    name = os.path.basename(paths[0])
+    if name.startswith('sleep'):
+        time.sleep(float(name.split('-')[1]))
+    elif name == 'raise':
+        raise ValueError('Cannot extract')
+    elif name == 'die':
+        os._exit(1)
+    return {'debug': paths, 'pid': os.getpid()}
+
+
+@pytest.fixture
+def batch(monkeypatch):
+    """Run batches with a fake extract_matio, shutting down the pools afterwards"""
+    monkeypatch.setattr(xtract_matio_main, 'extract_matio', _fake_extract)
+    yield partial(xtract_matio_main.execute_extractor_batch, workers=2, parsers=['fake'])
+    xtract_matio_main.shutdown_pools()
+
+
+def test_batch_order(batch):
+    # Results are yielded as groups finish, not in input order
+    results = list(batch([['sleep-1'], ['fast']]))
+    assert [i for i, _ in results] == [1, 0]
+    assert results[1][1]['debug'] == ['sleep-1']
+
+
+def test_batch_errors(batch):
+    groups = [['sleep-0.5'], ['raise'], ['die'], ['fast'], ['sleep-0.2']]
+    results = dict(batch(groups))
+    assert sorted(results) == [0, 1, 2, 3, 4]
+
+    # Only the groups at fault are reported as failed
+    assert results[1]['error'] == 'Unable to extract group: Cannot extract'
+    assert results[2]['error'].startswith('Worker failed on group')
+    assert all('pid' in results[i] for i in [0, 3, 4])
+
+    # The broken pool was replaced, and the next batch runs normally
+    assert 'pid' in dict(batch([['fast']]))[0]
+
+
+def test_batch_pool_reuse(batch):
+    pids = set(x['pid'] for _, x in batch([['sleep-0.1']] * 4))
+    pool, = xtract_matio_main._pools.values()
+    assert set(x['pid'] for _, x in batch([['sleep-0.1']] * 4)) <= pids
+    assert list(xtract_matio_main._pools.values()) == [pool]
+
+    # Shutting down stops the workers, and the next batch starts a new pool
+    xtract_matio_main.shutdown_pools()
+    assert xtract_matio_main._pools == {}
+    with pytest.raises(RuntimeError):
+        pool.submit(os.getpid)
+    for pid in pids:
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+    assert set(x['pid'] for _, x in batch([['fast']])).isdisjoint(pids)
+
+
+class SleepingParser(FakeParser):
+    def parse(self, group, context=None):
+        time.sleep(60)
+
+
+class GreedyParser(FakeParser):
+    def parse(self, group, context=None):
+        data = b'x' * (512 * 1024 ** 2)  # Filled, so the pages are resident
+        time.sleep(60)
+        return {'size': len(data)}
+
+
+def test_extract_limits(plugins, tmp_path):
+    path = tmp_path / 'a.txt'
+    path.write_text('Some text that is long enough for any of the parsers to try it')
+    plugins['sleepy'] = SleepingParser(), None
+    plugins['greedy'] = GreedyParser(), None
+    plugins['good'] = FakeParser(), FakeAdapter()
+
+    start = time.time()
+    meta = xtract_matio_main.extract_matio([str(path)], ['sleepy', 'greedy', 'good'],
+                                           sniff=False, timeout=2, max_rss=256 * 1024 ** 2)
+    assert time.time() - start < 10
+
+    # Parsers past a limit are killed, and the others in the group still run
+    assert [(x['error'], x['parser']) for x in meta['sleepy']] == [('timeout', 'sleepy')]
+    assert [(x['error'], x['parser']) for x in meta['greedy']] == [('oom', 'greedy')]
+    assert [x['mdata'].metadata for x in meta['good']] == [{'files': [str(path)],
+                                                            'adapted': True}]
+
+
+def test_failures_not_cached(plugins, tmp_path):
+    path = tmp_path / 'a.txt'
+    path.write_text('Some text that is long enough for any of the parsers to try it')
+    cache = ExtractionCache(str(tmp_path / 'cache.db'))
+    parser, _ = plugins['flaky'] = FakeParser(fail=True), FakeAdapter()
+
+    # A failure gives no results, and is not cached as it may be transient
+    meta = xtract_matio_main.extract_matio([str(path)], ['flaky'], sniff=False, cache=cache)
+    assert meta['flaky'] == [] and meta['cache']['misses'] == ['flaky']
+    assert cache.stats()['entries'] == 0
+
+    # So the parser runs again, and its results are cached once it succeeds
+    parser.fail = False
+    for hits in [[], ['flaky']]:
+        meta = xtract_matio_main.extract_matio([str(path)], ['flaky'], sniff=False, cache=cache)
+        assert meta['cache']['hits'] == hits and len(meta['flaky']) == 1
+    assert len(parser.contexts) == 2
@@ -0,0 +1,46 @@
+"""Tests for deciding which parsers to skip from the start of each file"""
+
+import pytest
+
+from xtract_matio_sniff import SNIFF_BYTES, sniff_group
+
+
+def _sniff(tmp_path, name, content, parsers=('csv',)):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return sniff_group([str(path)], list(parsers))
+
+
+def test_sniff_csv(tmp_path):
+    assert _sniff(tmp_path, 'plain.csv', b'a,b,c\n1,2,3\n') == {}
+    assert _sniff(tmp_path, 'tabs.tsv', b'a\tb\n1\t2\n') == {}
+
+    # Delimiters inside quoted fields are not counted
+    assert _sniff(tmp_path, 'quoted.csv', b'name,note\n"x","a, b, c"\n"y","d"\n') == {}
+
+    # The last line of a long file may be cut by the read, and is not compared
+    rows = b''.join(b'%d,"%s"\n' % (i, b'x' * (i % 7)) for i in range(SNIFF_BYTES))
+    assert _sniff(tmp_path, 'long.csv', b'id,value\n' + rows) == {}
+
+    # Prose and binary files are skipped
+    assert _sniff(tmp_path, 'prose.txt', b'Just some text.\nNothing to split.\n') == \
+        {'csv': 'no delimited text found'}
+    assert _sniff(tmp_path, 'data.bin', bytes(range(256))) == \
+        {'csv': 'no delimited text found'}
+
+
+def test_sniff_small(tmp_path):
+    assert _sniff(tmp_path, 'small.xyz', b'1\n\nH 0 0 0\n', ['ase', 'crystal']) == \
+        {'ase': 'file too small to process'}
+
+
+@pytest.mark.parametrize('name', ['OUTCAR', 'OUTCAR-1', 'OUTCAR_relax', 'outcar.gz',
+                                  'vasprun.xml', 'vasprun_relax.xml', 'CONTCAR.final',
+                                  'POSCAR-initial', 'XDATCAR'])
+def test_sniff_vasp(tmp_path, name):
+    assert _sniff(tmp_path, name, b'Some output of a calculation\n' * 4, ['dft']) == {}
+
+
+def test_sniff_not_vasp(tmp_path):
+    assert _sniff(tmp_path, 'notes.txt', b'Some notes on a calculation\n' * 4, ['dft']) == \
+        {'dft': 'no VASP or PWSCF files found'}
@@ -0,0 +1,98 @@
+"""Tests for streaming the records of CSV files to JSON Lines files"""
+
+import csv
+import json
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from xtract_matio_stream import JSONLSink, iter_csv_chunks, sink_path, stream_csv
+
+
+CSV_TEXT = 'composition,band_gap,measured\n' + ''.join(
+    f'NaCl{i},{i}.25,2020-01-{i + 1:02d}\n' for i in range(5)
+)
+
+
+class CSVParser:
+    """Reads rows with the types tableschema infers for them"""
+
+    def iter_chunks(self, path, chunk_size, context):
+        with open(path, newline='') as fp:
+            rows = [dict(row, band_gap=Decimal(row['band_gap']),
+                         measured=date.fromisoformat(row['measured']))
+                    for row in csv.DictReader(fp)]
+        for i in range(0, len(rows), chunk_size):
+            yield rows[i:i + chunk_size]
+
+
+class CSVAdapter:
+    def iter_chunks(self, chunks, mapping):
+        for chunk in chunks:
+            yield (dict((field, row[column]) for field, column in mapping.items())
+                   for row in chunk)
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / 'data.csv'
+    path.write_text(CSV_TEXT)
+    return str(path)
+
+
+def _read_lines(path):
+    with open(path) as fp:
+        return [json.loads(line) for line in fp]
+
+
+def test_iter_csv_chunks(csv_path):
+    pytest.importorskip('tableschema')
+    chunks = list(iter_csv_chunks(object(), csv_path, chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert chunks[0][1] == {'composition': 'NaCl1', 'band_gap': Decimal('1.25'),
+                            'measured': date(2020, 1, 2)}
+
+
+def test_jsonl_sink(tmp_path):
+    path = str(tmp_path / 'out.jsonl')
+    with JSONLSink(path) as sink:
+        assert sink.write([{'value': Decimal('1.25'), 'date': date(2020, 1, 2)}]) == 1
+    assert _read_lines(path) == [{'value': 1.25, 'date': '2020-01-02'}]
+
+    # Values that cannot be encoded are an error, and leave no file behind
+    with pytest.raises(TypeError):
+        with JSONLSink(path + '.bad') as sink:
+            sink.write([{'value': object()}])
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['out.jsonl']
+
+
+@pytest.mark.parametrize('parser', ['native', 'tableschema'])
+def test_stream_csv(parser, csv_path, tmp_path):
+    if parser == 'tableschema':
+        pytest.importorskip('tableschema')
+    mapping = {'material.composition': 'composition', 'band_gap': 'band_gap',
+               'date': 'measured'}
+    result = stream_csv([csv_path], str(tmp_path), CSVParser() if parser == 'native' else object(),
+                        CSVAdapter(), mapping, chunk_size=2)
+    assert result == {'sink': sink_path(str(tmp_path), [csv_path], 'csv'), 'records': 5,
+                      'chunks': 3, 'skipped': []}
+    assert _read_lines(result['sink']) == [
+        {'material.composition': f'NaCl{i}', 'band_gap': i + 0.25, 'date': f'2020-01-{i + 1:02d}'}
+        for i in range(5)
+    ]
+
+
+def test_stream_csv_mixed_group(csv_path, tmp_path):
+    binary = tmp_path / 'image.png'
+    binary.write_bytes(b'\x89PNG\r\n\x1a\n' + bytes(range(256)))
+    notes = tmp_path / 'notes.txt'
+    notes.write_text('Measured on the new instrument\nSee the lab book for details\n')
+    paths = [str(binary), csv_path, str(notes)]
+
+    # Only the delimited file is streamed, and the others are reported as skipped
+    result = stream_csv(paths, str(tmp_path), CSVParser(), CSVAdapter(),
+                        {'material.composition': 'composition'}, chunk_size=2)
+    assert result['records'] == 5 and result['chunks'] == 3
+    assert result['skipped'] == [str(binary), str(notes)]
+    assert _read_lines(result['sink'])[0] == {'material.composition': 'NaCl0'}
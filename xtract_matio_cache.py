@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+
+
+# Default bound on the total size of cached results
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+# Caches opened by this process, keyed by (pid, path) so forked workers open their own
+_caches = dict()
+
+
+class ExtractionCache:
+    """On-disk cache of extraction results, backed by SQLite.
+
+    Results are stored per parser under a key made of the identity of the files in the
+    group (path plus size, mtime and inode, or plus a hash of the contents), the parser
+    name, and the versions of the packages providing the parser and the adapter. A file
+    that changes, or a parser that is upgraded, simply misses the cache.
+
+    The cache is bounded in size: once the stored results exceed `max_bytes`, the least
+    recently used results are evicted. The total size of the results is kept as a counter
+    in the database, updated in the same transaction as each store or eviction, so that it
+    stays exact when many processes share the cache. Hits and misses are counted both for
+    this object and, cumulatively, in the database itself.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, content_hash=False):
+        """Open (or create) a cache.
+
+        Parameter:
+        path (str): Path of the SQLite database.
+        max_bytes (int): Bound on the total size of cached results.
+        content_hash (bool): Whether to identify files by a hash of their contents
+            rather than by their size, mtime and inode.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.content_hash = content_hash
+        self.hits = 0
+        self.misses = 0
+
+        # Autocommit mode, WAL so that many workers can share one database
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, '
+                           'value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS counters '
+                           '(name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    @contextmanager
+    def _transaction(self):
+        """Run statements in one write transaction, rolled back on error"""
+        # Take the write lock up front, so the total cannot change between read and write
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+
+    def group_key(self, paths):
+        """Key identifying the current state of the files in a group.
+
+        Parameter:
+        paths (list(str)): Files in the group.
+
+        Return:
+        (str): Hex digest of the file identities.
+        """
+        digest = hashlib.sha256()
+        for path in paths:
+            digest.update(os.path.abspath(path).encode())
+            if self.content_hash:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 ** 2), b''):
+                        digest.update(chunk)
+            else:
+                st = os.stat(path)
+                digest.update(f'\0{st.st_size}:{st.st_mtime_ns}:{st.st_ino}\0'.encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def result_key(group_key, parser, parser_version, adapter_version, context=None):
+        """Key of the results of one parser on a group.
+
+        Parameter:
+        group_key (str): Output of `group_key`.
+        parser (str): Name of the parser.
+        parser_version (str): Version of the package providing the parser.
+        adapter_version (str): Version of the package providing its adapter, None if it
+            has no adapter.
+        context (dict): Context given to the adapter, must be JSON-serializable.
+
+        Return:
+        (str): Cache key.
+        """
+        key = f'{group_key}:{parser}:{parser_version}:{adapter_version}'
+        if context is not None:
+            key += ':' + hashlib.sha256(json.dumps(context, sort_keys=True).encode()).hexdigest()
+        return key
+
+    def get(self, key):
+        """Get cached results, counting the hit or miss.
+
+        Parameter:
+        key (str): Output of `result_key`.
+
+        Return:
+        Cached results, None if there are none.
+        """
+        row = self._conn.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            self._count('misses')
+            return None
+        self.hits += 1
+        self._count('hits')
+        self._conn.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        """Store results, evicting old results if the cache is over its size bound.
+
+        Parameter:
+        key (str): Output of `result_key`.
+        value: Results to store, must be picklable.
+        """
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._transaction():
+            row = self._conn.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+            self._conn.execute('INSERT OR REPLACE INTO results (key, value, size, last_used) '
+                               'VALUES (?, ?, ?, ?)', (key, blob, len(blob), time.time()))
+            # A replaced result no longer counts towards the total
+            self._count('bytes', len(blob) - (0 if row is None else row[0]))
+            self._evict()
+
+    def _total_bytes(self):
+        """Total size of the cached results, from its counter"""
+        row = self._conn.execute('SELECT value FROM counters WHERE name = \'bytes\'').fetchone()
+        return 0 if row is None else row[0]
+
+    def _evict(self):
+        """Remove the least recently used results until the cache fits in max_bytes.
+
+        Must run in the transaction that changed the total.
+        """
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return
+        to_delete = []
+        freed = 0
+        for key, size in self._conn.execute('SELECT key, size FROM results ORDER BY last_used'):
+            to_delete.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        self._conn.executemany('DELETE FROM results WHERE key = ?', to_delete)
+        self._count('bytes', -freed)
+        self._count('evictions', len(to_delete))
+
+    def _count(self, name, n=1):
+        self._conn.execute('INSERT INTO counters (name, value) VALUES (?, ?) '
+                           'ON CONFLICT(name) DO UPDATE SET value = value + ?', (name, n, n))
+
+    def stats(self):
+        """Usage statistics of the cache.
+
+        Return:
+        (dict): Hits and misses of this object, cumulative counters of the database,
+            and the number and total size of the cached results.
+        """
+        entries, = self._conn.execute('SELECT COUNT(*) FROM results').fetchone()
+        totals = dict(self._conn.execute('SELECT name, value FROM counters'))
+        return {'hits': self.hits, 'misses': self.misses, 'total_hits': totals.get('hits', 0),
+                'total_misses': totals.get('misses', 0),
+                'evictions': totals.get('evictions', 0), 'entries': entries,
+                'bytes': totals.get('bytes', 0)}
+
+    def close(self):
+        self._conn.close()
+
+
+def get_cache(path, max_bytes=DEFAULT_MAX_BYTES, content_hash=False):
+    """Get the cache stored at a path, opening it once per process.
+
+    Parameter:
+    path (str): Path of the SQLite database.
+    max_bytes (int): Bound on the total size of cached results.
+    content_hash (bool): Whether to identify files by a hash of their contents.
+
+    Return:
+    (ExtractionCache): Cache for this process.
+    """
+    key = (os.getpid(), path)
+    if key not in _caches:
+        _caches[key] = ExtractionCache(path, max_bytes=max_bytes, content_hash=content_hash)
+    return _caches[key]
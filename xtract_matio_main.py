@@ -1,79 +1,378 @@
 
 import os
 import sys
+import json
 import time
+import signal
+import resource
 import argparse
-from materials_io.utils.interface import run_all_parsers_on_group, get_available_parsers
+import multiprocessing
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from xtract_matio_sniff import sniff_group
+from xtract_matio_cache import ExtractionCache, get_cache
+from xtract_matio_stream import DEFAULT_CHUNK_SIZE, stream_csv
+from xtract_matio_plugins import (PARSER_GROUP, ADAPTER_GROUP, get_plugin_names, load_plugin,
+                                  get_plugin_version, import_timed, get_load_times,
+                                  print_import_profile)
 
 
+# CSV omitted because cannot pass in anything.
+DEFAULT_PARSERS = ['crystal', 'csv', 'ase', 'dft', 'image', 'tdb']
 
-def extract_matio(paths):
 
-    # CSV omitted because cannot pass in anything. 
-    parsers=['crystal', 'csv', 'ase', 'dft', 'image', 'tdb']
+def _interface():
+    """The MaterialsIO interface module, imported on first use"""
+    return import_timed('materials_io.utils.interface')
+
+
+@lru_cache(maxsize=None)
+def _get_parser_and_adapter(name):
+    """Load a parser and the adapter that matches its name, once per process.
+
+    Only the modules of this parser and adapter are imported, found through their
+    entry points, so the cost of starting up scales with the parsers actually used.
+
+    Parameter:
+    name (str): Name of the parser.
+
+    Return:
+    (parser, adapter): Parser object and its matching adapter (None if there is none).
+    """
+    adapter = load_plugin(ADAPTER_GROUP, name) if name in get_plugin_names(ADAPTER_GROUP) \
+        else None
+    return load_plugin(PARSER_GROUP, name), adapter
+
+
+class ParserFailed(Exception):
+    """A parser or its adapter raised an error on a group"""
+    pass
+
+
+def _run_parser(par, paths, parser_context=None, adapter_context=None):
+    """Run a single parser and its matching adapter on a group.
+
+    Mirrors what `run_all_parsers_on_group(..., adapter_map="match")` does for one
+    parser, but reuses the parser and adapter objects across calls. As there, the
+    adapter must be compatible with the parser. A parser or adapter that fails on the
+    group raises ParserFailed, for which extract_matio reports no results, as
+    `run_all_parsers_on_group` does.
+
+    Parameter:
+    par (str): Name of the parser to run.
+    paths (list(str)): Files in the group.
+    parser_context (dict): Context for the parser.
+    adapter_context (dict): Context for the adapter.
+
+    Return:
+    ([ParseResult]): Results of the parser, empty if the adapter rejected the output.
+
+    Raises:
+    ValueError: If the adapter is not compatible with the parser.
+    ParserFailed: If the parser or adapter failed on the group.
+    """
+    parser, adapter = _get_parser_and_adapter(par)
+    if adapter is not None and not adapter.check_compatibility(parser):
+        raise ValueError(f'Adapter {par} is not compatible with parser {par}')
+    try:
+        metadata = parser.parse(paths, parser_context)
+        if adapter is not None:
+            metadata = adapter.transform(metadata, adapter_context)
+    except Exception as e:
+        raise ParserFailed(f'{par} failed on the group: {e!r}') from e
+    if metadata is None:
+        return []
+    return [_interface().ParseResult(paths, par, metadata)]
+
+
+# Limited parsers run in a forked child, which inherits the parsers already loaded
+_fork_context = multiprocessing.get_context('fork')
+
+
+class ParserLimitExceeded(Exception):
+    """A parser ran past its wall-clock or memory limit. The message is 'timeout' or 'oom'."""
+    pass
+
+
+def _rss_bytes(pid):
+    """Resident set size of a process, 0 if it cannot be read"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _limited_child(conn, func):
+    """Body of the child process used by _run_limited"""
+    try:
+        conn.send(('ok', func()))
+    except MemoryError:
+        conn.send(('oom', None))
+    except ParserFailed as e:
+        conn.send(('failed', str(e)))
+    except Exception as e:
+        conn.send(('error', repr(e)))
+    finally:
+        conn.close()
+
+
+def _run_limited(func, timeout=None, max_rss=None, interval=0.05):
+    """Run a function in a child process, killing it if it runs too long or uses too much memory.
+
+    Parameter:
+    func (callable): Function to run, takes no arguments.
+    timeout (float): Wall-clock limit in seconds. Default None, no limit.
+    max_rss (int): Resident memory limit in bytes. Default None, no limit.
+    interval (float): How often to check the limits, in seconds.
+
+    Return:
+    Output of func.
+
+    Raises:
+    ParserLimitExceeded: If a limit was hit.
+    ParserFailed: If func raised ParserFailed in the child.
+    RuntimeError: If func failed in the child.
+    """
+    recv_conn, send_conn = _fork_context.Pipe(duplex=False)
+    proc = _fork_context.Process(target=_limited_child, args=(send_conn, func))
+    start = time.time()
+    proc.start()
+    send_conn.close()
+    try:
+        while not recv_conn.poll(interval):
+            if timeout is not None and time.time() - start > timeout:
+                raise ParserLimitExceeded('timeout')
+            if max_rss is not None and _rss_bytes(proc.pid) > max_rss:
+                raise ParserLimitExceeded('oom')
+        try:
+            status, value = recv_conn.recv()
+        except EOFError:
+            # The child died without reporting, most likely at the hands of the OOM killer
+            proc.join()
+            if proc.exitcode == -signal.SIGKILL:
+                raise ParserLimitExceeded('oom')
+            raise RuntimeError(f'Parser process exited with code {proc.exitcode}')
+    finally:
+        if proc.is_alive():
+            proc.kill()
+        proc.join()
+        recv_conn.close()
+
+    if status == 'oom':
+        raise ParserLimitExceeded('oom')
+    elif status == 'failed':
+        raise ParserFailed(value)
+    elif status == 'error':
+        raise RuntimeError(value)
+    return value
+
+
+def _run_all_parsers_on_group(paths, par, parser_context=None, adapter_context=None):
+    """Run one parser through `run_all_parsers_on_group`, collecting its results"""
+    return list(_interface().run_all_parsers_on_group(group=paths, adapter_map="match",
+                                                      parser_context={par: parser_context},
+                                                      adapter_context={par: adapter_context},
+                                                      include_parsers=[par]))
+
+
+def _stream_csv(paths, sink, chunk_size, parser_context, adapter_context):
+    """Stream the CSV parser and adapter on a group into a JSON Lines file"""
+    parser, adapter = _get_parser_and_adapter('csv')
+    return stream_csv(paths, sink, parser, adapter, adapter_context['mapping'],
+                      parser_context=parser_context, chunk_size=chunk_size)
+
+
+def _cache_key(cache, group_key, par, context=None):
+    """Cache key for the results of a parser, None if its versions cannot be determined.
+
+    Versions are those of the packages providing the parser and adapter, read from
+    their metadata, so looking up the cache does not load any plugin.
+    """
+    parser_version = get_plugin_version(PARSER_GROUP, par)
+    if parser_version is None:
+        return None
+    adapter_version = None
+    if par in get_plugin_names(ADAPTER_GROUP):
+        adapter_version = get_plugin_version(ADAPTER_GROUP, par)
+        if adapter_version is None:
+            return None
+    return cache.result_key(group_key, par, parser_version, adapter_version, context=context)
+
+
+def extract_matio(paths, parsers=None, single_pass=True, sniff=True, timeout=None, max_rss=None,
+                  cache=None, adapter_context=None, sink=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                  parser_context=None):
     """Runs a file through MaterialsIO parsers.
 
+    In single-pass mode (the default), the group is stat'ed once and sent through every
+    requested parser in one dispatch, reusing parser and adapter objects between calls.
+    Otherwise, `run_all_parsers_on_group` is called once per parser. Either way, a
+    parser that fails on the group gives an empty list of results.
+
+    With sniffing on, the start of each file is checked first and parsers that cannot
+    match the group are skipped. Their slots hold the reason instead of results, and
+    all reasons are collected under 'skipped_parsers'. With sniffing off, every parser
+    runs, except that ase reports {'error': 'file too small to process'} for a group
+    whose last file holds 32 bytes or less.
+
+    If a timeout or memory limit is given, each parser runs in a child process that is
+    killed when it exceeds the limit. Its slot then holds {'error': 'timeout'|'oom', ...}
+    and extraction carries on with the remaining parsers.
+
+    If a cache is given, parsers whose results for the unchanged files are already
+    cached are not run at all. Their entries are marked with 'cache_hit', and the hits,
+    misses and the extraction time saved are reported under 'cache'.
+
+    If a sink directory is given and the CSV adapter has a mapping, CSV files are
+    streamed: rows are read and mapped `chunk_size` at a time and the records are
+    written to a JSON Lines file in the sink, so memory stays bounded however large
+    the file. The 'csv' slot then holds the path of that file and the number of
+    records written instead of the records themselves.
+
+    Parsers and adapters are imported the first time they are needed in a process.
+    The time spent loading them during this call is reported under 'load_times'.
+
     Parameter:
     paths (list(str): List of paths of files to parse.
+    parsers (list(str)): Names of the parsers to run. Default DEFAULT_PARSERS.
+    single_pass (bool): Whether to run all parsers in a single dispatch.
+    sniff (bool): Whether to skip parsers that cannot match the group.
+    timeout (float): Wall-clock limit for each parser, in seconds. Default None, no limit.
+    max_rss (int): Resident memory limit for each parser, in bytes. Default None, no limit.
+    cache (str or ExtractionCache): Cache of previous results, or the path to one.
+        Default None, no caching.
+    adapter_context (dict): Context for each adapter, keyed by parser name
+        (e.g., {'csv': {'mapping': {...}}}).
+    sink (str): Directory to stream the records of CSV files to. Default None, no streaming.
+    chunk_size (int): Number of CSV rows held in memory at once when streaming.
+    parser_context (dict): Context for each parser, keyed by parser name.
 
     Return:
     meta_dictionary (dict): Dictionary of all metadata extracted using
     MaterialsIO parsers.
     """
 
-    # This helps us handle the Xtract-case. 
+    # This helps us handle the Xtract-case.
     if type(paths) == str:
         paths = [paths]
+    if parsers is None:
+        parsers = DEFAULT_PARSERS
+    elif type(parsers) == str:
+        parsers = [parsers]
+    if adapter_context is None:
+        adapter_context = dict()
+    if parser_context is None:
+        parser_context = dict()
+    stream = sink is not None and 'mapping' in (adapter_context.get('csv') or {})
 
-    all_mdata = []
+    t0 = time.time()
+    loaded_before = set(get_load_times())
 
+    # Stat each file once, the sizes are shared by all parsers
     path_sizes = dict()
-    # for path in paths: 
-
-    #for parser in parsers:
-    t0 = time.time()
-    # meta_dictionary = {"matio": {}, "parser": pars}
-    
     for path in paths:
         if not os.path.isfile(path):
             return {'error': f'file {path} does not exist'}
-        
+        path_sizes[path] = os.path.getsize(path)
 
     meta_dictionary = dict()
 
     meta_dictionary['debug'] = paths
 
-    # print(get_available_parsers().keys())
+    # Look up results for unchanged files, those parsers need not run
+    cache_keys = dict()
+    cache_hits = dict()
+    if cache is not None:
+        if not isinstance(cache, ExtractionCache):
+            cache = get_cache(cache)
+        group_key = cache.group_key(paths)
+        for par in parsers:
+            if stream and par == 'csv':
+                continue  # Records are in the sink, not in the results
+            context = adapter_context.get(par)
+            if parser_context.get(par) is not None:
+                context = {'parser': parser_context[par], 'adapter': context}
+            key = _cache_key(cache, group_key, par, context)
+            if key is None:
+                continue
+            cache_keys[par] = key
+            entries = cache.get(key)
+            if entries is not None:
+                cache_hits[par] = entries
+        meta_dictionary['cache'] = {
+            'hits': [par for par in parsers if par in cache_hits],
+            'misses': [par for par in parsers if par not in cache_hits],
+            'saved_time': sum(max((e['extract_time'] for e in entries), default=0)
+                              for entries in cache_hits.values())
+        }
+    to_run = [par for par in parsers if par not in cache_hits]
 
-    # print(f"Parsers: {parsers}") 
+    skipped = dict()
+    if sniff:
+        ts = time.time()
+        if len(to_run) > 0:
+            skipped = sniff_group(paths, to_run, path_sizes)
+        meta_dictionary['skipped_parsers'] = skipped
+        meta_dictionary['sniff_time'] = time.time() - ts
 
     for par in parsers:
-        # print(f"Now executing parser...{par}")
         ta = time.time()
         gen_dump = []
-        # parser_gen = execute_parser(parser, paths) # List index error from this line.
+        if par in cache_hits:
+            meta_dictionary[par] = [dict(entry, cache_hit=True) for entry in cache_hits[par]]
+            continue
+        if par in skipped:
+            meta_dictionary[par] = [{'skipped': skipped[par], 'extract_time': time.time()-ta}]
+            continue
+        if not sniff and par == 'ase' and path_sizes[paths[-1]] <= 32:
+            # Without sniffing, small files are reported as before: judged on the last file
+            meta_dictionary[par] = [{'error': 'file too small to process',
+                                     'extract_time': time.time()-ta}]
+            continue
+
         try:
-            if par == 'ase':
-                if os.path.getsize(path) <= 32:
-                    # continue
-                    gen_dump.append({'error': 'file too small to process', 'extract_time': time.time()-ta})
-                    meta_dictionary[par] = gen_dump 
-                    #meta_dictionary['extraction_time'] = time.time() - ta
-                    continue
-
-            
-            parser_gen = run_all_parsers_on_group(group=paths, adapter_map="match", include_parsers=[par])
-            # print(parser_gen)
-            for item in parser_gen:
-                gen_dump.append({'mdata': item, 'extract_time': time.time() - ta})
-            # print(f"Item for {par}: {item}")
+            if stream and par == 'csv':
+                _get_parser_and_adapter(par)
+                run = partial(_stream_csv, paths, sink, chunk_size, parser_context.get(par),
+                              adapter_context[par])
+            elif single_pass:
+                # Load before any fork, so the child reuses the loaded parser
+                _get_parser_and_adapter(par)
+                run = partial(_run_parser, par, paths, parser_context.get(par),
+                              adapter_context.get(par))
+            else:
+                run = partial(_run_all_parsers_on_group, paths, par, parser_context.get(par),
+                              adapter_context.get(par))
+
+            if timeout is None and max_rss is None:
+                parser_gen = run()
+            else:
+                parser_gen = _run_limited(run, timeout=timeout, max_rss=max_rss)
+            if stream and par == 'csv':
+                gen_dump.append(dict(parser_gen, extract_time=time.time() - ta))
+            else:
+                for item in parser_gen:
+                    gen_dump.append({'mdata': item, 'extract_time': time.time() - ta})
+        except ParserLimitExceeded as e:
+            gen_dump = [{'error': str(e), 'parser': par, 'extract_time': time.time()-ta}]
+        except ParserFailed:
+            gen_dump = []  # No results, as from run_all_parsers_on_group, and not cached
         except Exception as e:
             gen_dump.append({'error': 'Unable to execute parser on group', 'parser': par, 'extract_time': time.time()-ta})
-        
+        else:
+            # Only successful runs are cached, errors may be transient
+            if par in cache_keys:
+                cache.put(cache_keys[par], gen_dump)
+
         meta_dictionary[par] = gen_dump
 
     t1 = time.time()
     meta_dictionary['extraction_time'] = t1-t0
+    meta_dictionary['load_times'] = dict((f'{group}:{name}', seconds) for (group, name), seconds
+                                         in get_load_times().items()
+                                         if (group, name) not in loaded_before)
 
     meta_dictionary["CONTAINER_VERSION"] = os.environ['CONTAINER_VERSION']
 
@@ -83,7 +382,7 @@ def extract_matio(paths):
     return meta_dictionary
 
 
-def execute_extractor(paths, debug=False):
+def execute_extractor(paths, debug=False, **kwargs):
 
     if not debug:
         # Need this to shush pycalphad
@@ -92,19 +391,149 @@ def execute_extractor(paths, debug=False):
 
 
 
-    mdata = extract_matio(paths)
+    mdata = extract_matio(paths, **kwargs)
     return mdata
 
 
+# Process pools kept warm between batches, keyed by (workers, parsers, debug)
+_pools = dict()
+
+
+def _init_worker(parsers, debug):
+    """Prepare a pool worker: silence stdout and import the parsers up front"""
+    if not debug:
+        sys.stdout = open('/dev/null', 'w')
+    for par in parsers:
+        try:
+            _get_parser_and_adapter(par)
+        except Exception:
+            pass  # Reported per-group by extract_matio
+
+
+def _extract_group(paths, parsers, kwargs):
+    """Run extract_matio on one group, never letting an error escape the worker"""
+    try:
+        return extract_matio(paths, parsers=parsers, **kwargs)
+    except Exception as e:
+        return {'error': f'Unable to extract group: {e}', 'debug': paths}
+
+
+def _get_pool(workers, parsers, debug):
+    """Get a warm process pool, creating it on first use"""
+    key = (workers, tuple(parsers), debug)
+    if key not in _pools:
+        _pools[key] = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                          initargs=(tuple(parsers), debug))
+    return _pools[key]
+
+
+def _discard_pool(pool):
+    """Forget a pool that broke because one of its workers died, so the next use replaces it"""
+    for key, other in list(_pools.items()):
+        if other is pool:
+            del _pools[key]
+    pool.shutdown(wait=False)
+
+
+def execute_extractor_batch(groups, workers=None, debug=False, parsers=None, **kwargs):
+    """Runs many groups through the MaterialsIO parsers using a persistent process pool.
+
+    Workers import the parsers once when the pool starts and are reused by later
+    batches. A failure in one group is reported in that group's result and does not
+    affect the others. If a worker dies, which breaks the pool, the pool is replaced and
+    the groups that had not finished are run again one at a time, so that only the group
+    that killed its worker is reported as failed.
+
+    Parameter:
+    groups (list(list(str))): Groups of files to parse.
+    workers (int): Number of worker processes. Default os.cpu_count().
+    debug (bool): Whether to leave stdout of the workers alone.
+    parsers (list(str)): Names of the parsers to run. Default DEFAULT_PARSERS.
+    kwargs: Other options passed to extract_matio (e.g., timeout, max_rss, cache).
+
+    Yield:
+    (int, dict): Index of the group in `groups` and its metadata, as each group finishes.
+    """
+    if parsers is None:
+        parsers = DEFAULT_PARSERS
+    elif type(parsers) == str:
+        parsers = [parsers]
+
+    workers = workers or os.cpu_count()
+    pool = _get_pool(workers, parsers, debug)
+    futures = dict((pool.submit(_extract_group, paths, parsers, kwargs), i)
+                   for i, paths in enumerate(groups))
+    to_retry = []
+    for future in as_completed(futures):
+        i = futures[future]
+        try:
+            yield i, future.result()
+        except BrokenProcessPool:
+            # A worker died, maybe running another group: all pending groups fail with it
+            to_retry.append(i)
+        except Exception as e:
+            yield i, {'error': f'Worker failed on group: {e}', 'debug': groups[i]}
+    if len(to_retry) == 0:
+        return
+
+    # Run the interrupted groups on their own, so only the one at fault fails again
+    _discard_pool(pool)
+    for i in sorted(to_retry):
+        pool = _get_pool(workers, parsers, debug)
+        try:
+            yield i, pool.submit(_extract_group, groups[i], parsers, kwargs).result()
+        except BrokenProcessPool as e:
+            _discard_pool(pool)
+            yield i, {'error': f'Worker failed on group: {e}', 'debug': groups[i]}
+
+
+def shutdown_pools():
+    """Shut down the process pools kept by execute_extractor_batch"""
+    while _pools:
+        _, pool = _pools.popitem()
+        pool.shutdown()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('--paths', nargs='+', help='list of files to parse',
+    parser.add_argument('--paths', nargs='+', action='append',
+                        help='list of files to parse (repeat for a batch of groups)',
                         type=str, required=True)
     parser.add_argument('--parser', type=str, required=False)
-    # print(get_available_parsers().keys())
+    parser.add_argument('--workers', type=int, required=False,
+                        help='number of worker processes for a batch of groups')
+    parser.add_argument('--timeout', type=float, required=False,
+                        help='wall-clock limit for each parser, in seconds')
+    parser.add_argument('--max-rss-mb', type=int, required=False,
+                        help='resident memory limit for each parser, in MB')
+    parser.add_argument('--cache', type=str, required=False,
+                        help='path of the SQLite cache of extraction results')
+    parser.add_argument('--csv-mapping', type=str, required=False,
+                        help='JSON map of MDF field to CSV column name')
+    parser.add_argument('--sink', type=str, required=False,
+                        help='directory to stream the records of CSV files to, as JSON Lines')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='number of CSV rows held in memory at once when streaming')
+    parser.add_argument('--profile-imports', action='store_true',
+                        help='report the time spent loading each parser to stderr')
     args = parser.parse_args()
-    meta = execute_extractor(args.paths, debug=False)
+    options = {'timeout': args.timeout, 'cache': args.cache,
+               'max_rss': args.max_rss_mb * 1024 ** 2 if args.max_rss_mb else None,
+               'sink': args.sink, 'chunk_size': args.chunk_size}
+    if args.csv_mapping:
+        options['adapter_context'] = {'csv': {'mapping': json.loads(args.csv_mapping)}}
+
+    if len(args.paths) == 1:
+        meta = execute_extractor(args.paths[0], debug=False, parsers=args.parser, **options)
+    else:
+        # Batches go through the warm worker pool
+        meta = dict(execute_extractor_batch(args.paths, workers=args.workers,
+                                            parsers=args.parser, **options))
+        meta = [meta[i] for i in range(len(args.paths))]
+        shutdown_pools()
 
     # sys.stdout = t
 
     print(meta)
+    if args.profile_imports:
+        print_import_profile()
@@ -0,0 +1,119 @@
+import sys
+import time
+from importlib import import_module
+from importlib.metadata import PackageNotFoundError, entry_points, version
+
+
+PARSER_GROUP = 'materialsio.parser'
+ADAPTER_GROUP = 'materialsio.adapter'
+
+# Seconds spent importing and creating each plugin, keyed by (group, name)
+_load_times = dict()
+
+
+def _find_entry_points(group):
+    """Entry points of a group, keyed by name. Reads package metadata only, imports nothing."""
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        eps = eps.select(group=group)
+    else:
+        eps = eps.get(group, [])
+    return dict((ep.name, ep) for ep in eps)
+
+
+# Read once per process, plugins themselves are only imported by load_plugin
+_entry_points = dict()
+
+
+def get_plugin_names(group):
+    """Names of the installed plugins of a group, without importing any of them.
+
+    Parameter:
+    group (str): Entry point group, PARSER_GROUP or ADAPTER_GROUP.
+
+    Return:
+    (frozenset(str)): Names of the plugins.
+    """
+    if group not in _entry_points:
+        _entry_points[group] = _find_entry_points(group)
+    return frozenset(_entry_points[group])
+
+
+def get_plugin_version(group, name):
+    """Version of the package that provides a plugin, without importing the plugin.
+
+    Parameter:
+    group (str): Entry point group, PARSER_GROUP or ADAPTER_GROUP.
+    name (str): Name of the plugin.
+
+    Return:
+    (str): Version of the distribution holding the entry point, None if the plugin is
+        not installed or its version cannot be determined.
+    """
+    if name not in get_plugin_names(group):
+        return None
+    ep = _entry_points[group][name]
+    dist = getattr(ep, 'dist', None)
+    if dist is not None:
+        return dist.version
+    # Entry points only know their distribution from Python 3.10 on
+    try:
+        return version(ep.value.split(':')[0].split('.')[0])
+    except PackageNotFoundError:
+        return None
+
+
+def load_plugin(group, name):
+    """Import a single plugin by name and create it, recording how long that took.
+
+    Only the module holding the plugin (and whatever it imports) is loaded, so a
+    process that only runs the image parser never imports pymatgen or pycalphad.
+
+    Parameter:
+    group (str): Entry point group, PARSER_GROUP or ADAPTER_GROUP.
+    name (str): Name of the plugin.
+
+    Return:
+    Instance of the plugin.
+
+    Raises:
+    KeyError: If no plugin of that name is installed.
+    """
+    if name not in get_plugin_names(group):
+        raise KeyError(f'No {group} plugin named {name}')
+    start = time.perf_counter()
+    plugin = _entry_points[group][name].load()()
+    _load_times[(group, name)] = time.perf_counter() - start
+    return plugin
+
+
+def import_timed(module):
+    """Import a module, recording how long that took under the ('module', name) key"""
+    start = time.perf_counter()
+    loaded = import_module(module)
+    _load_times.setdefault(('module', module), time.perf_counter() - start)
+    return loaded
+
+
+def get_load_times():
+    """Seconds spent loading each plugin so far in this process.
+
+    Return:
+    (dict): Load time keyed by (group, name), slowest first.
+    """
+    return dict(sorted(_load_times.items(), key=lambda x: x[1], reverse=True))
+
+
+def print_import_profile(file=sys.stderr):
+    """Print the time spent loading each plugin, and the modules loaded so far.
+
+    Parameter:
+    file: Where to write the report. Default stderr, so it does not mix with the metadata.
+    """
+    times = get_load_times()
+    print(f'Plugin load times ({sum(times.values()):.3f} s total):', file=file)
+    for (group, name), seconds in times.items():
+        print(f'  {seconds:8.3f} s  {group}:{name}', file=file)
+    top_level = sorted(set(m.split('.')[0] for m in sys.modules if not m.startswith('_')))
+    print(f'{len(sys.modules)} modules loaded, from {len(top_level)} packages:', file=file)
+    print('  ' + ' '.join(top_level), file=file)
@@ -0,0 +1,143 @@
+import io
+import os
+import re
+import csv
+
+
+# Only this many bytes are read from the start of each file
+SNIFF_BYTES = 4096
+
+_IMAGE_MAGIC = (b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff', b'GIF87a', b'GIF89a',
+                b'II*\x00', b'MM\x00*', b'BM')
+
+# Names of VASP files start with these, often followed by a suffix (OUTCAR-1, vasprun_relax.xml)
+_VASP_PREFIXES = ('INCAR', 'OUTCAR', 'POSCAR', 'CONTCAR', 'OSZICAR', 'KPOINTS', 'POTCAR',
+                  'DOSCAR', 'EIGENVAL', 'CHGCAR', 'XDATCAR', 'IBZKPT', 'PROCAR', 'LOCPOT',
+                  'WAVECAR', 'VASPRUN')
+
+_PWSCF_MARKERS = (b'Program PWSCF', b'Quantum ESPRESSO')
+
+_TDB_KEYWORDS = re.compile(rb'^\s*(ELEMENT|PHASE|PARAMETER|FUNCTION|TYPE_DEFINITION|'
+                           rb'CONSTITUENT)\s', re.IGNORECASE | re.MULTILINE)
+
+_CSV_DELIMITERS = ',\t;|'
+
+
+def read_head(path, size=SNIFF_BYTES):
+    """Read the first bytes of a file.
+
+    Parameter:
+    path (str): Path of the file.
+    size (int): Number of bytes to read.
+
+    Return:
+    (bytes): Start of the file, empty if it cannot be read.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read(size)
+    except OSError:
+        return b''
+
+
+def _is_image(head):
+    return head.startswith(_IMAGE_MAGIC)
+
+
+def _is_text(head):
+    return len(head) > 0 and b'\x00' not in head
+
+
+def _is_vasp(path):
+    return os.path.basename(path).upper().startswith(_VASP_PREFIXES)
+
+
+def _is_pwscf(head):
+    return any(marker in head for marker in _PWSCF_MARKERS)
+
+
+def _is_tdb(path, head):
+    return path.lower().endswith('.tdb') or _TDB_KEYWORDS.search(head) is not None
+
+
+def _is_delimited(head, truncated=False):
+    """Whether a text file starts with rows of delimited fields.
+
+    The dialect is sniffed by the csv module, so delimiters inside quoted fields are
+    not counted, and the first two rows must then have the same number of fields.
+
+    Parameter:
+    head (bytes): Start of the file.
+    truncated (bool): Whether the file continues past the head, whose last line may
+        then have been cut by the read.
+    """
+    if not _is_text(head):
+        return False
+    text = head.decode('utf-8', errors='replace')
+    if truncated and '\n' in text.rstrip('\r\n'):
+        text = text[:text.rstrip('\r\n').rfind('\n')]
+    try:
+        dialect = csv.Sniffer().sniff(text, delimiters=_CSV_DELIMITERS)
+        rows = [row for row in csv.reader(io.StringIO(text), dialect) if row][:2]
+    except csv.Error:
+        return False
+    widths = set(len(row) for row in rows)
+    return len(widths) == 1 and widths.pop() > 1
+
+
+def is_delimited_file(path):
+    """Whether a file starts with rows of delimited fields, as the CSV parser reads.
+
+    Parameter:
+    path (str): Path of the file.
+
+    Return:
+    (bool): Whether the start of the file is delimited text.
+    """
+    head = read_head(path)
+    try:
+        return _is_delimited(head, os.path.getsize(path) > len(head))
+    except OSError:
+        return False
+
+
+def sniff_group(paths, parsers, sizes=None):
+    """Decide which parsers cannot match a group, using only the start of each file.
+
+    The checks are deliberately permissive: a parser is only skipped when nothing in
+    the group looks like a file it can read. Parsers without a rule are never skipped.
+
+    Parameter:
+    paths (list(str)): Files in the group.
+    parsers (list(str)): Names of the parsers to consider.
+    sizes (dict): Size of each file, if already known.
+
+    Return:
+    (dict): Reason each skipped parser was skipped, keyed by parser name.
+    """
+    if sizes is None:
+        sizes = dict((path, os.path.getsize(path)) for path in paths)
+    heads = dict((path, read_head(path)) for path in paths)
+    all_images = all(_is_image(head) for head in heads.values())
+
+    skipped = dict()
+    for par in parsers:
+        if par == 'image':
+            if not any(_is_image(head) for head in heads.values()):
+                skipped[par] = 'no image header found'
+        elif par == 'tdb':
+            if not any(_is_tdb(path, head) for path, head in heads.items()):
+                skipped[par] = 'no TDB keywords found'
+        elif par == 'csv':
+            if not any(_is_delimited(head, sizes[path] > len(head))
+                       for path, head in heads.items()):
+                skipped[par] = 'no delimited text found'
+        elif par == 'dft':
+            if not any(_is_vasp(path) or _is_pwscf(head) for path, head in heads.items()):
+                skipped[par] = 'no VASP or PWSCF files found'
+        elif par in ('ase', 'crystal'):
+            if par == 'ase' and all(size <= 32 for size in sizes.values()):
+                skipped[par] = 'file too small to process'
+            elif all_images:
+                skipped[par] = 'only image files'
+    return skipped
@@ -0,0 +1,153 @@
+import os
+import json
+import hashlib
+import tempfile
+from decimal import Decimal
+from datetime import date, time
+from itertools import islice
+
+from xtract_matio_sniff import is_delimited_file
+
+
+# Rows of a CSV file held in memory at once when streaming
+DEFAULT_CHUNK_SIZE = 10000
+
+
+def iter_csv_chunks(parser, path, chunk_size=DEFAULT_CHUNK_SIZE, context=None):
+    """Read the rows of a CSV file in chunks.
+
+    Parsers that stream natively provide `iter_chunks(path, chunk_size, context)`.
+    For the others, the file is read with tableschema, inferring the types of the
+    columns from the first rows as the MaterialsIO CSV parser does.
+
+    Parameter:
+    parser: CSV parser object.
+    path (str): Path of the file.
+    chunk_size (int): Number of rows per chunk.
+    context (dict): Parser context, may hold a 'schema' and an 'infer_limit'.
+
+    Yield:
+    (list(dict)): Rows of each chunk, keyed by column name.
+    """
+    if context is None:
+        context = {}
+    if hasattr(parser, 'iter_chunks'):
+        yield from parser.iter_chunks(path, chunk_size, context)
+        return
+
+    from tableschema import Table
+    table = Table(path, schema=context.get('schema'))
+    if context.get('schema') is None:
+        table.infer(limit=context.get('infer_limit', 1000))
+    rows = table.iter(keyed=True)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _json_default(value):
+    """Encode the values read by tableschema that JSON has no type for.
+
+    Numbers become floats and dates, datetimes and times their ISO format, as in the
+    records of the CSV files that are not streamed.
+    """
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class JSONLSink:
+    """Write records to a JSON Lines file, one record per line, as they are produced.
+
+    Records go to a temporary file in the same directory, which is renamed into
+    place when the sink is closed without error. Readers never see a partial file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        fd, self._tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                              suffix='.jsonl.tmp')
+        self._file = os.fdopen(fd, 'w')
+
+    def write(self, records):
+        """Write records to the file.
+
+        Parameter:
+        records (iterable(dict)): Records to write.
+
+        Return:
+        (int): Number of records written.
+        """
+        n = 0
+        for record in records:
+            self._file.write(json.dumps(record, default=_json_default))
+            self._file.write('\n')
+            n += 1
+        self.records += n
+        return n
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._file.close()
+        if exc_type is None:
+            os.replace(self._tmp_path, self.path)
+        else:
+            os.unlink(self._tmp_path)
+
+
+def sink_path(sink_dir, paths, par):
+    """Path of the file holding the records of a parser on a group.
+
+    Parameter:
+    sink_dir (str): Directory of the JSON Lines files.
+    paths (list(str)): Files in the group.
+    par (str): Name of the parser.
+
+    Return:
+    (str): Path of the file, named by the parser and a digest of the group.
+    """
+    digest = hashlib.sha1('\0'.join(os.path.abspath(p) for p in paths).encode()).hexdigest()
+    return os.path.join(sink_dir, f'{par}-{digest[:16]}.jsonl')
+
+
+def stream_csv(paths, sink_dir, parser, adapter, mapping, parser_context=None,
+               chunk_size=DEFAULT_CHUNK_SIZE):
+    """Map the rows of CSV files chunk by chunk, writing the records to a JSON Lines file.
+
+    Only one chunk of rows is in memory at a time, however large the files are.
+    Files of the group that do not start with delimited text, such as binary files,
+    are skipped rather than failing the whole group.
+
+    Parameter:
+    paths (list(str)): CSV files in the group.
+    sink_dir (str): Directory of the JSON Lines files.
+    parser: CSV parser object.
+    adapter: CSV adapter object, providing `iter_chunks(chunks, mapping)`.
+    mapping (dict): Map of MDF field to column name.
+    parser_context (dict): Context for the parser.
+    chunk_size (int): Number of rows per chunk.
+
+    Return:
+    (dict): Path of the file ('sink'), numbers of records and chunks written, and the
+        files skipped.
+    """
+    path = sink_path(sink_dir, paths, 'csv')
+    chunks = 0
+    skipped = []
+    with JSONLSink(path) as sink:
+        for csv_path in paths:
+            if not is_delimited_file(csv_path):
+                skipped.append(csv_path)
+                continue
+            rows = iter_csv_chunks(parser, csv_path, chunk_size, parser_context)
+            for records in adapter.iter_chunks(rows, mapping):
+                sink.write(records)
+                chunks += 1
+    return {'sink': path, 'records': sink.records, 'chunks': chunks, 'skipped': skipped}